@@ -0,0 +1,184 @@
+import http.server
+import json
+import os
+import shutil
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+
+from src.utils.resources import SharedResources
+from src.utils.docker_engine_client import DockerEngineClient, DockerEngineError
+from src.utils.docker_utilities import DockerMetadataCache
+
+IMAGE_NAME = 'dbouget/raidionics-rads:v1.1'
+
+
+class StubDockerHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers the few Docker Engine API endpoints used by the plugin, with canned content.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, content):
+        payload = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.path == '/_ping':
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'OK')
+        elif self.path.startswith('/v1.41/images/') and self.path.endswith('/json'):
+            if IMAGE_NAME.replace('/', '%2F').replace(':', '%3A') in self.path:
+                self.send_json(200, {'Id': 'sha256:0123', 'RepoDigests': ['dbouget/raidionics-rads@sha256:4567']})
+            else:
+                self.send_json(404, {'message': 'No such image'})
+        elif self.path.startswith('/v1.41/containers/stub/logs'):
+            # Multiplexed stream, a line split across two frames.
+            self.send_response(200)
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for stream, content in [(1, b'LOG:Segmentation - 10%\nLOG:Segm'), (2, b'entation - 50%\n'),
+                                    (1, b'done')]:
+                self.wfile.write(struct.pack('>BxxxL', stream, len(content)) + content)
+            self.close_connection = True
+        else:
+            self.send_json(404, {'message': 'page not found'})
+
+    def do_POST(self):
+        self.server.requests.append(('POST', self.path))
+        if self.path.startswith('/v1.41/images/create'):
+            # Progress events streamed with a chunked transfer, as the daemon does.
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            events = [{'status': 'Pulling from dbouget/raidionics-rads', 'id': 'v1.1'},
+                      {'status': 'Downloading', 'id': 'a1', 'progressDetail': {'current': 5, 'total': 10}},
+                      {'status': 'Download complete', 'id': 'a1'}]
+            for event in events:
+                content = json.dumps(event).encode('utf-8') + b'\r\n'
+                self.wfile.write('{:x}\r\n'.format(len(content)).encode('ascii') + content + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        elif self.path.startswith('/v1.41/containers/stub/wait'):
+            self.send_json(200, {'StatusCode': 3, 'Error': None})
+        else:
+            self.send_json(404, {'message': 'page not found'})
+
+
+class StubDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, StubDockerHandler)
+        self.requests = []
+
+
+class DockerEngineClientTest(unittest.TestCase):
+    """
+    Drives the Docker Engine API client against a local stand-in socket server, no Docker daemon being needed.
+    """
+    def setUp(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('Unix sockets not supported on this platform.')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'docker.sock')
+        self.server = StubDockerServer(self.socket_path)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = DockerEngineClient(socket_path=self.socket_path, timeout=5.)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_ping(self):
+        self.assertTrue(DockerEngineClient.is_supported(self.socket_path))
+        self.assertTrue(self.client.ping())
+        self.assertFalse(DockerEngineClient(socket_path=os.path.join(self.tmp_dir, 'missing.sock')).ping())
+
+    def test_inspect_image(self):
+        self.assertEqual(self.client.inspect_image(IMAGE_NAME)['RepoDigests'],
+                         ['dbouget/raidionics-rads@sha256:4567'])
+        self.assertIsNone(self.client.inspect_image('dbouget/raidionics-rads:missing'))
+        self.assertIsNotNone(self.client.inspect_image(IMAGE_NAME))
+        self.assertEqual(len([r for r in self.server.requests if r[1].startswith('/v1.41/images/')]), 3)
+
+    def test_pull_progress(self):
+        events = []
+        self.assertTrue(self.client.pull_image(IMAGE_NAME, progress_callback=events.append))
+        self.assertEqual([e['status'] for e in events], ['Pulling from dbouget/raidionics-rads', 'Downloading',
+                                                         'Download complete'])
+        self.assertEqual(events[1]['progressDetail'], {'current': 5, 'total': 10})
+        self.assertIn(('POST', '/v1.41/images/create?fromImage=dbouget%2Fraidionics-rads&tag=v1.1'),
+                      self.server.requests)
+
+    def test_logs(self):
+        lines = []
+        self.client.container_logs('stub', lines.append)
+        self.assertEqual(lines, ['LOG:Segmentation - 10%\n', 'LOG:Segmentation - 50%\n', 'done'])
+
+    def test_wait(self):
+        self.assertEqual(self.client.wait_container('stub')['StatusCode'], 3)
+        with self.assertRaises(DockerEngineError) as context:
+            self.client.wait_container('missing')
+        self.assertEqual(context.exception.status, 404)
+
+    def use_stale_socket(self, script: str) -> None:
+        """
+        Leaves the socket without any daemon listening, with a stand-in Docker command line running the script.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.socket_path)
+        stale_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale_socket.bind(self.socket_path)
+        self.addCleanup(stale_socket.close)
+        docker_path = os.path.join(self.tmp_dir, 'docker')
+        with open(docker_path, 'w') as f:
+            f.write('#!/bin/sh\n' + script)
+        os.chmod(docker_path, os.stat(docker_path).st_mode | stat.S_IEXEC)
+        resources = SharedResources.getInstance()
+        resources.use_docker_engine_api = True
+        resources.docker_socket_path = self.socket_path
+        resources.docker_path = docker_path
+        DockerMetadataCache.getInstance().invalidate()
+
+    def test_image_exists_fallback(self):
+        self.use_stale_socket('echo "Error: No such image: $4" >&2\nexit 1\n')
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(DockerMetadataCache.getInstance().image_exists(IMAGE_NAME))
+
+    def test_daemon_status_fallback(self):
+        self.use_stale_socket('echo "CONTAINER ID   IMAGE"\n')
+        with self.assertLogs(level='WARNING'):
+            self.assertTrue(DockerMetadataCache.getInstance().is_daemon_running())
+
+    def test_pull_fallback(self):
+        self.use_stale_socket('echo "v1.1: Pulling from dbouget/raidionics-rads"\necho "Status: Downloaded"\n')
+        events = []
+        with self.assertLogs(level='WARNING'):
+            self.assertTrue(DockerMetadataCache.getInstance().pull_image(IMAGE_NAME, progress_callback=events.append))
+        self.assertEqual([e['status'] for e in events], ['v1.1: Pulling from dbouget/raidionics-rads',
+                                                         'Status: Downloaded'])
+
+
+if __name__ == '__main__':
+    unittest.main()
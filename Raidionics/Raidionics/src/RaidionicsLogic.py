@@ -4,30 +4,40 @@ from slicer.ScriptedLoadableModule import *
 import logging
 import sys
 
-if sys.version_info.major == 3:
-    from queue import Queue
-else:
-    from Queue import Queue
-
 import json
 import platform
 import os
 import numpy
 import re
-import subprocess
 import shutil
 import threading
+import time
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
 from glob import glob
-from time import sleep
 from copy import deepcopy
 from __main__ import qt, ctk, slicer, vtk
 
 import SimpleITK as sitk
 import sitkUtils
 from src.utils.resources import SharedResources
-from src.utils.backend_utilities import generate_backend_config, postop_model_selection
+from src.utils.backend_utilities import generate_backend_config, postop_model_selection, get_backend_input_filename, \
+    get_pipeline_segmentation_steps, remove_pipeline_steps, is_atlas_output_selected
+from src.utils.backend_execution import run_backend
+from src.utils.docker_utilities import DockerMetadataCache
+from src.utils.progress_utilities import ProgressTracker
+from src.utils.workspace_utilities import RunWorkspace, collect_workspaces_async, get_scratch_runs_path
+from src.utils.result_cache import ResultCache, image_fingerprint, array_fingerprint, file_fingerprint, \
+    get_cloud_checksum, get_local_model_fingerprint
+from src.utils.staging_cache import StagingCache, sampled_fingerprint
+from src.utils.roi_utilities import mask_ras_bounds, compute_crop, crop_size, crop_array, paste_crop
+from src.utils.output_watcher import OutputWatcher, scan_output_files, file_signature
+from src.utils.probability_store import ProbabilityStore
+from src.utils.nifti_writer import write_nifti, geometry_from_ijk_to_ras, is_supported as is_direct_export_supported
+from src.utils.artifact_registry import SegmentationArtifactRegistry
+from src.utils.volume_codecs import get_transfer_extension, write_volume, read_volume, narrow_array, narrow_image
+from src.logic.main_thread_dispatcher import MainThreadDispatcher
 
 
 class RaidionicsLogic:
@@ -55,22 +65,21 @@ class RaidionicsLogic:
         self.abort = False
         self.dockerPath = SharedResources.getInstance().docker_path
         self.file_extension_docker = '.nii.gz'
+        self.transfer_format = 'nii.gz'
         self.logic_task = 'segmentation'  # segmentation or reporting (RADS) for now
         self.logic_target_space = "neuro_diagnosis"
-
-    def yieldPythonGIL(self, seconds=0):
-        sleep(seconds)
+        self.main_queue = MainThreadDispatcher()
+        self.thread = threading.Thread()
+        self.output_raw_values = ProbabilityStore()
+        self.progress_tracker = None
+        self.workspace = None
 
     def start_logic(self):
-        self.main_queue = Queue()
-        self.main_queue_running = False
-        self.thread = threading.Thread()
         self.cmdStartLogic()
 
     def stop_logic(self):
-        if self.main_queue_running:
-            self.main_queue_stop()
-        if self.thread.is_alive():
+        self.main_queue_stop()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
             self.thread.join()
         self.cmdStopLogic()
 
@@ -78,91 +87,158 @@ class RaidionicsLogic:
         """
         Begins monitoring of main_queue for callables
         """
-        self.main_queue_running = True
-        # slicer.modules.RaidionicsWidget.onLogicRunStart()
-        qt.QTimer.singleShot(0, self.main_queue_process)
+        self.main_queue.start()
 
     def main_queue_stop(self):
         """
-        End monitoring of main_queue for callables
+        End monitoring of main_queue for callables. Callables already posted are still delivered.
         """
-        self.main_queue_running = False
-        if self.thread.is_alive():
-            self.thread.join()
-        # slicer.modules.RaidionicsWidget.onLogicRunStop()
+        self.main_queue.stop()
 
-    def main_queue_process(self):
+    def run_on_main_thread(self, f):
         """
-        processes the main_queue of callables
+        Executes the callable f on the GUI thread: directly if already there, otherwise it is pushed to the
+        main_queue and picked up by the GUI thread. Every MRML scene or widget update from the processing thread
+        must go through this method.
         """
-        try:
-            while not self.main_queue.empty():
-                f = self.main_queue.get_nowait()
-                if callable(f):
-                    f()
-
-            if self.main_queue_running:
-                # Yield the GIL to allow other thread to do some python work.
-                # This is needed since pyQt doesn't yield the python GIL
-                self.yieldPythonGIL(.01)
-                qt.QTimer.singleShot(0, self.main_queue_process)
-
-        except Exception as e:
-            import sys
-            sys.stderr.write("ModelLogic error in main_queue: \"{0}\"".format(e))
-
-            # if there was an error try to resume
-            if not self.main_queue.empty() or self.main_queue_running:
-                qt.QTimer.singleShot(0, self.main_queue_process)
+        if threading.current_thread() is threading.main_thread():
+            f()
+        else:
+            self.main_queue.post(f)
 
     def run(self, model_parameters):
         """
-        Run the actual algorithm
+        Run the actual algorithm.
+        The preparation of the output nodes is performed on the GUI thread, then the input staging, the backend
+        execution and the decoding of the results happen in a separate thread. Only the final update of the output
+        nodes is marshalled back to the GUI thread.
         """
-        self.cmdLogEvent('Starting the task.')
-        self.start_logic()
         if self.thread.is_alive():
             import sys
             sys.stderr.write("ModelLogic is already executing!")
             return
+        self.cmdLogEvent('Starting the task.')
         self.abort = False
-        self.thread = threading.Thread(target=self.thread_doit(model_parameters=model_parameters))
-        # self.stop_logic()  # stop_logic also performed in the thread_doit, which spot is the best to run it?
-
-    def cancel_run(self):
-        self.abort = True
+        self.output_raw_values.clear()
+        self.start_logic()
 
-    def thread_doit(self, model_parameters):
         iodict = model_parameters.iodict
         inputs = model_parameters.inputs
-        params = model_parameters.params
         outputs = model_parameters.outputs
-        dockerName = model_parameters.dockerImageName
-        modelName = model_parameters.modelName
-        modelTarget = model_parameters.modelTarget
-        dataPath = model_parameters.dataPath
         widgets = model_parameters.widgets
-        # The Docker image existence should have been checked when the model was selected.
-        go_flag = self.check_docker_image_local_existence(docker_image_name=dockerName)
-        if not go_flag:
-            self.cmdLogEvent('The docker image does not exist, or could not be downloaded locally.\n'
-                             'The selected model cannot be run.')
+        self.logic_target_space = "neuro_diagnosis" if model_parameters.modelTarget == "Neuro" else "mediastinum_diagnosis"
+        try:
+            input_addresses = self.prepare_inputs(iodict, inputs)
+            input_arrays = self.prepare_input_arrays(iodict, inputs) if input_addresses is not None else {}
+            inputs_size = self.estimate_inputs_size(iodict, inputs)
+            manual_addresses = self.prepare_outputs(iodict, outputs, widgets)
+            roi_crops = self.prepare_roi_crops(iodict, inputs, outputs, manual_addresses) \
+                if input_addresses is not None else {}
+        except Exception:
+            logging.error("Error during inputs preparation before Docker call.")
+            logging.error(traceback.format_exc())
+            self.stop_logic()
+            return
+        if input_addresses is None:
+            self.stop_logic()
             return
 
-        try:
-            self.main_queue_start()
-            self.logic_target_space = "neuro_diagnosis" if modelTarget == "Neuro" else "mediastinum_diagnosis"
+        self.main_queue_start()
+        run_parameters = {'docker_image_name': model_parameters.dockerImageName,
+                          'model_name': model_parameters.modelName,
+                          'cloud_name': getattr(model_parameters, 'json_dict', {}).get('name'),
+                          'iodict': iodict, 'outputs': dict(outputs),
+                          'widgets': widgets, 'input_addresses': input_addresses, 'input_arrays': input_arrays,
+                          'manual_addresses': manual_addresses, 'inputs_size': inputs_size, 'roi_crops': roi_crops}
+        self.thread = threading.Thread(target=self.thread_doit, kwargs=run_parameters)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel_run(self):
+        self.abort = True
 
-            self.executeDocker(dockerName, modelName, dataPath, iodict, inputs, outputs, params, widgets)
+    def thread_doit(self, docker_image_name, model_name, cloud_name, iodict, outputs, widgets, input_addresses,
+                    manual_addresses, input_arrays=None, inputs_size=0, roi_crops=None):
+        """
+        Processing thread, must not access the MRML scene nor any widget directly.
+        """
+        try:
+            # The Docker image existence should have been checked when the model was selected.
+            execution_mode = SharedResources.getInstance().backend_execution_mode
+            go_flag = execution_mode != 'docker' or \
+                self.check_docker_image_local_existence(docker_image_name=docker_image_name)
+            if not go_flag:
+                self.cmdLogEvent('The docker image does not exist, or could not be downloaded locally.\n'
+                                 'The selected model cannot be run.')
+                self.run_on_main_thread(self.stop_logic)
+                return
+
+            self.transfer_format = 'nii' if execution_mode == 'in_process' else \
+                SharedResources.getInstance().transfer_format
+            # Staged inputs and outputs (probability maps in float32) estimated to a few times the raw inputs.
+            estimated_size = 4 * inputs_size
+            if execution_mode == 'in_process':
+                # The volumes are exchanged uncompressed, through memory whenever possible.
+                location = 'memory' if SharedResources.getInstance().scratch_location == 'default' else None
+                workspace = RunWorkspace.create(get_scratch_runs_path(location, estimated_size))
+                self.file_extension_docker = get_transfer_extension('nii')
+            else:
+                workspace = RunWorkspace.create(get_scratch_runs_path(estimated_size=estimated_size))
+                self.file_extension_docker = get_transfer_extension()
+            self.workspace = workspace
+            self.cmdLogEvent('Run ID: {} (performance profile: {})'.format(
+                workspace.run_id, SharedResources.getInstance().performance_profile))
+            if workspace.scratch:
+                self.cmdLogEvent('Workspace staged in {}.'.format(workspace.runs_path))
+            input_fingerprints = self.stage_inputs(workspace, iodict, model_name, input_addresses, manual_addresses,
+                                                   input_arrays, roi_crops)
+            cache_key = None
+            streamed = None
+            if SharedResources.getInstance().use_result_cache:
+                cache_key = ResultCache.compute_key(input_fingerprints, model_name, get_cloud_checksum(cloud_name),
+                                                    workspace.config_filename, workspace.container_path,
+                                                    get_local_model_fingerprint(model_name, self.logic_task, iodict),
+                                                    docker_image_name)
+            if cache_key is not None and ResultCache.getInstance().restore(cache_key, workspace.output_path):
+                self.cmdLogEvent('Results found in cache, skipping the processing.')
+            else:
+                self.progress_tracker = ProgressTracker(model_name,
+                                                        SharedResources.getInstance().performance_profile)
+                watcher = None
+                if SharedResources.getInstance().use_output_streaming:
+                    watcher = OutputWatcher(workspace.output_path,
+                                            lambda created: self.locate_outputs(workspace, iodict, created,
+                                                                                quiet=True)[0],
+                                            lambda item, filename: self.stream_output(iodict, outputs, item, filename,
+                                                                                      roi_crops))
+                    watcher.start()
+                try:
+                    success = self.executeDocker(docker_image_name, workspace)
+                finally:
+                    streamed = watcher.stop() if watcher is not None else None
+                self.progress_tracker.finish(success=success and not self.abort)
+                if success and cache_key is not None:
+                    ResultCache.getInstance().store(cache_key, workspace.output_path, description=model_name)
             if not self.abort:
-                self.updateOutput(iodict, outputs, widgets)
-                # self.main_queue_stop()
-                self.stop_logic()
-                # self.cmdEndEvent()
+                results = self.collect_outputs(workspace, iodict, streamed)
+                self.run_on_main_thread(lambda: self.updateOutput(iodict, outputs, widgets, results, roi_crops))
+                self.run_on_main_thread(self.stop_logic)
+                if self.logic_task == 'segmentation':
+                    # Only needed by a later RADS pipeline run, the results are displayed first.
+                    threading.Thread(target=self.register_segmentation_artifacts,
+                                     args=(iodict, model_name, dict(input_fingerprints), results),
+                                     daemon=True).start()
             else:
-                self.cmdAbortEvent()
+                self.run_on_main_thread(self.cmdAbortEvent)
+                self.run_on_main_thread(self.stop_logic)
+            # Queued after the results display, which still reads files from the workspace (e.g., fiducials).
+            self.run_on_main_thread(lambda: self.release_workspace(workspace))
         except Exception as e:
-            self.cmdAbortEvent()
+            logging.error("Processing thread failed:\n{}".format(traceback.format_exc()))
+            if self.workspace is not None:
+                self.workspace.release()
+            self.run_on_main_thread(self.cmdAbortEvent)
+            self.run_on_main_thread(self.stop_logic)
         '''
         except Exception as e:
             msg = e.message
@@ -173,6 +249,20 @@ class RaidionicsLogic:
             self.yieldPythonGIL()
         '''
 
+    def release_workspace(self, workspace) -> None:
+        """
+        Marks the run workspace as inactive and collects the old ones, once its outputs have been pushed to the scene.
+        """
+        workspace.release()
+        collect_workspaces_async(runs_path=workspace.runs_path)
+
+    @property
+    def results_path(self) -> str:
+        """
+        Output folder of the last run workspace, where the results are to be read from (None if nothing was run yet).
+        """
+        return self.workspace.output_path if self.workspace is not None else None
+
     def cmdStartLogic(self):
         if hasattr(slicer.modules, 'RaidionicsWidget'):
             widget = slicer.modules.RaidionicsWidget
@@ -193,37 +283,25 @@ class RaidionicsLogic:
             widget = slicer.modules.RaidionicsWidget
             widget.set_default()
 
-    def cmdProgressEvent(self, progress, line):
+    def cmdProgressEvent(self, event):
         if hasattr(slicer.modules, 'RaidionicsWidget'):
             widget = slicer.modules.RaidionicsWidget
-            widget.on_logic_event_progress(self.logic_task, progress, line)
+            task = self.logic_task
+            self.run_on_main_thread(lambda: widget.on_logic_event_progress(task, event))
 
     def cmdLogEvent(self, line):
         if hasattr(slicer.modules, 'RaidionicsWidget'):
             widget = slicer.modules.RaidionicsWidget
-            widget.on_logic_log_event(line)
-
-    def cmdCheckAbort(self, p):
-        if self.abort:
-            p.kill()
-            # self.cmdAbortEvent()
+            self.run_on_main_thread(lambda: widget.on_logic_log_event(line))
 
     def checkDockerDaemon(self):
-        cmd = list()
-        cmd.append(self.dockerPath)
-        cmd.append('ps')
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        slicer.app.processEvents()
-        line = p.stdout.readline().decode("utf-8")
-        if line[:9] == 'CONTAINER':
-            return True
-        return False
+        return DockerMetadataCache.getInstance().is_daemon_running()
 
     def check_docker_image_local_existence(self, docker_image_name: str) -> bool:
         """
         Inspect the list of local Docker images. If the requested docker_image_name exists locally, the method will
-        return True, otherwise False.
-        For an existing local image, a pull operation is performed to have an up-to-date version.
+        return True, otherwise False and a pull operation is attempted.
+        The answer is served from the Docker metadata cache whenever possible.
 
         Parameters
         ----------
@@ -235,261 +313,683 @@ class RaidionicsLogic:
         bool
             Boolean asserting whether the requested Docker image exists locally or not.
         """
-        result = False
-        cmd_docker = [self.dockerPath, 'image', 'inspect', docker_image_name]
-        p = subprocess.Popen(cmd_docker, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = p.communicate()
+        result = DockerMetadataCache.getInstance().image_exists(docker_image_name)
+        if not result:
+            DockerMetadataCache.getInstance().pull_image(docker_image_name)
+        return result
 
-        if 'Error: No such image' not in stderr.decode("utf-8"):
-            result = True
-        else:
-            # If the image exists already, we make sure it is up-to-date (minimal download time overhead)
-            cmd_docker = [self.dockerPath, 'pull', docker_image_name]
-            p = subprocess.Popen(cmd_docker, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = p.communicate()
-
-        # res_lines = ""
-        # while True:
-        #     slicer.app.processEvents()
-        #     line = p.stderr.readline().decode("utf-8")
-        #     if not line:
-        #         break
-        #     res_lines = res_lines + '/n' + line
-        #
-        # # If the image has not been found, attempt to download it
-        # if 'Error: No such image' not in res_lines:
-        #     result = True
+    def prepare_inputs(self, iodict, inputs):
+        """
+        Collects, on the GUI thread, the read addresses of the input volume nodes to be staged by the processing
+        thread.
 
-        return result
+        Return
+        ------
+        dict
+            Read address for each input item, or None if a mandatory input is missing.
+        """
+        input_addresses = dict()
+        for item in iodict:
+            if iodict[item]["iotype"] == "input" and iodict[item]["type"] == "volume":
+                if (item not in list(inputs.keys()) or not inputs[item]) and "importance" in list(
+                        iodict[item].keys()) and "Mandatory" in iodict[item]["importance"]:
+                    logging.error("Missing mandatory input for running the selected model: {}.".format(item))
+                    return None
+                elif item not in list(inputs.keys()) or not inputs[item]:
+                    continue
+                input_addresses[item] = sitkUtils.GetSlicerITKReadWriteAddress(inputs[item].GetName())
+        return input_addresses
+
+    def prepare_input_arrays(self, iodict, inputs):
+        """
+        Collects, on the GUI thread, the voxel buffer (numpy view, no copy) and the IJK-to-RAS matrix of the input
+        volume nodes, for the processing thread to write them directly (see nifti_writer) and to look them up in the
+        staging cache. The volumes which cannot be written this way (e.g., multi-component) are left to the ITK export.
 
-    def executeDocker(self, dockerName, modelName, dataPath, iodict, inputs, outputs, params, widgets):
-        try:
-            assert self.checkDockerDaemon(), "Docker Daemon is not running"
-        except Exception as e:
-            print(e.message)
-            self.abort = True
+        Return
+        ------
+        dict
+            Source of each input item, in the form {'array': ndarray, 'ijk_to_ras': ndarray, 'direct': bool,
+            'node_id': str, 'mtime': int}.
+        """
+        input_arrays = dict()
+        if not SharedResources.getInstance().use_direct_staging and \
+                not SharedResources.getInstance().use_staging_cache and not SharedResources.getInstance().use_roi_crop:
+            return input_arrays
+        for item in iodict:
+            if iodict[item]["iotype"] == "input" and iodict[item]["type"] == "volume" and item in inputs \
+                    and inputs[item]:
+                try:
+                    array = slicer.util.arrayFromVolume(inputs[item])
+                    matrix = vtk.vtkMatrix4x4()
+                    inputs[item].GetIJKToRASMatrix(matrix)
+                    # Any edit of the voxels (or resampling) bumps the image data modification time, any change of
+                    # the geometry the node one.
+                    input_arrays[item] = {'array': array, 'ijk_to_ras': slicer.util.arrayFromVTKMatrix(matrix),
+                                          'direct': SharedResources.getInstance().use_direct_staging and
+                                          is_direct_export_supported(array),
+                                          'node_id': inputs[item].GetID(),
+                                          'mtime': max(inputs[item].GetMTime(), inputs[item].GetImageData().GetMTime())}
+                except Exception:
+                    logging.debug(traceback.format_exc())
+        return input_arrays
+
+    def estimate_inputs_size(self, iodict, inputs):
+        """
+        Return
+        ------
+        int
+            Raw size in bytes of the input volumes, to choose the run workspace location (see get_scratch_runs_path).
+        """
+        size = 0
+        for item in iodict:
+            if iodict[item]["iotype"] == "input" and iodict[item]["type"] == "volume" and item in inputs \
+                    and inputs[item] and inputs[item].GetImageData() is not None:
+                image_data = inputs[item].GetImageData()
+                size += image_data.GetNumberOfPoints() * image_data.GetScalarSize() * \
+                    image_data.GetNumberOfScalarComponents()
+        return size
+
+    def prepare_outputs(self, iodict, outputs, widgets):
+        """
+        Creates, on the GUI thread, the output nodes which do not exist yet in the scene.
+
+        Return
+        ------
+        dict
+            Read address for each output item linked to a manually imported volume, to be staged as input.
+        """
+        manual_addresses = dict()
+        for item in iodict:
+            if iodict[item]["iotype"] == "output" and iodict[item]["type"] == "volume":
+                if not is_atlas_output_selected(iodict, item):
+                    # No placeholder for the atlases left out of the report.
+                    continue
+                nodes = slicer.util.getNodes(item)
+                manual_node = widgets[[x.accessibleName == item + '_combobox' for x in widgets].index(True)].currentNode()
+                if len(nodes) == 0 and manual_node is None:
+                    # If the output volume is not set, a new one is created
+                    node = slicer.vtkMRMLLabelMapVolumeNode()
+                    node.SetName(item)
+                    slicer.mrmlScene.AddNode(node)
+                    node.CreateDefaultDisplayNodes()
+                    if iodict[item]["voltype"] == "LabelMap":
+                        imageData = vtk.vtkImageData()
+                        imageData.SetDimensions((150, 150, 150))
+                        imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+                        node.SetAndObserveImageData(imageData)
+                    outputs[item] = node
+
+                    # Select the correct item in the combobox upon creation
+                    combobox_widget = widgets[[x.accessibleName == item + '_combobox' for x in widgets].index(True)]
+                    combobox_widget.setCurrentNode(node)
+                elif manual_node is not None and manual_node.GetImageData() is not None:
+                    # If the node links to a manually imported volume, used as input (e.g., for faster diagnosis)
+                    # Working only if pointing to a file, not if a new empty LabelMapVolume was created.
+                    outputs[item] = manual_node
+                    manual_addresses[item] = sitkUtils.GetSlicerITKReadWriteAddress(manual_node.GetName())
+                elif manual_node is not None and manual_node.GetImageData() is None:
+                    # If the placeholder was manually created, but not linked to an image container
+                    imageData = vtk.vtkImageData()
+                    imageData.SetDimensions((150, 150, 150))
+                    imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+                    manual_node.SetAndObserveImageData(imageData)
+        return manual_addresses
+
+    def prepare_roi_crops(self, iodict, inputs, outputs, manual_addresses):
+        """
+        Computes, on the GUI thread, the crop of each input volume and manually provided segmentation to the region of
+        interest, plus a margin, when the ROI-cropped export is enabled (segmentation task only). The region is taken
+        from the selected ROI node, or else from the brain or lungs mask linked by the user.
 
-        modules = slicer.modules
-        if hasattr(modules, 'RaidionicsWidget'):
-            widgetPresent = True
+        Return
+        ------
+        dict
+            Crop (see roi_utilities), full dimensions and IJK-to-RAS matrix of each cropped item, and its timestamp.
+        """
+        roi_crops = dict()
+        shared = SharedResources.getInstance()
+        if not shared.use_roi_crop or self.logic_task != 'segmentation':
+            return roi_crops
+        ras_bounds = None
+        roi_node = slicer.mrmlScene.GetNodeByID(shared.roi_crop_node_id) if shared.roi_crop_node_id else None
+        if roi_node is not None:
+            ras_bounds = [0.] * 6
+            roi_node.GetRASBounds(ras_bounds)
+            region_name = roi_node.GetName()
         else:
-            widgetPresent = False
+            for item in manual_addresses:
+                if item.lower() in ['brain', 'lungs']:
+                    matrix = vtk.vtkMatrix4x4()
+                    outputs[item].GetIJKToRASMatrix(matrix)
+                    ras_bounds = mask_ras_bounds(slicer.util.arrayFromVolume(outputs[item]),
+                                                 slicer.util.arrayFromVTKMatrix(matrix))
+                    region_name = outputs[item].GetName()
+                    if ras_bounds is not None:
+                        break
+        if ras_bounds is None:
+            self.cmdLogEvent('No ROI node nor brain/lungs mask available, the inputs are staged uncropped.')
+            return roi_crops
+
+        nodes = {item: inputs[item] for item in iodict if iodict[item]["iotype"] == "input"
+                 and iodict[item]["type"] == "volume" and item in inputs and inputs[item]}
+        nodes.update({item: outputs[item] for item in manual_addresses})
+        for item, node in nodes.items():
+            if node.GetImageData() is None:
+                continue
+            matrix = vtk.vtkMatrix4x4()
+            node.GetRASToIJKMatrix(matrix)
+            dims = list(node.GetImageData().GetDimensions())
+            crop = compute_crop(ras_bounds, slicer.util.arrayFromVTKMatrix(matrix), dims, node.GetSpacing(),
+                                shared.roi_crop_margin_mm)
+            if crop is None:
+                continue
+            node.GetIJKToRASMatrix(matrix)
+            roi_crops[item] = {'crop': crop, 'dims': dims, 'ijk_to_ras': slicer.util.arrayFromVTKMatrix(matrix),
+                               'timestamp_order': str(iodict[item].get('timestamp_order', '0'))}
+        if len(roi_crops) != 0:
+            self.cmdLogEvent('Inputs cropped to {} with a {:.0f} mm margin.'.format(region_name,
+                                                                                  shared.roi_crop_margin_mm))
+        return roi_crops
+
+    def stage_inputs(self, workspace, iodict, modelName, input_addresses, manual_addresses, input_arrays=None,
+                     roi_crops=None):
+        """
+        Exports the input volumes and generates the backend configuration file inside the run workspace, from the
+        processing thread.
 
-        dataPath = '/workspace/resources'
+        Return
+        ------
+        dict
+            Content fingerprint of each exported volume, indexed by its location relative to the data folder.
+        """
+        input_fingerprints = dict()
+        segmentation_filenames = dict()
+        roi_crops = roi_crops if roi_crops is not None else dict()
+        # Exported location, relative to the data folder, of each manually provided segmentation and input volume,
+        # with its read address, voxel buffer source and crop.
+        exports = dict()
+        for item in manual_addresses:
+            fileName = item + self.file_extension_docker
+            segmentation_filenames[item] = workspace.container_data_path + '/' + fileName
+            exports[fileName] = (manual_addresses[item], None, roi_crops.get(item, {}).get('crop'))
 
-        # Cleaning input/output folders for every run
-        if os.path.exists(SharedResources.getInstance().data_path):
-            shutil.rmtree(SharedResources.getInstance().data_path)
-        os.makedirs(SharedResources.getInstance().data_path)
+        for item in iodict:
+            if iodict[item]["iotype"] == "input":
+                if iodict[item]["type"] == "volume":
+                    if item not in input_addresses:
+                        continue
+                    input_sequence_type = iodict[item]["sequence_type"]
+                    fileName = get_backend_input_filename(input_sequence_type, self.file_extension_docker)
+                    input_timestamp_order = iodict[item]["timestamp_order"]
+                    os.makedirs(str(os.path.join(workspace.data_path, "T" + input_timestamp_order)), exist_ok=True)
+                    exports["T" + input_timestamp_order + '/' + fileName] = \
+                        (input_addresses[item], input_arrays.get(item) if input_arrays is not None else None,
+                         roi_crops.get(item, {}).get('crop'))
+                    if input_timestamp_order == "1" and not os.path.exists(os.path.join(workspace.data_path, "T0")):
+                        os.makedirs(os.path.join(workspace.data_path, "T0"))
+
+        # The volumes are exported concurrently, the compression and hashing releasing the GIL. The backend is only
+        # started once all of them are written.
+        start = time.time()
+        read_lock = threading.Lock()
+        max_workers = SharedResources.getInstance().staging_threads
+        max_workers = max(1, min(len(exports), max_workers if max_workers > 0 else os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {k: executor.submit(self.stage_volume, exports[k][0], os.path.join(workspace.data_path, k),
+                                          read_lock, exports[k][1], workspace.runs_path, exports[k][2])
+                       for k in exports}
+        full_mb = staged_mb = saved_time = 0.
+        for fileName, future in futures.items():
+            try:
+                input_fingerprints[fileName], timings = future.result()
+                if timings.get('cached', False):
+                    self.cmdLogEvent('Reused the staged {} from a previous run in {:.2f}s ({:.1f} MB).'.format(
+                        fileName, timings['write'], timings['mb']))
+                else:
+                    self.cmdLogEvent('Staged {} in {:.2f}s (read {:.2f}s, write {:.2f}s, {:.1f} MB).'.format(
+                        fileName, timings['read'] + timings['write'], timings['read'], timings['write'],
+                        timings['mb']))
+                if 'original_type' in timings:
+                    self.cmdLogEvent('{} staged as {} instead of {} (lossless).'.format(
+                        fileName, timings['type'], timings['original_type']))
+                if 'full_mb' in timings:
+                    full_mb += timings['full_mb']
+                    staged_mb += timings['mb']
+                    # Staging time of the full volume extrapolated from the crop one.
+                    saved_time += timings['write'] * (timings['full_mb'] / max(timings['mb'], 1e-6) - 1.)
+            except Exception:
+                if fileName[:-len(self.file_extension_docker)] in segmentation_filenames:
+                    raise
+                logging.warning("Issue preparing input volume.")
+                logging.warning(traceback.format_exc())
+        if len(exports) != 0:
+            self.cmdLogEvent('{} volumes staged in {:.2f}s ({} threads).'.format(len(exports), time.time() - start,
+                                                                                 max_workers))
+        if full_mb > 0:
+            self.cmdLogEvent('ROI crop: {:.1f} MB staged instead of {:.1f} MB ({:.0f}% less), about {:.2f}s of staging '
+                             'saved.'.format(staged_mb, full_mb, 100. * (1. - staged_mb / full_mb), saved_time))
+
+        if True in [iodict[item]["iotype"] == "input" and iodict[item]["type"] == "configuration" for item in iodict]:
+            # if modelName == "MRI_GBM_Postop":
+            #     modelName = postop_model_selection(inputs)
+            pipeline_filename = None
+            if self.logic_task == 'reporting':
+                pipeline_filename = self.prepare_pipeline(workspace, iodict, input_fingerprints,
+                                                          segmentation_filenames)
+            generate_backend_config(workspace.data_path, iodict, self.logic_target_space, self.logic_task,
+                                    modelName, container_input_folder=workspace.container_data_path,
+                                    container_output_folder=workspace.container_output_path,
+                                    container_resources_folder=workspace.container_resources_path,
+                                    segmentation_filenames=segmentation_filenames, pipeline_filename=pipeline_filename)
+        return input_fingerprints
+
+    def stage_volume(self, address, filename, read_lock, array_source=None, runs_path=None, crop=None):
+        """
+        Exports one volume node to the run workspace, from a staging thread.
 
-        if os.path.exists(SharedResources.getInstance().output_path):
-            shutil.rmtree(SharedResources.getInstance().output_path)
-        os.makedirs(SharedResources.getInstance().output_path)
+        Parameters
+        ----------
+        address: str
+            Slicer ITK read address of the node.
+        filename: str
+            Destination file, with the extension of the transfer format.
+        read_lock: threading.Lock
+            Serializing the accesses to the nodes through ITK, only the encoding of the volumes being concurrent.
+        array_source: dict
+            Voxel buffer and IJK-to-RAS matrix of the node (see prepare_input_arrays), written directly without any
+            intermediate ITK image when possible, and identifying the node in the staging cache.
+        runs_path: str
+            Runs folder of the workspace, next to which the staging cache is kept.
+        crop: list
+            Region of the volume to stage (see roi_utilities), the whole volume if None.
 
-        # if widgetPresent:
-        #     self.cmdStartEvent()
+        Return
+        ------
+        tuple
+            Content fingerprint of the volume, and the read/write timings (s) and raw size (MB), with the uncropped raw
+            size (full_mb) for a cropped volume.
+        """
+        cache_key = None
+        if array_source is not None and SharedResources.getInstance().use_staging_cache:
+            start = time.time()
+            try:
+                cache_key = StagingCache.compute_key(array_source['node_id'], array_source['mtime'],
+                                                     sampled_fingerprint(array_source['array'],
+                                                                         array_source['ijk_to_ras']),
+                                                     self.transfer_format,
+                                                     SharedResources.getInstance().transfer_compression_level, crop,
+                                                     SharedResources.getInstance().use_dtype_narrowing)
+                restored = StagingCache.getInstance().restore(cache_key, filename)
+                if restored is not None:
+                    fingerprint, types = restored
+                    array = array_source['array']
+                    mb = (array.nbytes if crop is None else
+                          int(numpy.prod(crop_size(crop))) * array.itemsize) / (1024. * 1024.)
+                    timings = {'read': 0., 'write': time.time() - start, 'mb': mb, 'cached': True}
+                    timings.update(types)
+                    return fingerprint, timings
+            except Exception:
+                logging.debug(traceback.format_exc())
+        fingerprint, timings = self.export_volume(address, filename, read_lock, array_source, crop)
+        if cache_key is not None:
+            StagingCache.getInstance().store(cache_key, filename, fingerprint, array_source['node_id'],
+                                             runs_path if runs_path is not None else
+                                             SharedResources.getInstance().runs_path,
+                                             {k: timings[k] for k in ['original_type', 'type'] if k in timings})
+        return fingerprint, timings
+
+    def export_volume(self, address, filename, read_lock, array_source=None, crop=None):
+        """
+        Writes one volume node (or its crop) to the run workspace (see stage_volume), directly from its voxel buffer
+        when possible, through ITK otherwise.
+        """
+        if array_source is not None and array_source['direct']:
+            try:
+                start = time.time()
+                array = array_source['array']
+                ijk_to_ras = array_source['ijk_to_ras']
+                timings = dict()
+                if crop is not None:
+                    timings['full_mb'] = array.nbytes / (1024. * 1024.)
+                    array, ijk_to_ras = crop_array(array, ijk_to_ras, crop)
+                if SharedResources.getInstance().use_dtype_narrowing:
+                    array, original_dtype = narrow_array(array)
+                    if original_dtype is not None:
+                        timings['original_type'] = original_dtype.name
+                        timings['type'] = array.dtype.name
+                write_nifti(array, ijk_to_ras, filename, self.transfer_format,
+                            SharedResources.getInstance().transfer_compression_level)
+                spacing, origin, direction = geometry_from_ijk_to_ras(ijk_to_ras)
+                pixel_id = sitk.GetImageFromArray(array[:1, :1, :1]).GetPixelIDValue()
+                fingerprint = array_fingerprint(array, pixel_id, 1, spacing, origin, direction)
+                timings.update({'read': 0., 'write': time.time() - start, 'mb': array.nbytes / (1024. * 1024.)})
+                return fingerprint, timings
+            except Exception:
+                logging.warning("Direct export of {} failed, exporting through ITK.".format(os.path.basename(filename)))
+                logging.debug(traceback.format_exc())
+        start = time.time()
+        with read_lock:
+            img = sitk.ReadImage(address)
+        read_time = time.time() - start
+        start = time.time()
+        timings = dict()
+        if crop is not None:
+            timings['full_mb'] = img.GetNumberOfPixels() * img.GetNumberOfComponentsPerPixel() * \
+                img.GetSizeOfPixelComponent() / (1024. * 1024.)
+            img = sitk.RegionOfInterest(img, crop_size(crop), crop[:3])
+        if SharedResources.getInstance().use_dtype_narrowing:
+            img, original_type = narrow_image(img)
+            if original_type is not None:
+                timings['original_type'] = sitk.GetPixelIDValueAsString(original_type)
+                timings['type'] = img.GetPixelIDTypeAsString()
+        write_volume(img, filename, self.transfer_format)
+        fingerprint = image_fingerprint(img)
+        timings.update({'read': read_time, 'write': time.time() - start,
+                        'mb': img.GetNumberOfPixels() * img.GetNumberOfComponentsPerPixel() *
+                        img.GetSizeOfPixelComponent() / (1024. * 1024.)})
+        return fingerprint, timings
+
+    def prepare_pipeline(self, workspace, iodict, input_fingerprints, segmentation_filenames):
+        """
+        Looks for recent segmentation masks compatible with the Segmentation steps of the RADS pipeline (same model, on
+        the same input volumes) and stages them in the run workspace. The steps whose structures are all provided,
+        either reused or manually linked by the user, are removed from a run-specific copy of the pipeline.
+
+        Return
+        ------
+        str
+            Location of the run-specific pipeline as seen by the backend, or None if the original pipeline is kept.
+        """
         try:
-            inputDict = dict()
-            outputDict = dict()
-            paramDict = dict()
-            for item in iodict:
-                if iodict[item]["iotype"] == "output":
-                    if iodict[item]["type"] == "volume":
-                        outputDict[item] = item
-                        # curr_output = outputs[item]
-                        nodes = slicer.util.getNodes(outputDict[item])
-                        manual_node = widgets[[x.accessibleName == item + '_combobox' for x in widgets].index(True)].currentNode()
-                        if len(nodes) == 0 and manual_node is None:
-                            # If the output volume is not set, a new one is created
-                            node = slicer.vtkMRMLLabelMapVolumeNode()
-                            node.SetName(outputDict[item])
-                            slicer.mrmlScene.AddNode(node)
-                            node.CreateDefaultDisplayNodes()
-                            if iodict[item]["voltype"] == "LabelMap":
-                                imageData = vtk.vtkImageData()
-                                imageData.SetDimensions((150, 150, 150))
-                                imageData.AllocateScalars(vtk.VTK_SHORT, 1)
-                                node.SetAndObserveImageData(imageData)
-                            outputs[item] = node
-
-                            # Select the correct item in the combobox upon creation
-                            combobox_widget = widgets[[x.accessibleName == item + '_combobox' for x in widgets].index(True)]
-                            combobox_widget.setCurrentNode(node)
-                        elif not manual_node is None and not manual_node.GetImageData() is None:
-                            # If the node links to a manually imported volume, used as input (e.g., for faster diagnosis)
-                            # Working only if pointing to a file, not if a new empty LabelMapVolume was created.
-                            outputs[item] = manual_node
-                            output_node_name = outputs[item].GetName()
-                            img = sitk.ReadImage(sitkUtils.GetSlicerITKReadWriteAddress(output_node_name))
-                            fileName = item + self.file_extension_docker
-                            # inputDict[item] = fileName
-                            SharedResources.getInstance().user_diagnosis_configuration['Neuro'][item.lower() + '_segmentation_filename'] = os.path.join(dataPath, 'data', fileName)
-                            sitk.WriteImage(img, str(os.path.join(SharedResources.getInstance().data_path, fileName)))
-                        elif manual_node.GetImageData() is None:
-                            # If the placeholder was manually created, but not linked to an image container
-                            imageData = vtk.vtkImageData()
-                            imageData.SetDimensions((150, 150, 150))
-                            imageData.AllocateScalars(vtk.VTK_SHORT, 1)
-                            manual_node.SetAndObserveImageData(imageData)
-
-                    elif iodict[item]["type"] == "point_vec":
-                        outputDict[item] = item + '.fcsv'
-                    elif iodict[item]["type"] == "text":
-                        outputDict[item] = item + '.txt'
-                    else:
-                        paramDict[item] = str(params[item])
-            for item in iodict:
-                if iodict[item]["iotype"] == "input":
-                    if iodict[item]["type"] == "volume":
-                        # print(inputs[item])
-                        try:
-                            if (item not in list(inputs.keys()) or not inputs[item]) and "importance" in list(
-                                    iodict[item].keys()) and "Mandatory" in iodict[item]["importance"]:
-                                logging.error("Missing mandatory input for running the selected model: {}.".format(item))
-                                self.stop_logic()
-                                return
-                            elif item not in list(inputs.keys()) or not inputs[item]:
-                                continue
-                            input_node_name = inputs[item].GetName()
-                            img = sitk.ReadImage(sitkUtils.GetSlicerITKReadWriteAddress(input_node_name))
-                            input_sequence_type = iodict[item]["sequence_type"]
-                            fileName = 'input_' + input_sequence_type + self.file_extension_docker
-                            # @TODO. hard-coding to improve.
-                            if input_sequence_type == "T1-CE":
-                                fileName = 'input_t1gd' + self.file_extension_docker
-                            inputDict[item] = fileName
-                            input_timestamp_order = iodict[item]["timestamp_order"]
-                            os.makedirs(str(os.path.join(SharedResources.getInstance().data_path,
-                                                         "T" + input_timestamp_order)), exist_ok=True)
-                            sitk.WriteImage(img, str(os.path.join(SharedResources.getInstance().data_path,
-                                                                  "T" + input_timestamp_order, fileName)))
-                            if input_timestamp_order == "1" and not os.path.exists(os.path.join(SharedResources.getInstance().data_path, "T0")):
-                                os.makedirs(os.path.join(SharedResources.getInstance().data_path, "T0"))
-                        except Exception as e:
-                            print("Issue preparing input volume.")
-                            print(traceback.format_exc())
-                    elif iodict[item]["type"] == "configuration":
-                        # if modelName == "MRI_GBM_Postop":
-                        #     modelName = postop_model_selection(inputs)
-                        generate_backend_config(SharedResources.getInstance().data_path,
-                                                iodict, self.logic_target_space, self.logic_task, modelName)
-                elif iodict[item]["iotype"] == "parameter":
-                    paramDict[item] = str(params[item])
+            pipeline_filename = os.path.join(SharedResources.getInstance().diagnosis_path,
+                                             iodict['UserConfiguration']['default'])
+            with open(pipeline_filename, 'r') as infile:
+                pipeline = json.load(infile, object_pairs_hook=OrderedDict)
+            provided = [x.lower() for x in segmentation_filenames.keys()]
+            skipped_steps = []
+            for key, targets, inputs, step_model in get_pipeline_segmentation_steps(pipeline,
+                                                                                   self.file_extension_docker):
+                # The backend takes a single mask per structure, valid for the first timestamp only.
+                if len(targets) == 0 or False in [x in input_fingerprints and x.startswith('T0/') for x in inputs]:
+                    continue
+                step_fingerprints = {x: input_fingerprints[x] for x in inputs}
+                missing = [t for t in targets if t.lower() not in provided]
+                if len(missing) != 0 and not SharedResources.getInstance().use_segmentation_reuse:
+                    continue
+                artifacts = {t: SegmentationArtifactRegistry.getInstance().find(step_model, t, step_fingerprints)
+                             for t in missing}
+                if None in artifacts.values():
+                    continue
+                for target in artifacts:
+                    # The stored masks are compressed NIfTI, whichever the transfer format.
+                    fileName = target + '.nii.gz'
+                    shutil.copyfile(artifacts[target], os.path.join(workspace.data_path, fileName))
+                    input_fingerprints[fileName] = file_fingerprint(artifacts[target])
+                    segmentation_filenames[target] = workspace.container_data_path + '/' + fileName
+                    provided.append(target.lower())
+                    self.cmdLogEvent('Reusing the {} segmentation from a previous run.'.format(target))
+                skipped_steps.append(key)
+            if len(skipped_steps) == 0:
+                return None
+            with open(os.path.join(workspace.data_path, 'pipeline.json'), 'w') as outfile:
+                json.dump(remove_pipeline_steps(pipeline, skipped_steps), outfile, indent=4)
+            return workspace.container_data_path + '/pipeline.json'
         except Exception:
-            print("Error during inputs preparation before Docker call.")
-            print(traceback.format_exc())
-
-        self.cmdLogEvent('Docker run command:')
-
-        cmd = list()
-        cmd.append(self.dockerPath)
-        cmd.extend(('run', '-t'))
-        # if self.use_gpu:
-        #     cmd.append(' --runtime=nvidia ')
-        cmd.append('--user')
-        cmd.append(str(os.getuid()))
-        cmd.append('-v')
-        cmd.append(SharedResources.getInstance().resources_path + ':' + dataPath)
-        cmd.append(dockerName)
-        cmd.append('-c')
-        cmd.append('/workspace/resources/data/rads_config.ini')
-        cmd.append('-v')
-        cmd.append('debug')
-
-        self.cmdLogEvent(cmd)
-
-        # try:
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        progress = 0
-        # print('executing')
-        while True:
-            progress += 0.15
-            slicer.app.processEvents()
-            self.cmdCheckAbort(p)
-            line = p.stdout.readline().decode("utf-8")
-            if not line:
-                break
-
-            if widgetPresent:
-                self.cmdLogEvent(line)
-                self.cmdProgressEvent(progress, line)
-            # print(line)
-
-    def updateOutput(self, iodict, outputs, widgets):
-        output_volume_files = dict()
-        output_fiduciallist_files = dict()
-        # output_text_files = dict()
-        self.output_raw_values = dict()
-        created_files = {}
-        # Fetching all created outputs, including all timestamps.
-        for _, dirs, _ in os.walk(SharedResources.getInstance().output_path):
-            for d in dirs:
-                created_files[d] = []
-            break
+            logging.warning("Segmentation masks reuse failed, running the full pipeline.")
+            logging.warning(traceback.format_exc())
+            return None
+
+    def register_segmentation_artifacts(self, iodict, model_name, input_fingerprints, results):
+        """
+        Records the segmentation masks of a segmentation run, for a later RADS pipeline on the same volumes. Probability
+        maps are binarized with the model recommended threshold. Run in the background, once the results are displayed.
+        """
+        for item in results['volumes']:
+            try:
+                image = results['volumes'][item]
+                if image.GetPixelID() in [sitk.sitkFloat32, sitk.sitkFloat64]:
+                    threshold = float(str(iodict[item].get('threshold', 0.5)))
+                    image = sitk.BinaryThreshold(image, lowerThreshold=threshold, upperThreshold=1e12, insideValue=1,
+                                                 outsideValue=0)
+                inputs = {k: v for k, v in input_fingerprints.items() if '/' in k}
+                SegmentationArtifactRegistry.getInstance().register(model_name, item, inputs, image)
+            except Exception:
+                logging.warning("Segmentation mask for {} could not be registered.".format(item))
+                logging.warning(traceback.format_exc())
 
-        for d in list(created_files.keys()):
-            for _, _, files in os.walk(os.path.join(SharedResources.getInstance().output_path, d)):
-                for f in files:
-                    created_files[d].append(f)
+    def executeDocker(self, dockerName, workspace):
+        """
+        Return
+        ------
+        bool
+            Boolean asserting whether the backend ran until completion without reported failure.
+        """
+        if not workspace.native and not self.checkDockerDaemon():
+            logging.error("Docker Daemon is not running")
+            self.abort = True
+            return False
+
+        backend_names = {'docker': dockerName, 'native': 'the native backend', 'in_process': 'the in-process backend'}
+        self.cmdLogEvent('Running {} on {}'.format(backend_names.get(workspace.execution_mode, dockerName),
+                                                   workspace.container_config_filename))
+        success = run_backend(docker_image_name=dockerName, workspace=workspace,
+                              line_callback=self.on_backend_log_line, abort_callback=lambda: self.abort)
+        if not success and not self.abort:
+            logging.warning("The backend reported a failure, the results might be incomplete.")
+        return success
+
+    def on_backend_log_line(self, line):
+        if self.progress_tracker is None:
+            self.progress_tracker = ProgressTracker(None)
+        event = self.progress_tracker.feed(line)
+        if hasattr(slicer.modules, 'RaidionicsWidget'):
+            self.cmdLogEvent(line)
+            self.cmdProgressEvent(event)
 
+    def collect_outputs(self, workspace, iodict, streamed=None):
+        """
+        Locates and decodes the files generated by the backend in the run workspace, from the processing thread.
+
+        Parameters
+        ----------
+        streamed: dict
+            Outputs already decoded and displayed while the backend was running (see OutputWatcher.stop), reused when
+            their file was not rewritten since.
+
+        Return
+        ------
+        dict
+            Decoded SimpleITK image for each volume output, filename for each point list output, original type of the
+            narrowed volumes, and the volume outputs already displayed.
+        """
+        streamed = streamed if streamed is not None else dict()
+        # Fetching all created outputs, including all timestamps.
+        created_files = scan_output_files(workspace.output_path)
         if len(created_files) == 0:
-            self.cmdStopLogic()
             logging.warning("No results were generated! If no other error message was printed, it might indicate an"
                             " issue with Docker. Make sure the Docker service is running.")
+        output_volume_files, output_fiduciallist_files = self.locate_outputs(workspace, iodict, created_files)
+
+        output_volumes = dict()
+        output_types = dict()
+        displayed = []
+        for output_volume in output_volume_files.keys():
+            try:
+                filename = output_volume_files[output_volume]
+                if output_volume in streamed and streamed[output_volume]['filename'] == filename and \
+                        streamed[output_volume]['signature'] == file_signature(filename):
+                    output_volumes[output_volume], original_type = streamed[output_volume]['result']
+                    displayed.append(output_volume)
+                else:
+                    output_volumes[output_volume], original_type = self.decode_output(iodict, output_volume, filename)
+                if original_type is not None:
+                    output_types[output_volume] = original_type
+            except Exception as e:
+                logging.warning("Unable to read results for volume: {}".format(output_volume))
+                continue
+        return {'volumes': output_volumes, 'fiducials': output_fiduciallist_files, 'types': output_types,
+                'displayed': displayed}
+
+    def locate_outputs(self, workspace, iodict, created_files, quiet=False):
+        """
+        Matches the files generated by the backend (see scan_output_files) with the expected outputs.
 
+        Parameters
+        ----------
+        quiet: bool
+            No warning for the outputs not found, e.g. while the backend is still running.
+
+        Return
+        ------
+        tuple
+            Filename of each volume output found, and of each point list output.
+        """
+        output_volume_files = dict()
+        output_fiduciallist_files = dict()
         for item in iodict:
             try:
                 if iodict[item]["iotype"] == "output":
+                    if not is_atlas_output_selected(iodict, item):
+                        if not quiet:
+                            logging.info("Atlas {} not selected for the report, skipped.".format(item))
+                        continue
                     ts_path = "T0"
                     if "timestamp_order" in list(iodict[item].keys()):
                         ts_path = "T" + str(iodict[item]["timestamp_order"])
 
                     if iodict[item]["type"] == "volume":
-                        fileName = None
                         # Including a . when looking for the filename, to make sure to hit the proper output.
                         if "atlas_category" in list(iodict[item].keys()):
-                            fileName = str(os.path.join(SharedResources.getInstance().output_path, ts_path, iodict[item]["atlas_category"] + '-structures',
-                                                        created_files[ts_path][[item + '_atlas.' in x for x in created_files[ts_path]].index(True)]))
+                            folder = iodict[item]["atlas_category"] + '-structures' + os.sep
+                            candidates = [x for x in created_files[ts_path]
+                                          if x.startswith(folder) and item + '_atlas.' in x]
                         else:
-                            fileName = str(os.path.join(SharedResources.getInstance().output_path, ts_path,
-                                                        created_files[ts_path][[item+'.' in x for x in created_files[ts_path]].index(True)]))
-                        output_volume_files[item] = fileName
+                            candidates = [x for x in created_files[ts_path] if os.sep not in x and item + '.' in x]
+                        output_volume_files[item] = str(os.path.join(workspace.output_path, ts_path, candidates[0]))
                     if iodict[item]["type"] == "point_vec":
-                        fileName = str(os.path.join(SharedResources.getInstance().output_path, ts_path, item + '.fcsv'))
+                        fileName = str(os.path.join(workspace.output_path, ts_path, item + '.fcsv'))
                         output_fiduciallist_files[item] = fileName
                     # if iodict[item]["type"] == "text":
-                    #     fileName = str(os.path.join(SharedResources.getInstance().output_path, iodict[item]["default"] + '.txt'))
+                    #     fileName = str(os.path.join(workspace.output_path, iodict[item]["default"] + '.txt'))
                     #     output_text_files[item] = fileName
             except Exception as e:
-                logging.warning("Unable to collect results for {}".format(item))
-                logging.warning(traceback.format_exc())
+                if not quiet:
+                    logging.warning("Unable to collect results for {}".format(item))
+                    logging.warning(traceback.format_exc())
                 continue
+        return output_volume_files, output_fiduciallist_files
 
-        for output_volume in output_volume_files.keys():
-            try:
-                result = sitk.ReadImage(output_volume_files[output_volume])
-                # print(result.GetPixelIDTypeAsString())
-                self.output_raw_values[output_volume] = deepcopy(sitk.GetArrayFromImage(result))
-                output_node = outputs[output_volume]
-                output_node_name = output_node.GetName()
-                # if iodict[output_volume]["voltype"] == 'LabelMap':
-                nodeWriteAddress = sitkUtils.GetSlicerITKReadWriteAddress(output_node_name)
-                self.display_port = nodeWriteAddress
-                sitk.WriteImage(result, nodeWriteAddress)
-                applicationLogic = slicer.app.applicationLogic()
-                selectionNode = applicationLogic.GetSelectionNode()
-
-                outputLabelMap = True
-                if outputLabelMap:
-                    selectionNode.SetReferenceActiveLabelVolumeID(output_node.GetID())
-                else:
-                    selectionNode.SetReferenceActiveVolumeID(output_node.GetID())
+    def decode_output(self, iodict, item, filename):
+        """
+        Return
+        ------
+        tuple
+            Decoded output volume, and its original pixel type ID if narrowed (see volume_codecs.narrow_image).
+        """
+        image = read_volume(filename)
+        original_type = None
+        if SharedResources.getInstance().use_dtype_narrowing and iodict[item].get("voltype") == "LabelMap":
+            # Label maps are often written wider than needed by the backend, the values are kept as is.
+            image, original_type = narrow_image(image)
+            if original_type is not None:
+                logging.debug("{} result narrowed to {} (written as {}).".format(
+                    item, image.GetPixelIDTypeAsString(), sitk.GetPixelIDValueAsString(original_type)))
+        return image, original_type
+
+    def stream_output(self, iodict, outputs, item, filename, roi_crops=None):
+        """
+        Decodes an output as soon as the backend finished writing it, from the output watcher thread, and displays it
+        while the processing goes on.
 
-                applicationLogic.PropagateVolumeSelection(0)
-                applicationLogic.FitSliceToAll()
-            except Exception as e:
-                logging.warning("Unable to display results for volume: {}".format(output_volume))
+        Return
+        ------
+        tuple
+            Decoded output volume and its original pixel type ID (see decode_output).
+        """
+        decoded = self.decode_output(iodict, item, filename)
+        if not self.abort:
+            self.run_on_main_thread(lambda: self.update_output_volume(iodict, outputs, item, decoded[0], decoded[1],
+                                                                      roi_crops))
+            self.cmdLogEvent('{} result available, displayed while the processing continues.'.format(item))
+        return decoded
+
+    def paste_roi_crop(self, iodict, item, result, roi_crops):
+        """
+        Pastes a result computed on cropped inputs into a volume of the full input size, the reference input being the
+        cropped one of the same timestamp and crop size.
+
+        Return
+        ------
+        SimpleITK.Image
+            Full size result with the geometry of the reference input, or the cropped result if none matches.
+        """
+        timestamp_order = str(iodict[item].get('timestamp_order', '0'))
+        candidates = sorted(roi_crops.values(), key=lambda x: x['timestamp_order'] != timestamp_order)
+        for reference in candidates:
+            if crop_size(reference['crop']) != list(result.GetSize()):
+                continue
+            full = sitk.GetImageFromArray(paste_crop(sitk.GetArrayViewFromImage(result), reference['crop'],
+                                                     reference['dims']),
+                                          isVector=result.GetNumberOfComponentsPerPixel() > 1)
+            spacing, origin, direction = geometry_from_ijk_to_ras(reference['ijk_to_ras'])
+            full.SetSpacing(spacing)
+            full.SetOrigin(origin)
+            full.SetDirection(direction)
+            return full
+        logging.warning("No cropped input matching the {} result, kept at the crop size.".format(item))
+        return result
+
+    def update_output_volume(self, iodict, outputs, output_volume, result, original_type=None, roi_crops=None):
+        """
+        Pushes one decoded volume result into its output node, on the GUI thread. A result computed on cropped inputs
+        is pasted back into a volume of the full input size.
+        """
+        try:
+            if roi_crops:
+                result = self.paste_roi_crop(iodict, output_volume, result, roi_crops)
+            # print(result.GetPixelIDTypeAsString())
+            # Straight from the image buffer, quantised into the memory-mapped store.
+            self.output_raw_values.store(output_volume, sitk.GetArrayViewFromImage(result))
+            output_node = outputs[output_volume]
+            if original_type is not None and not output_node.IsA('vtkMRMLLabelMapVolumeNode'):
+                # Narrowed result pushed to a scalar volume, restored with the type written by the backend.
+                result = sitk.Cast(result, original_type)
+            output_node_name = output_node.GetName()
+            # if iodict[output_volume]["voltype"] == 'LabelMap':
+            nodeWriteAddress = sitkUtils.GetSlicerITKReadWriteAddress(output_node_name)
+            self.display_port = nodeWriteAddress
+            sitk.WriteImage(result, nodeWriteAddress)
+            applicationLogic = slicer.app.applicationLogic()
+            selectionNode = applicationLogic.GetSelectionNode()
+
+            outputLabelMap = True
+            if outputLabelMap:
+                selectionNode.SetReferenceActiveLabelVolumeID(output_node.GetID())
+            else:
+                selectionNode.SetReferenceActiveVolumeID(output_node.GetID())
+
+            applicationLogic.PropagateVolumeSelection(0)
+            applicationLogic.FitSliceToAll()
+        except Exception as e:
+            logging.warning("Unable to display results for volume: {}".format(output_volume))
+
+    def updateOutput(self, iodict, outputs, widgets, results, roi_crops=None):
+        """
+        Pushes the decoded results into the output nodes, on the GUI thread, except the ones already displayed while
+        the backend was running.
+        """
+        output_fiduciallist_files = results['fiducials']
+        for output_volume in results['volumes'].keys():
+            if output_volume in results.get('displayed', []):
                 continue
+            self.update_output_volume(iodict, outputs, output_volume, results['volumes'][output_volume],
+                                      results.get('types', {}).get(output_volume), roi_crops)
+        stats = self.output_raw_values.statistics()
+        if stats['items'] != 0:
+            self.cmdLogEvent('Raw results: {} volume(s) memory-mapped, {:.1f} MB on disk instead of {:.1f} MB kept in '
+                             'memory.'.format(stats['items'], stats['stored_bytes'] / (1024 * 1024),
+                                              stats['original_bytes'] / (1024 * 1024)))
 
         for fiduciallist in output_fiduciallist_files.keys():
             # information about loading markups: https://www.slicer.org/wiki/Documentation/Nightly/Modules/Markups
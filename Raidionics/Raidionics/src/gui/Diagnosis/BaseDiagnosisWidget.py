@@ -2,6 +2,8 @@ from __main__ import qt, ctk, slicer, vtk
 
 from src.RaidionicsLogic import RaidionicsLogic
 from src.utils.resources import SharedResources
+from src.utils.backend_utilities import CORTICAL_ATLASES, SUBCORTICAL_ATLASES, ATLAS_PRESETS, get_selected_atlases, \
+    set_selected_atlases
 from src.gui.Diagnosis.DiagnosisInterfaceWidget import *
 from src.gui.Diagnosis.DiagnosisExecutionWidget import *
 from src.gui.Diagnosis.DiagnosisNeuroResultsWidget import *
@@ -21,10 +23,28 @@ class MyDialog(qt.QDialog):
         self.select_tumor_type_combobox.addItems(["High-Grade Glioma", "Low-Grade Glioma", "Meningioma", "Metastasis"])
         SharedResources.getInstance().user_diagnosis_configuration['Neuro']['tumor_type'] = "High-Grade Glioma"
         self.base_layout.addWidget(self.select_tumor_type_combobox, 0, 1)
+        # Each atlas adds a registration and features computation to the run, only the selected ones are computed.
+        self.select_atlases_label = qt.QLabel('Atlases')
+        self.select_atlases_label.setToolTip('Atlases used for the cortical and subcortical structures features.\n'
+                                             'Fewer atlases give a shorter processing time.')
+        self.base_layout.addWidget(self.select_atlases_label, 1, 0)
+        self.select_atlases_layout = qt.QHBoxLayout()
+        self.select_atlases_checkboxes = dict()
+        cortical, subcortical = get_selected_atlases()
+        for atlas in CORTICAL_ATLASES + SUBCORTICAL_ATLASES:
+            checkbox = qt.QCheckBox(atlas)
+            checkbox.setChecked(atlas in cortical + subcortical)
+            checkbox.stateChanged.connect(self.on_atlases_selected)
+            self.select_atlases_layout.addWidget(checkbox)
+            self.select_atlases_checkboxes[atlas] = checkbox
+        self.select_routine_atlases_pushbutton = qt.QPushButton('Routine')
+        self.select_routine_atlases_pushbutton.setToolTip('Only ' + ' and '.join(ATLAS_PRESETS['routine']) + '.')
+        self.select_atlases_layout.addWidget(self.select_routine_atlases_pushbutton)
+        self.base_layout.addLayout(self.select_atlases_layout, 1, 1)
         self.exit_accept_pushbutton = qt.QDialogButtonBox(qt.QDialogButtonBox.Ok)
-        self.base_layout.addWidget(self.exit_accept_pushbutton, 1, 0)
+        self.base_layout.addWidget(self.exit_accept_pushbutton, 2, 0)
         self.exit_cancel_pushbutton = qt.QDialogButtonBox(qt.QDialogButtonBox.Cancel)
-        self.base_layout.addWidget(self.exit_cancel_pushbutton, 1, 1)
+        self.base_layout.addWidget(self.exit_cancel_pushbutton, 2, 1)
         # self.base_layout = qt.QVBoxLayout()
         # self.exit_pushbutton = qt.QDialogButtonBox(qt.QDialogButtonBox.Ok | qt.QDialogButtonBox.Cancel)
         # self.exit_pushbutton = qt.QDialogButtonBox(qt.QDialogButtonBox.Ok)
@@ -32,12 +52,21 @@ class MyDialog(qt.QDialog):
         self.setLayout(self.base_layout)
 
         self.select_tumor_type_combobox.currentTextChanged.connect(self.on_type_selected)
+        self.select_routine_atlases_pushbutton.clicked.connect(self.on_routine_atlases_selected)
         self.exit_accept_pushbutton.accepted.connect(self.accept)
         self.exit_cancel_pushbutton.rejected.connect(self.reject)
 
     def on_type_selected(self, text):
         SharedResources.getInstance().user_diagnosis_configuration['Neuro']['tumor_type'] = text
 
+    def on_atlases_selected(self, state):
+        set_selected_atlases([a for a in self.select_atlases_checkboxes.keys()
+                              if self.select_atlases_checkboxes[a].isChecked()])
+
+    def on_routine_atlases_selected(self):
+        for a in self.select_atlases_checkboxes.keys():
+            self.select_atlases_checkboxes[a].setChecked(a in ATLAS_PRESETS['routine'])
+
 
 class BaseDiagnosisWidget(qt.QTabWidget):
     """
@@ -134,8 +163,8 @@ class BaseDiagnosisWidget(qt.QTabWidget):
             pass
         self.update_results_area()
 
-    def on_logic_event_progress(self, progress, log):
-        self.diagnosis_execution_widget.on_logic_event_progress(progress, log)
+    def on_logic_event_progress(self, event):
+        self.diagnosis_execution_widget.on_logic_event_progress(event)
 
     def on_optimal_display(self):
         """
@@ -8,6 +8,7 @@ from copy import deepcopy
 
 from src.utils.resources import SharedResources
 from src.RaidionicsLogic import RaidionicsLogic
+from src.utils.progress_utilities import update_progressbar
 
 
 class DiagnosisExecutionWidget(qt.QWidget):
@@ -36,11 +37,15 @@ class DiagnosisExecutionWidget(qt.QWidget):
         self.execution_progress_textedit = qt.QTextEdit()
         self.execution_progress_textedit.setReadOnly(True)
         self.execution_area_layout.addWidget(self.execution_progress_textedit, 1, 1)
+        self.execution_progressbar = qt.QProgressBar()
+        self.execution_progressbar.setRange(0, 100)
+        self.execution_progressbar.setFormat('%p%')
+        self.execution_area_layout.addWidget(self.execution_progressbar, 2, 0, 1, 2)
         self.generate_segments_pushbutton = qt.QPushButton('Generate segments')
-        self.execution_area_layout.addWidget(self.generate_segments_pushbutton, 2, 0)
+        self.execution_area_layout.addWidget(self.generate_segments_pushbutton, 3, 0)
         self.generate_segments_pushbutton.setEnabled(False)
         self.optimal_display_pushbutton = qt.QPushButton('Optimal display')
-        self.execution_area_layout.addWidget(self.optimal_display_pushbutton, 2, 1)
+        self.execution_area_layout.addWidget(self.optimal_display_pushbutton, 3, 1)
         self.optimal_display_pushbutton.setEnabled(False)
 
         self.set_default_execution_area()
@@ -67,25 +72,22 @@ class DiagnosisExecutionWidget(qt.QWidget):
         self.run_model_pushbutton.setText('RADS processing...')
         self.cancel_model_run_pushbutton.setEnabled(True)
         self.generate_segments_pushbutton.setEnabled(False)
+        self.execution_progress_textedit.setPlainText('')
+        self.execution_progressbar.setValue(0)
+        self.execution_progressbar.setFormat('%p%')
 
     def on_logic_event_end(self):
         self.set_default_execution_area()
         self.run_model_pushbutton.setEnabled(True)
         self.generate_segments_pushbutton.setEnabled(True)
 
-    def on_logic_event_progress(self, progress, log):
-        # @TODO. Should the number of steps be known beforehand (in the json) to indicate 1/5, 2/5, etc...
-        # @TODO. Should a timer be used to indicate elapsed time for each task?
-        if 'SLICERLOG' in log:
-            task = log.split(':')[1].split('-')[0].strip()
-            status = log.split(':')[1].split('-')[1].strip()
-            log_text = self.execution_progress_textedit.plainText
-            new_log_text = ''
-            if status == 'Begin':
-                new_log_text = str(log_text) + task + ': ...'
-            elif status == 'End':
-                new_log_text = str(log_text)[:-3] + 'Done' + '\n'
-
-            self.execution_progress_textedit.setText(new_log_text)
+    def on_logic_event_progress(self, event):
+        if event.kind == 'stage_begin':
+            self.execution_progress_textedit.setText(str(self.execution_progress_textedit.plainText)
+                                                     + event.stage + ': ...')
+        elif event.kind == 'stage_end':
+            self.execution_progress_textedit.setText(str(self.execution_progress_textedit.plainText)[:-3]
+                                                     + 'Done ({:.1f} s)'.format(event.stage_duration) + '\n')
+        if event.kind != 'log':
             self.execution_progress_textedit.moveCursor(qt.QTextCursor.End)
-            # self.execution_progress_textedit.append(log)
\ No newline at end of file
+        update_progressbar(self.execution_progressbar, event)
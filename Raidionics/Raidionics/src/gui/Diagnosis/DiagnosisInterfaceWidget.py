@@ -11,6 +11,7 @@ if sys.version_info.major == 3:
 from src.utils.resources import SharedResources
 from src.logic.model_parameters import *
 from src.RaidionicsLogic import RaidionicsLogic
+from src.utils.docker_utilities import DockerMetadataCache
 from src.utils.io_utilities import get_available_cloud_diagnoses_list, download_cloud_diagnosis, check_local_diagnosis_for_update
 from src.gui.UtilsWidgets.DownloadDialog import DownloadDialog
 
@@ -99,28 +100,7 @@ class DiagnosisInterfaceWidget(qt.QWidget):
         self.cloud_diagnosis_download_pushbutton.clicked.connect(self.on_cloud_diagnosis_download_selected)
 
     def get_existing_digests(self):
-        cmd = []
-        cmd.append(SharedResources.getInstance().docker_path)
-        cmd.append('images')
-        cmd.append('--digests')
-        # print(cmd)
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        digest_index = 2
-        digests = []
-        try:
-            while True:
-                slicer.app.processEvents()
-                line = p.stdout.readline()
-                if not line:
-                    break
-                line = line.split()
-                if 'DIGEST' in line:
-                    digest_index = line.index('DIGEST')
-                else:
-                    digests.append(line[digest_index])
-        except Exception as e:
-            print("Exception: {}".format(e))
-        return digests
+        return DockerMetadataCache.getInstance().image_digests()
 
     def populate_cloud_diagnosis(self):
         self.cloud_diagnosis_list = []
@@ -234,7 +214,6 @@ class DiagnosisInterfaceWidget(qt.QWidget):
     def on_cloud_diagnosis_download_selected(self):
         # @TODO. Not ideal as it requires to click twice on download, but at least it will hang
         # during pop-up time, should be more understandable for the user.
-        digests = self.get_existing_digests()
         selected_diagnosis = self.cloud_diagnosis_selector_combobox.currentText
         diag = DownloadDialog(self)
         diag.set_diagnosis_name(selected_diagnosis)
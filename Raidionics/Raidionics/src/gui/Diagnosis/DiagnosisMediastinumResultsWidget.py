@@ -72,7 +72,7 @@ class DiagnosisMediastinumResultsWidget(qt.QWidget):
         self.results_widgets = {}
 
     def update_results(self):
-        diagnosis_file = os.path.join(SharedResources.getInstance().output_path, 'Diagnosis.json')
+        diagnosis_file = os.path.join(RaidionicsLogic.getInstance().results_path, 'Diagnosis.json')
         MediastinumDiagnosisParameters.getInstance().from_json(diagnosis_file)
 
         self.__clean_results_area()
@@ -118,8 +118,8 @@ class DiagnosisNeuroResultsWidget(qt.QWidget):
         filepath = qt.QFileDialog.getSaveFileName(self, self.tr("Save standardized report"),
                                                   os.path.expanduser('~'), self.tr("Report files (*.txt *.csv *.json)"))
         extension = filepath.split('.')[-1]
-        if os.path.exists(os.path.join(SharedResources.getInstance().output_path, 'Diagnosis.' + extension)):
-            shutil.copy(src=os.path.join(SharedResources.getInstance().output_path, 'Diagnosis.' + extension),
+        if RaidionicsLogic.getInstance().results_path is not None and os.path.exists(os.path.join(RaidionicsLogic.getInstance().results_path, 'Diagnosis.' + extension)):
+            shutil.copy(src=os.path.join(RaidionicsLogic.getInstance().results_path, 'Diagnosis.' + extension),
                         dst=filepath)
 
     def __clean_results_area(self):
@@ -139,7 +139,7 @@ class DiagnosisNeuroResultsWidget(qt.QWidget):
             self.results_widgets[str(i+1)] = w
 
     def update_results(self):
-        diagnosis_file = os.path.join(SharedResources.getInstance().output_path, 'neuro_clinical_report.json')
+        diagnosis_file = os.path.join(RaidionicsLogic.getInstance().results_path, 'neuro_clinical_report.json')
         NeuroDiagnosisParameters.getInstance().from_json(diagnosis_file)
 
         self.__clean_results_area()
@@ -23,6 +23,13 @@ from src.RaidionicsLogic import *
 from src.gui.Segmentation.BaseSegmentationWidget import BaseSegmentationWidget
 from src.gui.Diagnosis.BaseDiagnosisWidget import BaseDiagnosisWidget
 from src.utils.resources import SharedResources
+from src.utils.docker_utilities import DockerMetadataCache
+from src.utils.backend_worker import BackendWorker
+from src.utils.backend_execution import check_native_backend, check_in_process_backend
+from src.utils.workspace_utilities import collect_workspaces_async, release_memory_scratch
+from src.utils.staging_cache import StagingCache
+from src.utils.result_cache import ResultCache
+from src.utils.volume_codecs import TRANSFER_FORMATS
 
 
 class WarningDialog(qt.QDialog):
@@ -68,6 +75,8 @@ class RaidionicsWidget():
         self.logic = None
         shared = SharedResources.getInstance()
         shared.set_environment()
+        # Workspaces left by the previous sessions are cleaned in the background.
+        collect_workspaces_async()
 
     def setup(self):
         """
@@ -111,6 +120,55 @@ class RaidionicsWidget():
         dockerForm.addRow("Docker Executable Path:", self.dockerPath)
         self.docker_test_pushbutton = qt.QPushButton('Test!')
         dockerForm.addRow("Test Docker Configuration:", self.docker_test_pushbutton)
+        self.backend_mode_combobox = qt.QComboBox()
+        self.backend_mode_combobox.addItems(['Docker', 'Native (local environment)', 'In-process (Slicer Python)'])
+        self.backend_mode_combobox.setToolTip("Run the backend in its Docker image, directly from a local Python "
+                                              "environment where raidionics_rads is installed (no image pull nor "
+                                              "container overhead), or inside Slicer if raidionics_rads is installed "
+                                              "in the Slicer Python (uncompressed volumes exchanged in memory).")
+        dockerForm.addRow("Backend execution:", self.backend_mode_combobox)
+        self.native_backend_python_path = ctk.ctkPathLineEdit()
+        self.native_backend_python_path.setToolTip("Python interpreter of the local backend environment, e.g. "
+                                                   "<venv>/bin/python.")
+        self.native_backend_python_path.setEnabled(False)
+        dockerForm.addRow("Backend environment Python:", self.native_backend_python_path)
+        self.native_backend_test_pushbutton = qt.QPushButton('Test!')
+        self.native_backend_test_pushbutton.setEnabled(False)
+        dockerForm.addRow("Test backend environment:", self.native_backend_test_pushbutton)
+        self.docker_warm_backend_checkbox = ctk.ctkCheckBox()
+        self.docker_warm_backend_checkbox.setToolTip("Keep one backend container running for the whole session, and "
+                                                     "dispatch each run to it instead of starting a new container.")
+        dockerForm.addRow("Warm backend container:", self.docker_warm_backend_checkbox)
+        self.docker_engine_api_checkbox = ctk.ctkCheckBox()
+        self.docker_engine_api_checkbox.setToolTip("Talk to the Docker daemon through its local socket instead of "
+                                                   "calling the Docker executable (Linux and macOS only).")
+        dockerForm.addRow("Use Docker Engine API:", self.docker_engine_api_checkbox)
+        self.docker_cpus_spinbox = qt.QDoubleSpinBox()
+        self.docker_cpus_spinbox.setRange(0., 256.)
+        self.docker_cpus_spinbox.setSingleStep(0.5)
+        self.docker_cpus_spinbox.setSpecialValueText('Auto')
+        self.docker_cpus_spinbox.setToolTip("Maximum number of CPUs used by the backend (Auto: all but the cores "
+                                            "reserved for Slicer). Split between the jobs running in parallel.")
+        dockerForm.addRow("Backend CPUs:", self.docker_cpus_spinbox)
+        self.docker_reserved_cores_spinbox = qt.QSpinBox()
+        self.docker_reserved_cores_spinbox.setRange(0, 64)
+        self.docker_reserved_cores_spinbox.setValue(SharedResources.getInstance().container_reserved_cores)
+        self.docker_reserved_cores_spinbox.setToolTip("Number of cores kept free for Slicer rendering and interactions.")
+        dockerForm.addRow("Cores reserved for Slicer:", self.docker_reserved_cores_spinbox)
+        self.docker_memory_spinbox = qt.QSpinBox()
+        self.docker_memory_spinbox.setRange(0, 1024 * 1024)
+        self.docker_memory_spinbox.setSingleStep(512)
+        self.docker_memory_spinbox.setSuffix(' MB')
+        self.docker_memory_spinbox.setSpecialValueText('No limit')
+        self.docker_memory_spinbox.setToolTip("Memory limit of the backend, split between the jobs running in parallel.")
+        dockerForm.addRow("Backend memory:", self.docker_memory_spinbox)
+        self.docker_shm_size_spinbox = qt.QSpinBox()
+        self.docker_shm_size_spinbox.setRange(0, 64 * 1024)
+        self.docker_shm_size_spinbox.setSingleStep(256)
+        self.docker_shm_size_spinbox.setSuffix(' MB')
+        self.docker_shm_size_spinbox.setSpecialValueText('Default')
+        self.docker_shm_size_spinbox.setToolTip("Shared memory size (/dev/shm) of each backend container.")
+        dockerForm.addRow("Backend shared memory:", self.docker_shm_size_spinbox)
         if platform.system() == 'Darwin':
             self.dockerPath.setCurrentPath('/usr/local/bin/docker')
         if platform.system() == 'Linux':
@@ -147,6 +205,72 @@ class RaidionicsWidget():
         self.global_options_purge_models_pushbutton.setToolTip("Click to purge the computer from all existing Raidionics models.")
         self.global_options_purge_models_pushbutton.setFixedHeight(25)
         self.global_options_groupbox_layout.addRow("Purge Raidionics models:", self.global_options_purge_models_pushbutton)
+        # option 4: backend inference speed/accuracy trade-off
+        self.global_options_performance_profile_combobox = qt.QComboBox()
+        self.global_options_performance_profile_combobox.addItems(['Fast', 'Balanced', 'Accurate'])
+        self.global_options_performance_profile_combobox.setCurrentText(SharedResources.getInstance().performance_profile.capitalize())
+        self.global_options_performance_profile_combobox.setToolTip("Inference settings of the backend: Fast (no overlap between patches, larger batches), Balanced (backend defaults), or Accurate (overlapping patches and test-time augmentation, slower).")
+        self.global_options_groupbox_layout.addRow("Performance profile:", self.global_options_performance_profile_combobox)
+        # option 5: reusing the results of previous identical runs
+        self.global_options_result_cache_checkbox = ctk.ctkCheckBox()
+        self.global_options_result_cache_checkbox.setChecked(SharedResources.getInstance().use_result_cache)
+        self.global_options_result_cache_checkbox.setToolTip("Click to reuse the results of a previous run when the same model is run again on the same inputs.")
+        self.global_options_groupbox_layout.addRow("Reuse cached results:", self.global_options_result_cache_checkbox)
+        self.global_options_purge_result_cache_pushbutton = ctk.ctkPushButton()
+        self.global_options_purge_result_cache_pushbutton.setToolTip("Click to delete all cached results.")
+        self.global_options_purge_result_cache_pushbutton.setFixedHeight(25)
+        self.global_options_groupbox_layout.addRow("Purge cached results:", self.global_options_purge_result_cache_pushbutton)
+        # option 6: reusing recent segmentations when running a RADS pipeline
+        self.global_options_segmentation_reuse_checkbox = ctk.ctkCheckBox()
+        self.global_options_segmentation_reuse_checkbox.setChecked(SharedResources.getInstance().use_segmentation_reuse)
+        self.global_options_segmentation_reuse_checkbox.setToolTip("Click to let the RADS pipelines reuse the segmentations recently computed on the same input volumes, instead of inferring them again.")
+        self.global_options_groupbox_layout.addRow("Reuse recent segmentations:", self.global_options_segmentation_reuse_checkbox)
+        # option 7: encoding of the volumes exchanged with the backend
+        self.global_options_transfer_format_combobox = qt.QComboBox()
+        self.global_options_transfer_format_combobox.addItems(['Uncompressed (.nii)', 'Gzip (.nii.gz)', 'Multithreaded gzip (.nii.gz)'])
+        self.global_options_transfer_format_combobox.setCurrentIndex(TRANSFER_FORMATS.index(SharedResources.getInstance().transfer_format))
+        self.global_options_transfer_format_combobox.setToolTip("Encoding of the volumes exchanged with the backend: uncompressed is the fastest but uses more disk space, multithreaded gzip compresses on all cores.")
+        self.global_options_groupbox_layout.addRow("Volume transfer format:", self.global_options_transfer_format_combobox)
+        self.global_options_compression_level_spinbox = qt.QSpinBox()
+        self.global_options_compression_level_spinbox.setRange(1, 9)
+        self.global_options_compression_level_spinbox.setValue(SharedResources.getInstance().transfer_compression_level)
+        self.global_options_compression_level_spinbox.setToolTip("Gzip compression level, from 1 (fastest) to 9 (smallest files).")
+        self.global_options_groupbox_layout.addRow("Compression level:", self.global_options_compression_level_spinbox)
+        # option 8: location of the run workspaces exchanged with the backend
+        self.global_options_scratch_location_combobox = qt.QComboBox()
+        self.global_options_scratch_location_combobox.addItems(['Resources folder', 'Memory (/dev/shm)', 'Custom folder'])
+        self.global_options_scratch_location_combobox.setCurrentIndex(['default', 'memory', 'custom'].index(SharedResources.getInstance().scratch_location))
+        self.global_options_scratch_location_combobox.setToolTip("Where the volumes exchanged with the backend are staged: in memory or on a fast local folder when the resources folder is on network storage. The resources folder is used when not enough space or memory is left.")
+        self.global_options_groupbox_layout.addRow("Run workspace location:", self.global_options_scratch_location_combobox)
+        self.global_options_scratch_path_lineedit = ctk.ctkPathLineEdit()
+        self.global_options_scratch_path_lineedit.filters = ctk.ctkPathLineEdit.Dirs
+        self.global_options_scratch_path_lineedit.setCurrentPath(SharedResources.getInstance().scratch_path)
+        self.global_options_scratch_path_lineedit.setEnabled(SharedResources.getInstance().scratch_location == 'custom')
+        self.global_options_scratch_path_lineedit.setToolTip("Scratch folder for the run workspaces, e.g. on a local SSD.")
+        self.global_options_groupbox_layout.addRow("Custom workspace folder:", self.global_options_scratch_path_lineedit)
+        # option 9: cropping the segmentation inputs to a region of interest
+        self.global_options_roi_crop_checkbox = ctk.ctkCheckBox()
+        self.global_options_roi_crop_checkbox.setChecked(SharedResources.getInstance().use_roi_crop)
+        self.global_options_roi_crop_checkbox.setToolTip("Click to export only the region of interest of the inputs (the selected ROI, or else the brain/lungs mask linked as output) plus a margin, the results being pasted back at the full size.")
+        self.global_options_groupbox_layout.addRow("ROI-cropped export:", self.global_options_roi_crop_checkbox)
+        self.global_options_roi_crop_node_combobox = slicer.qMRMLNodeComboBox()
+        self.global_options_roi_crop_node_combobox.nodeTypes = ["vtkMRMLMarkupsROINode", "vtkMRMLAnnotationROINode"]
+        self.global_options_roi_crop_node_combobox.noneEnabled = True
+        self.global_options_roi_crop_node_combobox.addEnabled = False
+        self.global_options_roi_crop_node_combobox.setMRMLScene(slicer.mrmlScene)
+        self.global_options_roi_crop_node_combobox.setToolTip("Region of interest to crop the inputs to, the brain/lungs mask being used if none.")
+        self.global_options_groupbox_layout.addRow("Region of interest:", self.global_options_roi_crop_node_combobox)
+        self.global_options_roi_crop_margin_spinbox = qt.QDoubleSpinBox()
+        self.global_options_roi_crop_margin_spinbox.setRange(0., 100.)
+        self.global_options_roi_crop_margin_spinbox.setSuffix(' mm')
+        self.global_options_roi_crop_margin_spinbox.setValue(SharedResources.getInstance().roi_crop_margin_mm)
+        self.global_options_roi_crop_margin_spinbox.setToolTip("Margin added around the region of interest on each side.")
+        self.global_options_groupbox_layout.addRow("ROI margin:", self.global_options_roi_crop_margin_spinbox)
+        # option 10: displaying each result as soon as written by the backend
+        self.global_options_output_streaming_checkbox = ctk.ctkCheckBox()
+        self.global_options_output_streaming_checkbox.setChecked(SharedResources.getInstance().use_output_streaming)
+        self.global_options_output_streaming_checkbox.setToolTip("Click to display each result as soon as the backend has written it (e.g., the tumor mask of a reporting pipeline), without waiting for the whole processing to finish.")
+        self.global_options_groupbox_layout.addRow("Display results as they come:", self.global_options_output_streaming_checkbox)
 
     def setup_user_interactions_widget(self):
         self.user_interactions_groupbox = ctk.ctkCollapsibleGroupBox()
@@ -185,8 +309,32 @@ class RaidionicsWidget():
         self.global_options_active_models_update_checkbox.stateChanged.connect(self.on_models_active_update_options_state_changed)
         self.global_options_purge_docker_images_pushbutton.clicked.connect(self.on_purge_docker_images_options_clicked)
         self.global_options_purge_models_pushbutton.clicked.connect(self.on_purge_models_options_clicked)
+        self.global_options_result_cache_checkbox.stateChanged.connect(self.on_result_cache_options_state_changed)
+        self.global_options_performance_profile_combobox.connect("currentIndexChanged(QString)", self.on_performance_profile_changed)
+        self.global_options_purge_result_cache_pushbutton.clicked.connect(self.on_purge_result_cache_options_clicked)
+        self.global_options_segmentation_reuse_checkbox.stateChanged.connect(self.on_segmentation_reuse_options_state_changed)
+        self.global_options_transfer_format_combobox.connect("currentIndexChanged(int)", self.on_transfer_format_changed)
+        self.global_options_compression_level_spinbox.valueChanged.connect(self.on_compression_level_changed)
+        self.global_options_scratch_location_combobox.connect("currentIndexChanged(int)", self.on_scratch_location_changed)
+        self.global_options_scratch_path_lineedit.connect("currentPathChanged(QString)", self.on_scratch_path_changed)
+        self.global_options_roi_crop_checkbox.stateChanged.connect(self.on_roi_crop_options_state_changed)
+        self.global_options_roi_crop_node_combobox.connect("currentNodeChanged(vtkMRMLNode*)", self.on_roi_crop_node_changed)
+        self.global_options_roi_crop_margin_spinbox.valueChanged.connect(self.on_roi_crop_margin_changed)
+        self.global_options_output_streaming_checkbox.stateChanged.connect(self.on_output_streaming_options_state_changed)
+        self.backend_mode_combobox.connect("currentIndexChanged(int)", self.on_backend_mode_changed)
+        self.native_backend_python_path.connect("currentPathChanged(QString)", self.on_native_backend_python_changed)
+        self.native_backend_test_pushbutton.connect('clicked(bool)', self.on_test_native_backend_button_pressed)
+        self.docker_warm_backend_checkbox.stateChanged.connect(self.on_warm_backend_state_changed)
+        self.docker_engine_api_checkbox.stateChanged.connect(self.on_docker_engine_api_state_changed)
+        self.docker_cpus_spinbox.valueChanged.connect(self.on_docker_resources_changed)
+        self.docker_reserved_cores_spinbox.valueChanged.connect(self.on_docker_resources_changed)
+        self.docker_memory_spinbox.valueChanged.connect(self.on_docker_resources_changed)
+        self.docker_shm_size_spinbox.valueChanged.connect(self.on_docker_resources_changed)
+        slicer.app.connect('aboutToQuit()', self.on_application_quit)
 
     def on_test_docker_button_pressed(self):
+        # Explicit check requested by the user, the cached Docker information is refreshed.
+        DockerMetadataCache.getInstance().invalidate()
         cmd = []
         cmd.append(self.dockerPath.currentPath)
         cmd.append('--version')
@@ -200,6 +348,60 @@ class RaidionicsWidget():
                                                            'installation and make sure that it is configured to '
                                                            'be run by non-root user.')
 
+    def on_backend_mode_changed(self, index):
+        mode = ['docker', 'native', 'in_process'][index]
+        native = mode != 'docker'
+        SharedResources.getInstance().backend_execution_mode = mode
+        self.native_backend_python_path.setEnabled(mode == 'native')
+        self.native_backend_test_pushbutton.setEnabled(native)
+        self.docker_warm_backend_checkbox.setEnabled(not native)
+        self.docker_engine_api_checkbox.setEnabled(not native)
+        if native and BackendWorker.getInstance().docker_image_name is not None:
+            BackendWorker.getInstance().stop()
+
+    def on_native_backend_python_changed(self, path):
+        SharedResources.getInstance().native_backend_python = path
+
+    def on_test_native_backend_button_pressed(self):
+        if SharedResources.getInstance().backend_execution_mode == 'in_process':
+            version = check_in_process_backend()
+        else:
+            version = check_native_backend(self.native_backend_python_path.currentPath)
+        if version is not None:
+            qt.QMessageBox.information(None, 'Backend environment', 'raidionics_rads {} is available in the '
+                                                                     'environment.'.format(version))
+        else:
+            qt.QMessageBox.critical(None, 'Backend environment', 'raidionics_rads could not be imported with this '
+                                                                  'Python interpreter, see the Python console for '
+                                                                  'details.')
+
+    def on_warm_backend_state_changed(self, state):
+        SharedResources.getInstance().use_warm_backend = False if state == 0 else True
+        if not SharedResources.getInstance().use_warm_backend:
+            BackendWorker.getInstance().stop()
+
+    def on_docker_engine_api_state_changed(self, state):
+        SharedResources.getInstance().use_docker_engine_api = False if state == 0 else True
+        DockerMetadataCache.getInstance().invalidate()
+
+    def on_docker_resources_changed(self, value):
+        SharedResources.getInstance().container_cpus = self.docker_cpus_spinbox.value
+        SharedResources.getInstance().container_reserved_cores = self.docker_reserved_cores_spinbox.value
+        SharedResources.getInstance().container_memory_mb = self.docker_memory_spinbox.value
+        SharedResources.getInstance().container_shm_size_mb = self.docker_shm_size_spinbox.value
+        # The limits of a running warm backend container cannot be changed, it is restarted at the next run.
+        if BackendWorker.getInstance().docker_image_name is not None:
+            BackendWorker.getInstance().stop()
+
+    def on_application_quit(self):
+        if BackendWorker.getInstance().docker_image_name is not None:
+            BackendWorker.getInstance().stop()
+        # The staged volumes are not reused across sessions, and would otherwise stay in memory (/dev/shm).
+        StagingCache.getInstance().invalidate()
+        # The raw values of the last run are memory-mapped files of the temporary folder (often tmpfs).
+        RaidionicsLogic.getInstance().output_raw_values.clear()
+        release_memory_scratch()
+
     def on_task_tabwidget_tabchanged(self):
         # @TODO. Should a clean-up be performed when moving between segmentation and diagnostic tasks?
         # self.tasks_tabwidget.currentWidget().reload()
@@ -224,15 +426,60 @@ class RaidionicsWidget():
     def on_logic_log_event(self, log):
         self.logging_textedit.append(log)
 
-    def on_logic_event_progress(self, task, progress, log):
+    def on_logic_event_progress(self, task, event):
         if task == 'segmentation':
-            self.base_segmentation_widget.on_logic_event_progress(progress, log)
+            self.base_segmentation_widget.on_logic_event_progress(event)
         elif task == 'reporting':
-            self.base_diagnosis_widget.on_logic_event_progress(progress, log)
+            self.base_diagnosis_widget.on_logic_event_progress(event)
 
     def on_models_active_update_options_state_changed(self, state):
         SharedResources.getInstance().global_active_model_update = False if state == 0 else True
 
+    def on_performance_profile_changed(self, profile):
+        SharedResources.getInstance().performance_profile = profile.lower()
+
+    def on_result_cache_options_state_changed(self, state):
+        SharedResources.getInstance().use_result_cache = False if state == 0 else True
+
+    def on_segmentation_reuse_options_state_changed(self, state):
+        SharedResources.getInstance().use_segmentation_reuse = False if state == 0 else True
+
+    def on_transfer_format_changed(self, index):
+        SharedResources.getInstance().transfer_format = TRANSFER_FORMATS[index]
+        self.global_options_compression_level_spinbox.setEnabled(TRANSFER_FORMATS[index] != 'nii')
+
+    def on_compression_level_changed(self, value):
+        SharedResources.getInstance().transfer_compression_level = value
+
+    def on_scratch_location_changed(self, index):
+        SharedResources.getInstance().scratch_location = ['default', 'memory', 'custom'][index]
+        self.global_options_scratch_path_lineedit.setEnabled(index == 2)
+
+    def on_scratch_path_changed(self, path):
+        SharedResources.getInstance().scratch_path = path
+
+    def on_roi_crop_options_state_changed(self, state):
+        SharedResources.getInstance().use_roi_crop = False if state == 0 else True
+
+    def on_roi_crop_node_changed(self, node):
+        SharedResources.getInstance().roi_crop_node_id = node.GetID() if node is not None else ''
+
+    def on_roi_crop_margin_changed(self, value):
+        SharedResources.getInstance().roi_crop_margin_mm = value
+
+    def on_output_streaming_options_state_changed(self, state):
+        SharedResources.getInstance().use_output_streaming = False if state == 0 else True
+
+    def on_purge_result_cache_options_clicked(self):
+        stats = ResultCache.getInstance().statistics()
+        popup = WarningDialog()
+        popup.setText("Are you sure you want to delete all cached results ({} runs, {:.1f} MB)?\n"
+                      "Current session: {} hits, {} misses.".format(stats['entries'], stats['size'] / (1024. * 1024.),
+                                                                    stats['hits'], stats['misses']))
+        code = popup.exec()
+        if code == 1:
+            ResultCache.getInstance().invalidate()
+
     def on_purge_docker_images_options_clicked(self):
         popup = WarningDialog()
         popup.setText("""Open the Docker Desktop Application and delete the following image: dbouget/raidionics-rads:v1.1\n
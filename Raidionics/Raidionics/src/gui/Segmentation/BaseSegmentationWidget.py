@@ -35,9 +35,6 @@ class BaseSegmentationWidget(qt.QWidget):
     def on_run_model(self):
         RaidionicsLogic.getInstance().logic_task = 'segmentation'
         RaidionicsLogic.getInstance().run(self.model_interface_widget.model_parameters)
-        if SharedResources.getInstance().user_configuration['Predictions']['reconstruction_method'] == 'probabilities':
-            self.model_execution_widget.populate_interactive_label_classes(self.model_interface_widget.model_parameters.outputs.keys())
-            self.on_interactive_best_threshold_clicked()
 
     def on_cancel_model_run(self):
         RaidionicsLogic.getInstance().cancel_run()
@@ -47,9 +44,14 @@ class BaseSegmentationWidget(qt.QWidget):
 
     def on_logic_event_end(self):
         self.model_execution_widget.on_logic_event_end()
+        # The run is asynchronous, the interactive thresholding is only available once the results have been imported.
+        if SharedResources.getInstance().user_configuration['Predictions']['reconstruction_method'] == 'probabilities'\
+                and len(RaidionicsLogic.getInstance().output_raw_values) != 0:
+            self.model_execution_widget.populate_interactive_label_classes(self.model_interface_widget.model_parameters.outputs.keys())
+            self.on_interactive_best_threshold_clicked()
 
-    def on_logic_event_progress(self, progress, log):
-        self.model_execution_widget.on_logic_event_progress(progress, log)
+    def on_logic_event_progress(self, event):
+        self.model_execution_widget.on_logic_event_progress(event)
 
     def on_interactive_slider_moved(self, value):
         self.model_execution_widget.on_interactive_slider_moved(value, self.model_interface_widget.model_parameters)
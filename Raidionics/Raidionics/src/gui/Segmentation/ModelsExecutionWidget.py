@@ -10,6 +10,7 @@ from copy import deepcopy
 
 from src.utils.resources import SharedResources
 from src.RaidionicsLogic import RaidionicsLogic
+from src.utils.progress_utilities import update_progressbar
 
 
 class ModelsExecutionWidget(qt.QWidget):
@@ -41,6 +42,10 @@ class ModelsExecutionWidget(qt.QWidget):
         self.model_execution_progress_textedit = qt.QTextEdit()
         self.model_execution_progress_textedit.setReadOnly(True)
         self.model_execution_area_layout.addWidget(self.model_execution_progress_textedit, 1, 1)
+        self.model_execution_progressbar = qt.QProgressBar()
+        self.model_execution_progressbar.setRange(0, 100)
+        self.model_execution_progressbar.setFormat('%p%')
+        self.model_execution_area_layout.addWidget(self.model_execution_progressbar, 2, 0, 1, 2)
 
         self.advanced_options_groupbox = qt.QGroupBox("Advanced options")
         self.advanced_options_groupbox.setCheckable(False)
@@ -70,7 +75,7 @@ class ModelsExecutionWidget(qt.QWidget):
         tmp_layout.addWidget(self.advanced_resampling_label, 1, 2)
         tmp_layout.addWidget(self.advanced_resampling_combobox, 1, 3)
         self.advanced_options_groupbox.setLayout(tmp_layout)
-        self.model_execution_area_layout.addWidget(self.advanced_options_groupbox, 2, 0, 1, 2)
+        self.model_execution_area_layout.addWidget(self.advanced_options_groupbox, 3, 0, 1, 2)
 
         self.set_default_execution_area()
 
@@ -178,32 +183,30 @@ class ModelsExecutionWidget(qt.QWidget):
         self.run_model_pushbutton.setText('Segmenting...')
         self.cancel_model_run_pushbutton.setEnabled(True)
         self.model_execution_progress_textedit.setPlainText('')
+        self.model_execution_progressbar.setValue(0)
+        self.model_execution_progressbar.setFormat('%p%')
         self.advanced_use_gpu_checkbox.setEnabled(False)
         self.advanced_resampling_combobox.setEnabled(False)
         self.advanced_predictions_type_combobox.setEnabled(False)
 
     def on_logic_event_end(self):
         self.set_default_execution_area()
+        self.model_execution_progressbar.setFormat('%p%')
         self.run_model_pushbutton.setEnabled(True)
         self.interactive_thresholding_slider.setEnabled(True)
         self.interactive_optimal_thr_pushbutton.setEnabled(True)
         self.interactive_options_area_groupbox.setChecked(True)
 
-    def on_logic_event_progress(self, progress, log):
-        # @TODO. Have to copy/paste how it is done inside Raidionics regarding the parsing of log messages
-        if 'LOG:' in log:
-            task = log.split(':')[1].split('-')[1].strip()
-            status = log.split(':')[1].split('-')[-1].strip().split('(')[0].strip()
-            log_text = self.model_execution_progress_textedit.plainText
-            new_log_text = ''
-            if status == 'Begin':
-                new_log_text = str(log_text) + task + ': ...'
-            elif status == 'End':
-                new_log_text = str(log_text)[:-3] + 'Done' + '\n'
-
-            self.model_execution_progress_textedit.setText(new_log_text)
+    def on_logic_event_progress(self, event):
+        if event.kind == 'stage_begin':
+            self.model_execution_progress_textedit.setText(str(self.model_execution_progress_textedit.plainText)
+                                                           + event.stage + ': ...')
+        elif event.kind == 'stage_end':
+            self.model_execution_progress_textedit.setText(str(self.model_execution_progress_textedit.plainText)[:-3]
+                                                           + 'Done ({:.1f} s)'.format(event.stage_duration) + '\n')
+        if event.kind != 'log':
             self.model_execution_progress_textedit.moveCursor(qt.QTextCursor.End)
-            # self.model_execution_progress_textedit.verticalScrollBar().setValue(self.model_execution_progress_textedit.verticalScrollBar().maximum())
+        update_progressbar(self.model_execution_progressbar, event)
 
     #@TODO. to finish
     def populate_interactive_label_classes(self, classes):
@@ -216,15 +219,13 @@ class ModelsExecutionWidget(qt.QWidget):
         try:
             current_class = self.interactive_thresholding_combobox.currentText
             value = float(value)
-            if current_class not in list(RaidionicsLogic.getInstance().output_raw_values.keys()):
+            if current_class not in RaidionicsLogic.getInstance().output_raw_values:
                 return
-            original_data = deepcopy(RaidionicsLogic.getInstance().output_raw_values[current_class])
             volume_node = slicer.util.getNode(model_parameters.outputs[current_class].GetName())
             arr = slicer.util.arrayFromVolume(volume_node)
             # Increase image contrast
             #arr[:] = original_data
-            arr[original_data < (value/100)] = 0
-            arr[original_data >= (value/100)] = 1
+            RaidionicsLogic.getInstance().output_raw_values.threshold(current_class, value/100, out=arr)
             slicer.util.arrayFromVolumeModified(volume_node)
             self.interactive_current_threshold_spinbox.setValue(value)
             # RaidionicsLogic.getInstance().current_class_thresholds[self.runtimeParametersThresholdClassCombobox.currentIndex] = value
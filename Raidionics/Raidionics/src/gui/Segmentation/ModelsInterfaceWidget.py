@@ -12,6 +12,7 @@ if sys.version_info.major == 3:
 from src.utils.resources import SharedResources
 from src.logic.model_parameters import *
 from src.RaidionicsLogic import RaidionicsLogic
+from src.utils.docker_utilities import DockerMetadataCache
 from src.utils.io_utilities import get_available_cloud_models_list, download_cloud_model, download_cloud_model_thread, check_local_model_for_update
 from src.gui.UtilsWidgets.DownloadDialog import DownloadDialog
 
@@ -210,7 +211,6 @@ class ModelsInterfaceWidget(qt.QWidget):
                     self.local_model_selector_combobox.addItem(j["name"], idx)
 
     def populate_local_models(self):
-        digests = self.get_existing_digests()
         jsonFiles = glob(SharedResources.getInstance().json_local_dir + "/*.json")
         jsonFiles = sorted(jsonFiles)
         #jsonFiles.sort(cmp=lambda x, y: cmp(os.path.basename(x), os.path.basename(y)))
@@ -239,28 +239,7 @@ class ModelsInterfaceWidget(qt.QWidget):
             self.local_model_moreinfo_pushbutton.setEnabled(False)
 
     def get_existing_digests(self):
-        cmd = []
-        cmd.append(SharedResources.getInstance().docker_path)
-        cmd.append('images')
-        cmd.append('--digests')
-        # print(cmd)
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        digest_index = 2
-        digests = []
-        try:
-            while True:
-                slicer.app.processEvents()
-                line = p.stdout.readline()
-                if not line:
-                    break
-                line = line.split()
-                if 'DIGEST' in line:
-                    digest_index = line.index('DIGEST')
-                else:
-                    digests.append(line[digest_index])
-        except Exception as e:
-            print("Exception: {}".format(e))
-        return digests
+        return DockerMetadataCache.getInstance().image_digests()
 
     def on_model_details_selected(self):
         index = self.local_model_selector_combobox.currentIndex
@@ -31,6 +31,7 @@ class DownloadDialog(qt.QDialog):
 
         self.worker = DownloadWorker()
         self.worker.finished_signal.connect(self.on_worker_finished)
+        self.worker.progress_signal.connect(self.on_worker_progress)
 
         # self.start_download_pushbutton.clicked.connect(self.on_worker_started())
         self.start_download_pushbuttonbox.clicked.connect(self.on_button_pressed)
@@ -74,6 +75,9 @@ class DownloadDialog(qt.QDialog):
             self.worker.onWorkerStart(model=self.model_name, diagnosis=self.diagnosis_name,
                                       docker_image=self.docker_image_name)
 
+    def on_worker_progress(self, status):
+        self.download_label.setText("Downloading, please wait ...\n{}".format(status))
+
     def on_worker_finished(self, success_state):
         if success_state:
             self.accept()
@@ -0,0 +1,108 @@
+import logging
+import socket
+import threading
+import time
+import traceback
+from queue import Queue, Empty
+from __main__ import qt
+
+
+class MainThreadDispatcher:
+    """
+    Delivers callables posted from any thread to the GUI thread, without polling.
+    Each post writes one byte to a local socket pair, whose reading end is watched by a QSocketNotifier inside the
+    Qt event loop. The GUI thread is therefore only woken up when there is actually something to process, and nothing
+    runs while idle. A low-frequency watchdog timer, only active during a run, bounds the waiting time of a callable to
+    watchdog_period_ms (as long as the event loop is responsive), even if a wakeup was coalesced or lost.
+    Must be instantiated from the GUI thread.
+    """
+    def __init__(self, watchdog_period_ms: int = 250):
+        self.watchdog_period_ms = watchdog_period_ms
+        self.__queue = Queue()
+        self.__stats_lock = threading.Lock()
+        self.__reset_statistics()
+
+        self.__read_socket, self.__write_socket = socket.socketpair()
+        self.__read_socket.setblocking(False)
+        self.__write_socket.setblocking(False)
+        self.__notifier = qt.QSocketNotifier(self.__read_socket.fileno(), qt.QSocketNotifier.Read)
+        self.__notifier.connect('activated(int)', self.__on_wakeup)
+        self.__watchdog = qt.QTimer()
+        self.__watchdog.setInterval(self.watchdog_period_ms)
+        self.__watchdog.connect('timeout()', self.process)
+
+    def __reset_statistics(self):
+        with self.__stats_lock:
+            self.__dispatched_count = 0
+            self.__total_latency = 0.
+            self.__max_latency = 0.
+
+    def start(self) -> None:
+        """
+        Arms the watchdog and resets the latency statistics, to be called at the beginning of a run.
+        """
+        self.__reset_statistics()
+        self.__watchdog.start()
+
+    def stop(self) -> None:
+        """
+        Disarms the watchdog, to be called at the end of a run. Callables posted afterwards are still delivered.
+        """
+        self.__watchdog.stop()
+        stats = self.latency_statistics()
+        if stats['count'] != 0:
+            logging.debug("Main thread dispatch latency over {} callbacks: mean {:.2f} ms, max {:.2f} ms"
+                          " (guaranteed upper bound {} ms).".format(stats['count'], stats['mean'], stats['max'],
+                                                                    stats['upper_bound']))
+
+    def post(self, f) -> None:
+        """
+        Queues the callable f for execution on the GUI thread. Safe to call from any thread.
+        """
+        self.__queue.put((time.perf_counter(), f))
+        try:
+            self.__write_socket.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # The socket buffer is full, the GUI thread has many wakeups pending already.
+            pass
+
+    def process(self) -> None:
+        """
+        Executes all the pending callables, in the order they were posted.
+        """
+        while True:
+            try:
+                posted_time, f = self.__queue.get_nowait()
+            except Empty:
+                break
+            latency = (time.perf_counter() - posted_time) * 1000.
+            with self.__stats_lock:
+                self.__dispatched_count += 1
+                self.__total_latency += latency
+                self.__max_latency = max(self.__max_latency, latency)
+            try:
+                if callable(f):
+                    f()
+            except Exception:
+                logging.error("Main thread dispatch error:\n{}".format(traceback.format_exc()))
+
+    def latency_statistics(self) -> dict:
+        """
+        Return
+        ------
+        dict
+            Number of dispatched callables since the last start, mean and max measured latency between post and
+            execution (in ms), and the latency upper bound guaranteed by the watchdog (in ms).
+        """
+        with self.__stats_lock:
+            mean = self.__total_latency / self.__dispatched_count if self.__dispatched_count != 0 else 0.
+            return {'count': self.__dispatched_count, 'mean': mean, 'max': self.__max_latency,
+                    'upper_bound': self.watchdog_period_ms}
+
+    def __on_wakeup(self, fd):
+        try:
+            while self.__read_socket.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        self.process()
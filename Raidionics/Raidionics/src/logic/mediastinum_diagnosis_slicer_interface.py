@@ -8,6 +8,7 @@ from __main__ import qt, ctk, slicer, vtk
 import SimpleITK as sitk
 import sitkUtils
 from src.utils.resources import SharedResources
+from src.RaidionicsLogic import RaidionicsLogic
 from src.logic.mediastinum_diagnosis_result_parameters import *
 
 
@@ -84,7 +85,7 @@ class MediastinumDiagnosisSlicerInterface:
 
                     if 'description' in iodict[output] and iodict[output]['description'] == 'True':
                         desc_info = []
-                        csv_filename = str(os.path.join(SharedResources.getInstance().output_path, output + '_description.csv'))
+                        csv_filename = str(os.path.join(RaidionicsLogic.getInstance().results_path, output + '_description.csv'))
                         file = open(csv_filename, 'r')
                         csvfile = csv.DictReader(file)
                         for row in csvfile:
@@ -100,7 +101,7 @@ class MediastinumDiagnosisSlicerInterface:
                 else:
                     desc_info = []
                     csv_filename = str(
-                        os.path.join(SharedResources.getInstance().output_path, output + '_description.csv'))
+                        os.path.join(RaidionicsLogic.getInstance().results_path, output + '_description.csv'))
                     file = open(csv_filename, 'r')
                     csvfile = csv.DictReader(file)
                     for row in csvfile:
@@ -110,7 +111,7 @@ class MediastinumDiagnosisSlicerInterface:
                     self.segmentation_nodes_descriptions[output] = desc_info
                     for l in desc_info:
                         item_name = l['text']
-                        item_label_filename = os.path.join(SharedResources.getInstance().output_path,
+                        item_label_filename = os.path.join(RaidionicsLogic.getInstance().results_path,
                                                            '_'.join(item_name.split(' ')) + '_mni_tract_to_input.nii.gz')
                         if os.path.exists(item_label_filename):
                             node = slicer.vtkMRMLLabelMapVolumeNode()
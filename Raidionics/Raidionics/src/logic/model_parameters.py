@@ -3,6 +3,7 @@ import SimpleITK as sitk
 import sitkUtils
 import re
 from src.utils.resources import SharedResources
+from src.utils.backend_utilities import create_iodict
 
 
 class ModelParameters(object):
@@ -39,46 +40,7 @@ class ModelParameters(object):
         return self.reCamelCase.sub(r' \1', str)
 
     def create_iodict(self, json_dict):
-        iodict = dict()
-        for member in json_dict["members"]:
-            if "type" in member:
-                t = member["type"]
-                if t in ["uint8_t", "int8_t",
-                           "uint16_t", "int16_t",
-                           "uint32_t", "int32_t",
-                           "uint64_t", "int64_t",
-                           "unsigned int", "int",
-                           "double", "float"]:
-                    iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"],
-                                                            "value": member["default"]}
-                elif t in ["volume"]:
-                    iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"],
-                                              "voltype": member["voltype"]}
-                    if 'importance' in member:
-                        iodict[member["name"]]['importance'] = member['importance']
-                    if 'sequence_type' in member:
-                        iodict[member["name"]]['sequence_type'] = member['sequence_type']
-                    if 'timestamp_order' in member:
-                        iodict[member["name"]]['timestamp_order'] = member['timestamp_order']
-                    if 'description' in member:
-                        iodict[member["name"]]['description'] = member['description']
-                    if 'threshold' in member:
-                        iodict[member["name"]]['threshold'] = member['threshold']
-                    if 'color' in member:
-                        iodict[member["name"]]['color'] = member['color']
-                    if 'atlas_category' in member:
-                        iodict[member["name"]]['atlas_category'] = member['atlas_category']
-                elif t in ["configuration"]:
-                    iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"]}
-                    if 'default' in member:
-                        iodict[member["name"]]['default'] = member['default']
-                elif t in ["text"]:
-                    iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"]}
-                    if 'default' in member:
-                        iodict[member["name"]]['default'] = member['default']
-                else:
-                    iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"]}
-        return iodict
+        return create_iodict(json_dict)
 
     def create_model_info(self, json_dict):
         dockerImageName = json_dict['docker']['dockerhub_repository']
@@ -56,34 +56,40 @@ class NeuroDiagnosisParameters:
             # lobes_overlap_o = collections.OrderedDict(sorted(lobes_overlap.items(), key=operator.itemgetter(1), reverse=True))
             # self.statistics['Main']['CoM'].mni_space_lobes_overlap = lobes_overlap_o
 
-            self.statistics['Main']['Overall'].original_space_tumor_volume = self.json_content['Main']['Total']['Volume original (ml)']
-            if self.statistics['Main']['Overall'].original_space_tumor_volume is None:
-                self.statistics['Main']['Overall'].original_space_tumor_volume = -1
-            self.statistics['Main']['Overall'].mni_space_tumor_volume = self.json_content['Main']['Total']['Volume in MNI (ml)']
-            if self.statistics['Main']['Overall'].mni_space_tumor_volume is None:
-                self.statistics['Main']['Overall'].mni_space_tumor_volume = -1
-            self.statistics['Main']['Overall'].left_laterality_percentage = self.json_content['Main']['Total']['Left laterality (%)']
-            if self.statistics['Main']['Overall'].left_laterality_percentage is None:
-                self.statistics['Main']['Overall'].left_laterality_percentage = -1
-            self.statistics['Main']['Overall'].right_laterality_percentage = self.json_content['Main']['Total']['Right laterality (%)']
-            if self.statistics['Main']['Overall'].right_laterality_percentage is None:
-                self.statistics['Main']['Overall'].right_laterality_percentage = -1
-            self.statistics['Main']['Overall'].laterality_midline_crossing = self.json_content['Main']['Total']['Midline crossing']
+            # The features of the atlases left out of the run (see the atlas selection) are missing from the report.
+            total = self.json_content['Main']['Total'] if 'Main' in self.json_content and \
+                'Total' in self.json_content['Main'] else {}
+            overall = self.statistics['Main']['Overall']
+            overall.original_space_tumor_volume = total.get('Volume original (ml)', None)
+            if overall.original_space_tumor_volume is None:
+                overall.original_space_tumor_volume = -1
+            overall.mni_space_tumor_volume = total.get('Volume in MNI (ml)', None)
+            if overall.mni_space_tumor_volume is None:
+                overall.mni_space_tumor_volume = -1
+            overall.left_laterality_percentage = total.get('Left laterality (%)', None)
+            if overall.left_laterality_percentage is None:
+                overall.left_laterality_percentage = -1
+            overall.right_laterality_percentage = total.get('Right laterality (%)', None)
+            if overall.right_laterality_percentage is None:
+                overall.right_laterality_percentage = -1
+            overall.laterality_midline_crossing = total.get('Midline crossing', None)
 
             if self.tumor_type == 'Glioblastoma':
-                self.statistics['Main']['Overall'].mni_space_expected_residual_tumor_volume = self.json_content['Main']['Total']['ExpectedResidualVolume (ml)']
-                self.statistics['Main']['Overall'].mni_space_resectability_index = self.json_content['Main']['Total']['ResectionIndex']
+                overall.mni_space_expected_residual_tumor_volume = total.get('ExpectedResidualVolume (ml)', None)
+                overall.mni_space_resectability_index = total.get('ResectionIndex', None)
 
             # @TODO. Have to fix it based on the actual format, see end of page
-            for a in self.json_content['Main']['Total']['CorticalStructures'].keys():
-                structures_overlap_o = collections.OrderedDict(sorted(self.json_content['Main']['Total']['CorticalStructures'][a].items(), key=operator.itemgetter(1), reverse=True))
-                self.statistics['Main']['Overall'].mni_space_cortical_structures_overlap[a] = structures_overlap_o
-
-            for a in self.json_content['Main']['Total']['SubcorticalStructures'].keys():
-                structures_overlap_o = collections.OrderedDict(sorted(self.json_content['Main']['Total']['SubcorticalStructures'][a]['Overlap'].items(), key=operator.itemgetter(1), reverse=True))
-                self.statistics['Main']['Overall'].mni_space_subcortical_structures_overlap[a] = structures_overlap_o
-                structures_distance_o = collections.OrderedDict(sorted(self.json_content['Main']['Total']['SubcorticalStructures'][a]['Distance'].items(), key=operator.itemgetter(1), reverse=False))
-                self.statistics['Main']['Overall'].mni_space_subcortical_structures_distance[a] = structures_distance_o
+            cortical_structures = total.get('CorticalStructures', None) or {}
+            for a in cortical_structures.keys():
+                structures_overlap_o = collections.OrderedDict(sorted(cortical_structures[a].items(), key=operator.itemgetter(1), reverse=True))
+                overall.mni_space_cortical_structures_overlap[a] = structures_overlap_o
+
+            subcortical_structures = total.get('SubcorticalStructures', None) or {}
+            for a in subcortical_structures.keys():
+                structures_overlap_o = collections.OrderedDict(sorted(subcortical_structures[a].get('Overlap', {}).items(), key=operator.itemgetter(1), reverse=True))
+                overall.mni_space_subcortical_structures_overlap[a] = structures_overlap_o
+                structures_distance_o = collections.OrderedDict(sorted(subcortical_structures[a].get('Distance', {}).items(), key=operator.itemgetter(1), reverse=False))
+                overall.mni_space_subcortical_structures_distance[a] = structures_distance_o
 
             # tracts_overlap = {item[0]: item[1] for item in self.json_content['Main']['Total']['Tract']['Overlap']}
             # tracts_overlap_o = collections.OrderedDict(sorted(tracts_overlap.items(), key=operator.itemgetter(1), reverse=True))
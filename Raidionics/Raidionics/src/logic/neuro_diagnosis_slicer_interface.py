@@ -11,6 +11,8 @@ from __main__ import qt, ctk, slicer, vtk
 import SimpleITK as sitk
 import sitkUtils
 from src.utils.resources import SharedResources
+from src.RaidionicsLogic import RaidionicsLogic
+from src.utils.backend_utilities import is_atlas_output_selected
 from src.logic.neuro_diagnosis_result_parameters import *
 
 
@@ -71,6 +73,9 @@ class NeuroDiagnosisSlicerInterface:
 
         for output in outputs.keys():
             try:
+                if not is_atlas_output_selected(iodict, output):
+                    # Atlas left out of the run, nothing was generated for it.
+                    continue
                 if output != 'Tracts':
                     output_node = outputs[output]
                     seg_node = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode')
@@ -88,7 +93,10 @@ class NeuroDiagnosisSlicerInterface:
 
                     if 'description' in iodict[output] and iodict[output]['description'] == 'True':
                         desc_info = []
-                        csv_filename = str(os.path.join(SharedResources.getInstance().output_path, "atlas_descriptions", output + '_description.csv'))
+                        csv_filename = str(os.path.join(RaidionicsLogic.getInstance().results_path, "atlas_descriptions", output + '_description.csv'))
+                        if not os.path.exists(csv_filename):
+                            logging.info("No atlas description available for {}.".format(output))
+                            continue
                         file = open(csv_filename, 'r')
                         csvfile = csv.DictReader(file)
                         for row in csvfile:
@@ -106,7 +114,7 @@ class NeuroDiagnosisSlicerInterface:
                 else:
                     desc_info = []
                     csv_filename = str(
-                        os.path.join(SharedResources.getInstance().output_path, output + '_description.csv'))
+                        os.path.join(RaidionicsLogic.getInstance().results_path, output + '_description.csv'))
                     file = open(csv_filename, 'r')
                     csvfile = csv.DictReader(file)
                     for row in csvfile:
@@ -116,7 +124,7 @@ class NeuroDiagnosisSlicerInterface:
                     self.segmentation_nodes_descriptions[output] = desc_info
                     for l in desc_info:
                         item_name = l['text']
-                        item_label_filename = os.path.join(SharedResources.getInstance().output_path,
+                        item_label_filename = os.path.join(RaidionicsLogic.getInstance().results_path,
                                                            '_'.join(item_name.split(' ')) + '_mni_tract_to_input.nii.gz')
                         if os.path.exists(item_label_filename):
                             node = slicer.vtkMRMLLabelMapVolumeNode()
@@ -193,6 +201,9 @@ class NeuroDiagnosisSlicerInterface:
                     elif output in NeuroDiagnosisParameters.getInstance().statistics['Main']['Overall'].mni_space_subcortical_structures_overlap.keys():
                         struct_overlap_info = NeuroDiagnosisParameters.getInstance().statistics['Main']['Overall'].mni_space_subcortical_structures_overlap[output]
 
+                    if struct_overlap_info is None or output not in self.segmentation_nodes.keys():
+                        # Atlas not computed in the run, or without segments generated.
+                        continue
                     node = self.segmentation_nodes[output]
                     display_node = node.GetDisplayNode()
                     display_node.SetAllSegmentsVisibility(False)
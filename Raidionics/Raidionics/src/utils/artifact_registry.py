@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+
+from src.utils.resources import SharedResources
+from src.utils.volume_codecs import write_volume
+
+
+def strip_volume_extension(filename: str) -> str:
+    """
+    Removes the volume file extension (.nii or .nii.gz), the inputs of an artifact being identified regardless of the
+    transfer format they were exchanged with.
+    """
+    for extension in ['.nii.gz', '.nii']:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+class SegmentationArtifactRegistry:
+    """
+    Singleton class keeping track of the segmentation masks produced by the recent runs, so that a RADS pipeline run
+    on the same input volumes can reuse them instead of inferring the same structures again.
+    An artifact is described by the model which produced it, the segmented structure (target), and the content
+    fingerprints of the input volumes it was computed from (see result_cache.image_fingerprint), indexed by their
+    location without extension.
+    """
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if SegmentationArtifactRegistry.__instance == None:
+            SegmentationArtifactRegistry()
+        return SegmentationArtifactRegistry.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if SegmentationArtifactRegistry.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            SegmentationArtifactRegistry.__instance = self
+            self.__init_base_variables()
+
+    def __init_base_variables(self):
+        self.registry_path = os.path.join(SharedResources.getInstance().Raidionics_dir, 'artifacts')
+        os.makedirs(self.registry_path, exist_ok=True)
+        self.registry_filename = os.path.join(self.registry_path, 'registry.json')
+        self.max_artifacts = 50
+        self.__lock = threading.Lock()
+        self.__artifacts = []
+        try:
+            if os.path.exists(self.registry_filename):
+                with open(self.registry_filename, 'r') as infile:
+                    self.__artifacts = json.load(infile)
+        except Exception:
+            logging.warning("Segmentation artifacts registry could not be loaded, starting from scratch.")
+            logging.warning(traceback.format_exc())
+        self.__artifacts = [a for a in self.__artifacts if os.path.exists(a['filename'])]
+        for a in self.__artifacts:
+            a['inputs'] = self.__strip_extensions(a['inputs'])
+
+    def register(self, model_name: str, target: str, input_fingerprints: dict, image) -> None:
+        """
+        Stores a copy of a segmentation mask (SimpleITK image, binary or labels) produced by a run.
+
+        Parameters
+        ----------
+        model_name: str
+            Name of the model which produced the mask.
+        target: str
+            Name of the segmented structure, e.g. Tumor or Brain.
+        input_fingerprints: dict
+            Fingerprint of each input volume of the run, indexed by its location relative to the run data folder.
+        image: SimpleITK.Image
+            Segmentation mask.
+        """
+        artifact_id = uuid.uuid4().hex
+        filename = os.path.join(self.registry_path, artifact_id + '.nii.gz')
+        input_fingerprints = self.__strip_extensions(input_fingerprints)
+        try:
+            write_volume(image, filename, 'nii.gz-mt')
+        except Exception:
+            logging.warning("Segmentation artifact for {} could not be stored.".format(target))
+            logging.warning(traceback.format_exc())
+            return
+        with self.__lock:
+            # A newer mask for the same structure and inputs replaces the previous one.
+            replaced = [a for a in self.__artifacts if self.__matches(a, model_name, target, input_fingerprints)]
+            self.__artifacts = [a for a in self.__artifacts if a not in replaced]
+            self.__artifacts.append({'id': artifact_id, 'model_name': model_name, 'target': target,
+                                     'inputs': input_fingerprints, 'filename': filename, 'created': time.time()})
+            removed = replaced + self.__artifacts[:-self.max_artifacts]
+            self.__artifacts = self.__artifacts[-self.max_artifacts:]
+            self.__save()
+        for a in removed:
+            if os.path.exists(a['filename']):
+                os.remove(a['filename'])
+
+    def find(self, model_name: str, target: str, input_fingerprints: dict) -> str:
+        """
+        Looks for a recent mask of the structure produced by the model from exactly the same input volumes.
+
+        Return
+        ------
+        str
+            Location of the mask on disk, or None if no compatible artifact exists.
+        """
+        max_age = SharedResources.getInstance().artifact_max_age_hours * 3600.
+        input_fingerprints = self.__strip_extensions(input_fingerprints)
+        with self.__lock:
+            for a in reversed(self.__artifacts):
+                if self.__matches(a, model_name, target, input_fingerprints) and time.time() - a['created'] < max_age \
+                        and os.path.exists(a['filename']):
+                    return a['filename']
+        return None
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__artifacts = []
+            shutil.rmtree(self.registry_path, ignore_errors=True)
+            os.makedirs(self.registry_path, exist_ok=True)
+
+    @staticmethod
+    def __strip_extensions(input_fingerprints: dict) -> dict:
+        return {strip_volume_extension(k): v for k, v in input_fingerprints.items()}
+
+    @staticmethod
+    def __matches(artifact: dict, model_name: str, target: str, input_fingerprints: dict) -> bool:
+        return (model_name is None or artifact['model_name'] == model_name) and \
+            artifact['target'].lower() == target.lower() and artifact['inputs'] == input_fingerprints
+
+    def __save(self) -> None:
+        try:
+            with open(self.registry_filename + '.tmp', 'w') as outfile:
+                json.dump(self.__artifacts, outfile, indent=4)
+            os.replace(self.registry_filename + '.tmp', self.registry_filename)
+        except Exception:
+            logging.warning("Segmentation artifacts registry could not be saved.")
+            logging.warning(traceback.format_exc())
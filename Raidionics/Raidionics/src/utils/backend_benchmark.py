@@ -0,0 +1,91 @@
+"""
+Side-by-side benchmark of the backend execution modes, i.e. Docker container and native local environment, processing
+the same cohort with the batch runner. Both modes are run alternately (without cached results), and the per-run
+aggregate statistics are written in <output>/backend_benchmark.csv.
+
+Usage, from <module_dir>:
+    python -m src.utils.backend_benchmark --manifest cohort.csv --model <name> --output <folder>
+        --native-python <venv>/bin/python [--repeats 2] [--jobs 1] [--profile balanced]
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+if __name__ == '__main__' and __package__ in [None, '']:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from src.utils import batch_runner
+
+
+def run_mode(mode: str, repeat: int, args) -> dict:
+    """
+    Processes the whole cohort once with the given execution mode.
+
+    Return
+    ------
+    dict
+        Aggregate statistics of the batch (see batch_runner.write_summary), with the mode, repeat and exit code.
+    """
+    output_folder = os.path.join(args.output, '{}_{}'.format(mode, repeat))
+    argv = ['--manifest', args.manifest, '--model', args.model, '--output', output_folder, '--jobs', str(args.jobs),
+            '--profile', args.profile, '--no-cache', '--restart']
+    if mode == 'native':
+        argv.extend(['--native-python', args.native_python])
+    elif args.docker is not None:
+        argv.extend(['--docker', args.docker])
+    exit_code = batch_runner.main(argv)
+    aggregate = {}
+    summary_filename = os.path.join(output_folder, 'batch_summary.json')
+    if os.path.exists(summary_filename):
+        with open(summary_filename, 'r') as infile:
+            aggregate = json.load(infile)['aggregate']
+    return {'mode': mode, 'repeat': repeat, 'exit_code': exit_code, 'cases': aggregate.get('cases', 0),
+            'succeeded': aggregate.get('succeeded', 0), 'wall_time': aggregate.get('wall_time', 0.),
+            'cases_per_hour': aggregate.get('cases_per_hour', 0.),
+            'mean_case_time': aggregate.get('mean_case_time', 0.),
+            'mean_processing_time': aggregate.get('mean_processing_time', 0.)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Compares the Docker and native backend execution modes.')
+    parser.add_argument('--manifest', required=True, help='CSV or JSON file listing the input volumes of each case.')
+    parser.add_argument('--model', required=True, help='Name of the local model or RADS pipeline to run.')
+    parser.add_argument('--output', required=True, help='Destination folder of the benchmark.')
+    parser.add_argument('--native-python', required=True, help='Python interpreter of the native backend environment.')
+    parser.add_argument('--docker', default=None, help='Docker executable path.')
+    parser.add_argument('--repeats', type=int, default=2, help='Number of runs of each mode.')
+    parser.add_argument('--jobs', type=int, default=1, help='Maximum number of cases processed simultaneously.')
+    parser.add_argument('--profile', default='balanced', choices=['fast', 'balanced', 'accurate'],
+                        help='Backend inference performance profile.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    os.makedirs(args.output, exist_ok=True)
+
+    results = []
+    # The modes are alternated, for a drift of the machine load to impact both alike.
+    for repeat in range(args.repeats):
+        for mode in ['docker', 'native']:
+            results.append(run_mode(mode, repeat, args))
+
+    with open(os.path.join(args.output, 'backend_benchmark.csv'), 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        for r in results:
+            writer.writerow(r)
+
+    means = dict()
+    for mode in ['docker', 'native']:
+        runs = [r for r in results if r['mode'] == mode and r['exit_code'] == 0]
+        means[mode] = sum([r['mean_case_time'] for r in runs]) / len(runs) if len(runs) != 0 else 0.
+        logging.info("{}: {}/{} successful runs, {:.1f}s per case on average.".format(
+            mode, len(runs), args.repeats, means[mode]))
+    if means['docker'] > 0 and means['native'] > 0:
+        logging.info("Native execution speed-up: x{:.2f}".format(means['docker'] / means['native']))
+    return 0 if all([r['exit_code'] == 0 for r in results]) else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,290 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+import traceback
+
+from src.utils.resources import SharedResources
+from src.utils.backend_worker import BackendWorker, BackendWorkerUnavailable
+from src.utils.docker_utilities import get_docker_engine_client
+from src.utils.docker_engine_client import DockerEngineError
+from src.utils.container_resources import ContainerResourcesAllocator
+
+# The backend library is not reentrant (global logging, inference sessions), one in-process run at a time.
+_in_process_lock = threading.Lock()
+
+
+def run_backend(docker_image_name: str, workspace, line_callback=None, abort_callback=None) -> bool:
+    """
+    Executes the backend on the configuration file of a run workspace, independently of any Slicer component, through
+    the first available transport: the warm backend worker (if enabled), the Docker Engine API (if enabled), and
+    finally a one-shot container started with the Docker command line. In the native execution mode, the backend is
+    run from the local Python environment instead, without Docker, and in the in-process mode directly inside the
+    current interpreter.
+    The container gets its share of the machine resources from the ContainerResourcesAllocator, and the job duration
+    is recorded along with them. The jobs run by the warm worker (under its own startup resources, and waiting for the
+    worker jobs queued before them) or in-process (without any limit) are not recorded.
+
+    Parameters
+    ----------
+    docker_image_name: str
+        Name of the Docker image in the form <user>/<image_name>:<tag>
+    workspace: RunWorkspace
+        Run workspace holding the inputs and the rads_config.ini file, and collecting the outputs.
+    line_callback: callable
+        Called with each new log line produced by the backend.
+    abort_callback: callable
+        Polled regularly, returning True to stop the processing.
+
+    Return
+    ------
+    bool
+        Boolean asserting whether the backend ran until completion without reported failure.
+    """
+    line_callback = line_callback if line_callback is not None else lambda line: None
+    abort_callback = abort_callback if abort_callback is not None else lambda: False
+    allocator = ContainerResourcesAllocator.getInstance()
+    resources = allocator.acquire()
+    start = time.time()
+    success, applied = False, None
+    try:
+        success, applied = run_backend_with_resources(docker_image_name, workspace, resources, line_callback,
+                                                      abort_callback)
+    finally:
+        allocator.release(resources)
+        if applied is not None and not abort_callback():
+            allocator.record(docker_image_name, applied, time.time() - start, success)
+    return success
+
+
+def run_backend_with_resources(docker_image_name: str, workspace, resources, line_callback, abort_callback) -> tuple:
+    """
+    Return
+    ------
+    tuple
+        Boolean asserting whether the backend ran until completion without reported failure, and the resources
+        actually applied to the job (None when run by the warm worker or in-process).
+    """
+    if workspace.execution_mode == 'in_process':
+        return run_backend_in_process(workspace, line_callback, abort_callback), None
+    if workspace.native:
+        return run_backend_native(workspace, resources, line_callback, abort_callback), resources
+
+    config_filename = workspace.container_config_filename
+    if SharedResources.getInstance().use_warm_backend:
+        try:
+            logging.info('Dispatching to the backend worker: {}'.format(config_filename))
+            return BackendWorker.getInstance().run_job(docker_image_name=docker_image_name,
+                                                       config_filename=config_filename, line_callback=line_callback,
+                                                       abort_callback=abort_callback,
+                                                       scratch_runs_path=workspace.runs_path if workspace.scratch
+                                                       else None), None
+        except BackendWorkerUnavailable as e:
+            logging.warning("{}\nFalling back to a one-shot Docker run.".format(e))
+
+    client = get_docker_engine_client()
+    if client is not None:
+        try:
+            return run_backend_engine_api(client, docker_image_name, workspace, resources, line_callback,
+                                          abort_callback), resources
+        except DockerEngineError as e:
+            logging.warning("{}\nFalling back to the Docker command line.".format(e))
+
+    cmd = list()
+    cmd.append(SharedResources.getInstance().docker_path)
+    cmd.extend(('run', '-t'))
+    # if self.use_gpu:
+    #     cmd.append(' --runtime=nvidia ')
+    cmd.append('--user')
+    cmd.append(str(os.getuid()))
+    cmd.extend(resources.cli_flags())
+    for volume in workspace.docker_volumes():
+        cmd.append('-v')
+        cmd.append(volume)
+    cmd.append(docker_image_name)
+    cmd.append('-c')
+    cmd.append(config_filename)
+    cmd.append('-v')
+    cmd.append('debug')
+    logging.info('Docker run command: {}'.format(' '.join(cmd)))
+
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    while True:
+        if abort_callback():
+            p.kill()
+        line = p.stdout.readline().decode("utf-8")
+        if not line:
+            break
+        line_callback(line)
+    p.wait()
+    return p.returncode == 0 and not abort_callback(), resources
+
+
+def run_backend_engine_api(client, docker_image_name: str, workspace, resources, line_callback,
+                           abort_callback) -> bool:
+    """
+    One-shot container run through the Docker Engine API, streaming the container logs until it stops.
+    """
+    config_filename = workspace.container_config_filename
+    logging.info('Docker Engine API run: {} -c {}'.format(docker_image_name, config_filename))
+    container_id = client.create_container(docker_image_name, command=['-c', config_filename, '-v', 'debug'],
+                                           binds=workspace.docker_volumes(), user=str(os.getuid()),
+                                           host_config=resources.host_config())
+    container_done = threading.Event()
+
+    def watch_abort():
+        while not container_done.wait(0.2):
+            if abort_callback():
+                try:
+                    client.kill_container(container_id)
+                except DockerEngineError:
+                    pass
+                return
+
+    try:
+        client.start_container(container_id)
+        threading.Thread(target=watch_abort, daemon=True).start()
+        client.container_logs(container_id, line_callback=line_callback, follow=True)
+        status = client.wait_container(container_id)
+        if status.get('StatusCode', 0) != 0 and not abort_callback():
+            logging.warning("Backend container exited with status {}.".format(status.get('StatusCode')))
+        return status.get('StatusCode', 0) == 0 and not abort_callback()
+    finally:
+        container_done.set()
+        client.remove_container(container_id, force=True)
+
+
+def run_backend_native(workspace, resources, line_callback, abort_callback) -> bool:
+    """
+    Runs the backend as a subprocess of the local Python environment set in SharedResources.native_backend_python,
+    on the configuration file of the workspace (generated with host locations). The process is pinned to the cores of
+    its resources slot when the platform allows it, the memory limit only applies to the containers.
+    """
+    python_path = SharedResources.getInstance().native_backend_python
+    if python_path is None or not os.path.isfile(python_path):
+        logging.error("The Python interpreter of the native backend environment could not be found: {}".format(
+            python_path))
+        return False
+    cmd = [python_path, '-u', os.path.join(os.path.dirname(os.path.realpath(__file__)), 'rads_worker.py'),
+           '--config', workspace.config_filename]
+    logging.info('Native backend command: {}'.format(' '.join(cmd)))
+
+    preexec_fn = None
+    if len(resources.cpuset) != 0 and hasattr(os, 'sched_setaffinity'):
+        cpuset = set(resources.cpuset)
+        preexec_fn = lambda: os.sched_setaffinity(0, cpuset)
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=preexec_fn)
+    while True:
+        if abort_callback():
+            p.kill()
+        line = p.stdout.readline().decode("utf-8")
+        if not line:
+            break
+        line_callback(line)
+    p.wait()
+    return p.returncode == 0 and not abort_callback()
+
+
+def check_native_backend(python_path: str) -> str:
+    """
+    Checks that raidionics_rads can be imported from a local Python environment.
+
+    Parameters
+    ----------
+    python_path: str
+        Python interpreter of the environment.
+
+    Return
+    ------
+    str
+        Version of the installed raidionics_rads package, or None if not usable.
+    """
+    if python_path is None or not os.path.isfile(python_path):
+        return None
+    cmd = [python_path, '-c', 'import raidionics_rads; from importlib.metadata import version; '
+                              'print(version("raidionics_rads"))']
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        logging.warning("raidionics_rads is not usable from {}:\n{}".format(python_path,
+                                                                           result.stderr.decode('utf-8')))
+        return None
+    return result.stdout.decode('utf-8').strip()
+
+
+class _BackendLogHandler(logging.Handler):
+    """
+    Forwards the log records emitted by the in-process backend to a line callback, as for the container logs. Only the
+    records emitted from the thread running the backend are forwarded, the other threads of the application logging
+    through the same loggers.
+    """
+    def __init__(self, line_callback):
+        super(_BackendLogHandler, self).__init__(level=logging.DEBUG)
+        self.line_callback = line_callback
+        self.thread_id = threading.get_ident()
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    def filter(self, record):
+        return record.thread == self.thread_id and super(_BackendLogHandler, self).filter(record)
+
+    def emit(self, record):
+        try:
+            self.line_callback(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
+def run_backend_in_process(workspace, line_callback, abort_callback) -> bool:
+    """
+    Runs the backend library inside the current interpreter (e.g., the Slicer Python), on the configuration file of
+    the workspace. There is neither container nor interpreter start-up, and the models stay loaded between runs.
+    The backend cannot be interrupted midway, an abort only takes effect once the run is over.
+    """
+    from src.utils.rads_worker import load_backend, cache_inference_sessions
+    try:
+        run_rads = load_backend()
+    except ImportError:
+        logging.error("raidionics_rads is not installed in the current Python environment, it can be installed with "
+                      "slicer.util.pip_install('raidionics_rads').")
+        return False
+    cache_inference_sessions()
+    with _in_process_lock:
+        if abort_callback():
+            return False
+        handler = _BackendLogHandler(line_callback)
+        # The backend records reach the root handlers by propagation, whichever the root logger level.
+        root_logger = logging.getLogger()
+        backend_logger = logging.getLogger('raidionics_rads')
+        previous_level = backend_logger.level
+        root_logger.addHandler(handler)
+        backend_logger.setLevel(logging.DEBUG)
+        logging.info('In-process backend run: {}'.format(workspace.config_filename))
+        try:
+            run_rads(config_filename=workspace.config_filename)
+            success = True
+        except Exception:
+            logging.error(traceback.format_exc())
+            success = False
+        finally:
+            root_logger.removeHandler(handler)
+            backend_logger.setLevel(previous_level)
+    return success and not abort_callback()
+
+
+def check_in_process_backend() -> str:
+    """
+    Return
+    ------
+    str
+        Version of raidionics_rads installed in the current interpreter, or None if it cannot be imported.
+    """
+    try:
+        import raidionics_rads
+        from importlib.metadata import version
+        return version('raidionics_rads')
+    except Exception:
+        logging.debug(traceback.format_exc())
+        return None
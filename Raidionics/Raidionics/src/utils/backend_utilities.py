@@ -4,10 +4,35 @@ import json
 import traceback
 
 from src.utils.resources import SharedResources
+from src.utils.container_resources import ContainerResourcesAllocator
+
+# Backend inference options for each performance profile, written in the [Runtime] section of rads_config.ini.
+# The sliding-window overlap and the test-time augmentation drive the inference wall time on CPU, while the batch size
+# trades memory for speed. The default profile (balanced) writes no option, for the backend to keep its own defaults
+# and the results of the previous versions, the overlapping windows being only used when explicitly chosen.
+PERFORMANCE_PROFILES = {
+    'fast': {'non_overlapping': 'true', 'overlap': '0.0', 'batch_size': '4',
+             'test_time_augmentation_iteration': '0'},
+    'balanced': {},
+    'accurate': {'non_overlapping': 'false', 'overlap': '0.5', 'batch_size': '1',
+                 'test_time_augmentation_iteration': '4'},
+}
+
+# Atlases available for the neuro report, and the usual selections. Most routine reports only need the MNI space
+# (lobes) and the white matter tracts (BCB).
+CORTICAL_ATLASES = ['MNI', 'Schaefer7', 'Schaefer17', 'Harvard-Oxford']
+SUBCORTICAL_ATLASES = ['BCB']
+ATLAS_PRESETS = {
+    'all': CORTICAL_ATLASES + SUBCORTICAL_ATLASES,
+    'routine': ['MNI', 'BCB'],
+}
 
 
 def generate_backend_config(input_folder: str, parameters, logic_target_space: str, logic_task: str,
-                            model_name: str) -> None:
+                            model_name: str, container_input_folder: str = '/workspace/resources/data',
+                            container_output_folder: str = '/workspace/resources/output',
+                            segmentation_filenames: dict = None, pipeline_filename: str = None,
+                            container_resources_folder: str = '/workspace/resources') -> None:
     """
     Preparing the configuration file to be used as input by raidionics_rads_lib (processing backend).
 
@@ -23,21 +48,37 @@ def generate_backend_config(input_folder: str, parameters, logic_target_space: s
         Disambiguation between single segmentation or complex diagnosis pipeline
     model_name: str
         Name of the model to be executed in the backend.
+    container_input_folder: str
+        Location of the input folder, as seen by the backend.
+    container_output_folder: str
+        Location of the output folder, as seen by the backend.
+    segmentation_filenames: dict
+        Existing segmentation mask to be used by the backend for each structure (e.g. Tumor), as seen by the backend.
+    pipeline_filename: str
+        Run-specific RADS pipeline, as seen by the backend, replacing the one from the pipeline folder.
+    container_resources_folder: str
+        Location of the resources folder (models and reporting pipelines), as seen by the backend.
     """
     try:
         rads_config = configparser.ConfigParser()
         rads_config.add_section('Default')
         rads_config.set('Default', 'task', logic_target_space)
         rads_config.set('Default', 'caller', '')
+        profile = SharedResources.getInstance().performance_profile
+        rads_config.set('Default', 'performance_profile', profile)
         rads_config.add_section('System')
         rads_config.set('System', 'gpu_id', "-1")  # Always running on CPU
-        rads_config.set('System', 'input_folder', '/workspace/resources/data')
-        rads_config.set('System', 'output_folder', '/workspace/resources/output')
-        rads_config.set('System', 'model_folder', '/workspace/resources/models')
-        rads_config.set('System', 'pipeline_filename', '/workspace/resources/models/' + model_name + '/pipeline.json')
+        rads_config.set('System', 'threads', str(get_inference_threads()))
+        rads_config.set('System', 'input_folder', container_input_folder)
+        rads_config.set('System', 'output_folder', container_output_folder)
+        rads_config.set('System', 'model_folder', container_resources_folder + '/models')
+        rads_config.set('System', 'pipeline_filename',
+                        container_resources_folder + '/models/' + model_name + '/pipeline.json')
         if logic_task == 'reporting':
             rads_config.set('System', 'pipeline_filename',
-                            '/workspace/resources/reporting/' + parameters['UserConfiguration']['default'])
+                            container_resources_folder + '/reporting/' + parameters['UserConfiguration']['default'])
+        if pipeline_filename is not None:
+            rads_config.set('System', 'pipeline_filename', pipeline_filename)
         rads_config.add_section('Runtime')
         rads_config.set('Runtime', 'reconstruction_method',
                         SharedResources.getInstance().user_configuration['Predictions']['reconstruction_method'])
@@ -47,10 +88,26 @@ def generate_backend_config(input_folder: str, parameters, logic_target_space: s
                         SharedResources.getInstance().user_configuration['Runtime']['use_stripped_data'])
         rads_config.set('Runtime', 'use_registered_data',
                         SharedResources.getInstance().user_configuration['Runtime']['use_registered_data'])
-        # @TODO. Add a user option to include/exclude atlases
+        for option, value in PERFORMANCE_PROFILES.get(profile, PERFORMANCE_PROFILES['balanced']).items():
+            rads_config.set('Runtime', option, value)
+        rads_config.set('Runtime', 'keep_intermediate_files',
+                        'true' if SharedResources.getInstance().keep_intermediate_files else 'false')
+        # Each atlas requires a registration and the computation of its features, only the selected ones are run.
+        cortical, subcortical = get_selected_atlases()
         rads_config.add_section('Neuro')
-        rads_config.set('Neuro', 'cortical_features', 'MNI, Schaefer7, Schaefer17, Harvard-Oxford')
-        rads_config.set('Neuro', 'subcortical_features', 'BCB')
+        rads_config.set('Neuro', 'cortical_features', ', '.join(cortical))
+        rads_config.set('Neuro', 'subcortical_features', ', '.join(subcortical))
+        # Segmentation masks provided by the user (or reused from previous runs), for the backend to skip their inference.
+        section = 'Neuro' if logic_target_space == 'neuro_diagnosis' else 'Mediastinum'
+        filenames = {k: v for k, v in SharedResources.getInstance().user_diagnosis_configuration[section].items()
+                     if k.endswith('_segmentation_filename') and v.strip() != ''} \
+            if SharedResources.getInstance().user_diagnosis_configuration.has_section(section) else {}
+        if segmentation_filenames is not None:
+            filenames.update({k.lower() + '_segmentation_filename': v for k, v in segmentation_filenames.items()})
+        if len(filenames) != 0 and not rads_config.has_section(section):
+            rads_config.add_section(section)
+        for option in filenames:
+            rads_config.set(section, option, filenames[option])
         rads_config_filename = os.path.join(input_folder, 'rads_config.ini')
         with open(rads_config_filename, 'w') as outfile:
             rads_config.write(outfile)
@@ -59,6 +116,63 @@ def generate_backend_config(input_folder: str, parameters, logic_target_space: s
         print(traceback.format_exc())
 
 
+def get_selected_atlases() -> tuple:
+    """
+    Atlases selected by the user for the neuro report.
+
+    Return
+    ------
+    tuple
+        Lists of the selected cortical and subcortical atlases.
+    """
+    config = SharedResources.getInstance().user_diagnosis_configuration
+    cortical = config.get('Neuro', 'cortical_features', fallback=', '.join(CORTICAL_ATLASES))
+    subcortical = config.get('Neuro', 'subcortical_features', fallback=', '.join(SUBCORTICAL_ATLASES))
+    return [x.strip() for x in cortical.split(',') if x.strip() != ''], \
+        [x.strip() for x in subcortical.split(',') if x.strip() != '']
+
+
+def set_selected_atlases(atlases: list) -> None:
+    """
+    Updates the atlases used for the neuro report, the unknown names being ignored.
+
+    Parameters
+    ----------
+    atlases: list
+        Names of the atlases to compute, cortical and subcortical alike, or the name of a preset (see ATLAS_PRESETS).
+    """
+    if isinstance(atlases, str):
+        atlases = ATLAS_PRESETS.get(atlases, [x.strip() for x in atlases.split(',')])
+    config = SharedResources.getInstance().user_diagnosis_configuration
+    if not config.has_section('Neuro'):
+        config.add_section('Neuro')
+    config.set('Neuro', 'cortical_features', ', '.join([x for x in CORTICAL_ATLASES if x in atlases]))
+    config.set('Neuro', 'subcortical_features', ', '.join([x for x in SUBCORTICAL_ATLASES if x in atlases]))
+
+
+def is_atlas_output_selected(iodict: dict, item: str) -> bool:
+    """
+    Whether an output of a RADS pipeline is expected from the run, i.e. it is not an atlas left out of the report.
+    """
+    if item not in iodict or 'atlas_category' not in iodict[item]:
+        return True
+    if item not in CORTICAL_ATLASES + SUBCORTICAL_ATLASES:
+        return True
+    cortical, subcortical = get_selected_atlases()
+    return item in cortical + subcortical
+
+
+def get_inference_threads() -> int:
+    """
+    Number of inference threads for one backend job, matching the CPU share of the job container.
+    """
+    slots = max(1, SharedResources.getInstance().max_concurrent_jobs)
+    cpus = ContainerResourcesAllocator.getInstance().profile(slot=0, slots=slots).cpus
+    if cpus <= 0:
+        cpus = len(ContainerResourcesAllocator.getInstance().available_cores()) / float(slots)
+    return max(1, int(cpus))
+
+
 def postop_model_selection(inputs: dict) -> str:
     model_name = "MRI_GBM_Postop_FV_4p"
     if inputs["T1w postop"] is None and inputs["FLAIR postop"] is None and inputs["T1wCE preop"] is None:
@@ -73,3 +187,93 @@ def postop_model_selection(inputs: dict) -> str:
         model_name = "MRI_GBM_Postop_FV_5p"
 
     return model_name
+
+
+def create_iodict(json_dict: dict) -> dict:
+    """
+    Parses the members of a model (or RADS pipeline) json description into the input/output dictionary used to
+    stage the inputs, generate the backend configuration and collect the outputs.
+    """
+    iodict = dict()
+    for member in json_dict["members"]:
+        if "type" in member:
+            t = member["type"]
+            if t in ["uint8_t", "int8_t",
+                       "uint16_t", "int16_t",
+                       "uint32_t", "int32_t",
+                       "uint64_t", "int64_t",
+                       "unsigned int", "int",
+                       "double", "float"]:
+                iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"],
+                                                        "value": member["default"]}
+            elif t in ["volume"]:
+                iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"],
+                                          "voltype": member["voltype"]}
+                if 'importance' in member:
+                    iodict[member["name"]]['importance'] = member['importance']
+                if 'sequence_type' in member:
+                    iodict[member["name"]]['sequence_type'] = member['sequence_type']
+                if 'timestamp_order' in member:
+                    iodict[member["name"]]['timestamp_order'] = member['timestamp_order']
+                if 'description' in member:
+                    iodict[member["name"]]['description'] = member['description']
+                if 'threshold' in member:
+                    iodict[member["name"]]['threshold'] = member['threshold']
+                if 'color' in member:
+                    iodict[member["name"]]['color'] = member['color']
+                if 'atlas_category' in member:
+                    iodict[member["name"]]['atlas_category'] = member['atlas_category']
+            elif t in ["configuration"]:
+                iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"]}
+                if 'default' in member:
+                    iodict[member["name"]]['default'] = member['default']
+            elif t in ["text"]:
+                iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"]}
+                if 'default' in member:
+                    iodict[member["name"]]['default'] = member['default']
+            else:
+                iodict[member["name"]] = {"type": member["type"], "iotype": member["iotype"]}
+    return iodict
+
+
+def get_backend_input_filename(sequence_type: str, extension: str = '.nii.gz') -> str:
+    """
+    Name under which an input volume of the given MR sequence type is expected by the backend.
+    """
+    # @TODO. hard-coding to improve.
+    if sequence_type == "T1-CE":
+        return 'input_t1gd' + extension
+    return 'input_' + sequence_type + extension
+
+
+def get_pipeline_segmentation_steps(pipeline: dict, extension: str = '.nii.gz') -> list:
+    """
+    Lists the segmentation steps of a RADS pipeline.
+
+    Return
+    ------
+    list
+        (step key, segmented structures, input volumes relative to the run data folder, model name) for each
+        Segmentation step, in the pipeline order.
+    """
+    steps = []
+    for key in sorted(pipeline.keys(), key=lambda x: int(x) if str(x).isdigit() else 0):
+        step = pipeline[key]
+        if not isinstance(step, dict) or step.get('task') != 'Segmentation':
+            continue
+        targets = step.get('target', [])
+        targets = [targets] if isinstance(targets, str) else list(targets)
+        inputs = ['T' + str(i.get('timestamp', 0)) + '/' + get_backend_input_filename(i.get('sequence', ''),
+                                                                                           extension)
+                  for i in step.get('inputs', {}).values()]
+        steps.append((key, targets, inputs, step.get('model')))
+    return steps
+
+
+def remove_pipeline_steps(pipeline: dict, step_keys: list) -> dict:
+    """
+    Copy of a RADS pipeline without the given steps, the remaining steps being renumbered in the same order.
+    """
+    kept = [pipeline[k] for k in sorted(pipeline.keys(), key=lambda x: int(x) if str(x).isdigit() else 0)
+            if k not in step_keys]
+    return {str(i + 1): step for i, step in enumerate(kept)}
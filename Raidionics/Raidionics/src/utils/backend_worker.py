@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import traceback
+import uuid
+
+from src.utils.resources import SharedResources
+from src.utils.container_resources import ContainerResourcesAllocator
+from src.utils.workspace_utilities import RunWorkspace
+
+
+class BackendWorkerUnavailable(Exception):
+    """
+    Raised when the long-lived backend container cannot be started, or died while processing a job.
+    """
+    pass
+
+
+class BackendWorker:
+    """
+    Singleton class managing a long-lived raidionics-rads container, to which processing jobs are dispatched.
+    The container is started on first use, and kept alive for the whole session so that the container creation, the
+    interpreter start-up, and the model loading are only paid once. Each process (e.g., a Slicer session and a batch
+    runner next to it) has its own container and jobs folder, identified by its session ID. A worker left idle for
+    idle_timeout seconds exits by itself, for no container to outlive a crashed session for long.
+    """
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if BackendWorker.__instance == None:
+            BackendWorker()
+        return BackendWorker.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if BackendWorker.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            BackendWorker.__instance = self
+            self.__init_base_variables()
+
+    def __init_base_variables(self):
+        self.session_id = '{}-{}'.format(os.getpid(), uuid.uuid4().hex[:8])
+        self.container_name = 'raidionics-slicer-worker-' + self.session_id
+        self.docker_image_name = None
+        self.scratch_runs_path = None
+        self.heartbeat_timeout = 15.
+        self.startup_timeout = 60.
+        self.polling_period = 0.1
+        self.idle_timeout = 1800.
+        self.__start_lock = threading.Lock()
+
+    @property
+    def workers_path(self) -> str:
+        return os.path.join(SharedResources.getInstance().resources_path, 'worker')
+
+    @property
+    def worker_path(self) -> str:
+        return os.path.join(self.workers_path, self.session_id)
+
+    @property
+    def jobs_path(self) -> str:
+        return os.path.join(self.worker_path, 'jobs')
+
+    def is_alive(self) -> bool:
+        """
+        The worker is considered alive as long as its heartbeat file has been refreshed recently.
+        """
+        heartbeat_filename = os.path.join(self.jobs_path, 'worker.alive')
+        if self.docker_image_name is None or not os.path.exists(heartbeat_filename):
+            return False
+        return (time.time() - os.path.getmtime(heartbeat_filename)) < self.heartbeat_timeout
+
+    def start(self, docker_image_name: str, scratch_runs_path: str = None) -> None:
+        """
+        Starts the worker container for the requested image, if not already running. A worker running a different
+        image, or not mounting the requested scratch runs folder, is replaced.
+
+        Parameters
+        ----------
+        docker_image_name: str
+            Name of the Docker image in the form <user>/<image_name>:<tag>
+        scratch_runs_path: str
+            Runs folder outside the resources folder (see workspace_utilities.get_scratch_runs_path), to be mounted.
+        """
+        # Concurrent jobs may request the worker at the same time, only one of them must start it.
+        with self.__start_lock:
+            self.__start(docker_image_name, scratch_runs_path)
+
+    def __start(self, docker_image_name: str, scratch_runs_path: str = None) -> None:
+        if self.is_alive() and self.docker_image_name == docker_image_name and \
+                (scratch_runs_path is None or scratch_runs_path == self.scratch_runs_path):
+            return
+        # The scratch folder already mounted is kept, for the jobs of both locations to be accepted.
+        scratch_runs_path = scratch_runs_path if scratch_runs_path is not None else self.scratch_runs_path
+        self.stop()
+
+        self.__collect_stale_workers()
+        if os.path.exists(self.jobs_path):
+            shutil.rmtree(self.jobs_path)
+        os.makedirs(self.jobs_path)
+        shutil.copy(src=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'rads_worker.py'),
+                    dst=os.path.join(self.worker_path, 'rads_worker.py'))
+        container_worker_path = '/workspace/resources/worker/' + self.session_id
+
+        cmd = [SharedResources.getInstance().docker_path, 'run', '-d', '--rm', '--name', self.container_name,
+               '--user', str(os.getuid())] + ContainerResourcesAllocator.getInstance().profile().cli_flags() + [
+               '-v', SharedResources.getInstance().resources_path + ':/workspace/resources'] + (
+               ['-v', scratch_runs_path + ':' + RunWorkspace.docker_scratch_path] if scratch_runs_path is not None
+               else []) + ['--entrypoint', 'python3', docker_image_name,
+               container_worker_path + '/rads_worker.py', '--jobs', container_worker_path + '/jobs',
+               '--idle-timeout', str(self.idle_timeout)]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = p.communicate()
+        if p.returncode != 0:
+            raise BackendWorkerUnavailable("Backend worker could not be started: {}".format(stderr.decode("utf-8")))
+
+        self.docker_image_name = docker_image_name
+        self.scratch_runs_path = scratch_runs_path
+        start = time.time()
+        while not self.is_alive():
+            if time.time() - start > self.startup_timeout:
+                self.stop()
+                raise BackendWorkerUnavailable("Backend worker did not report alive after {} seconds.".format(
+                    self.startup_timeout))
+            time.sleep(self.polling_period)
+        logging.info("Backend worker started for {} in {:.1f} seconds.".format(docker_image_name,
+                                                                               time.time() - start))
+
+    def stop(self) -> None:
+        """
+        Removes the worker container, whether running or not. Safe to call at any time.
+        """
+        try:
+            cmd = [SharedResources.getInstance().docker_path, 'rm', '-f', self.container_name]
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            p.communicate()
+        except Exception:
+            logging.warning("Backend worker could not be stopped.")
+            logging.warning(traceback.format_exc())
+        self.docker_image_name = None
+        heartbeat_filename = os.path.join(self.jobs_path, 'worker.alive')
+        if os.path.exists(heartbeat_filename):
+            os.remove(heartbeat_filename)
+
+    def run_job(self, docker_image_name: str, config_filename: str, line_callback=None, abort_callback=None,
+                scratch_runs_path: str = None) -> bool:
+        """
+        Dispatches one processing job to the worker, and blocks until completion while forwarding the log lines.
+
+        Parameters
+        ----------
+        docker_image_name: str
+            Name of the Docker image in the form <user>/<image_name>:<tag>
+        config_filename: str
+            Location of the rads_config.ini file, as seen from inside the container.
+        line_callback: callable
+            Called with each new log line produced by the backend for the job.
+        abort_callback: callable
+            Polled regularly, returning True to stop waiting for the job.
+        scratch_runs_path: str
+            Runs folder of the job workspace when outside the resources folder, to be mounted in the worker.
+
+        Return
+        ------
+        bool
+            Boolean asserting whether the job was processed successfully.
+        """
+        self.start(docker_image_name, scratch_runs_path)
+        job_id = str(uuid.uuid4())
+        job_filename = os.path.join(self.jobs_path, job_id + '.json')
+        with open(job_filename + '.tmp', 'w') as outfile:
+            json.dump({'config': config_filename, 'verbose': 'debug'}, outfile)
+        os.replace(job_filename + '.tmp', job_filename)
+
+        log_filename = os.path.join(self.jobs_path, job_id + '.log')
+        status_filename = os.path.join(self.jobs_path, job_id + '.status')
+        log_file = None
+        pending_line = ''
+        try:
+            while True:
+                if log_file is None and os.path.exists(log_filename):
+                    log_file = open(log_filename, 'r')
+                if log_file is not None:
+                    pending_line = self.__forward_lines(log_file, pending_line, line_callback)
+                if os.path.exists(status_filename):
+                    break
+                if abort_callback is not None and abort_callback():
+                    self.__abort_job(job_id)
+                    return False
+                if not self.is_alive():
+                    self.stop()
+                    raise BackendWorkerUnavailable("Backend worker died while processing job {}.".format(job_id))
+                time.sleep(self.polling_period)
+
+            if log_file is None and os.path.exists(log_filename):
+                log_file = open(log_filename, 'r')
+            if log_file is not None:
+                pending_line = self.__forward_lines(log_file, pending_line, line_callback)
+            if pending_line != '' and line_callback is not None:
+                line_callback(pending_line)
+            with open(status_filename, 'r') as infile:
+                status = json.load(infile)
+        finally:
+            if log_file is not None:
+                log_file.close()
+
+        for ext in ['.log', '.status']:
+            if os.path.exists(os.path.join(self.jobs_path, job_id + ext)):
+                os.remove(os.path.join(self.jobs_path, job_id + ext))
+        if not status['success']:
+            logging.warning("Backend worker job failed:\n{}".format(status['error']))
+        return status['success']
+
+    def __abort_job(self, job_id: str) -> None:
+        """
+        Withdraws a job not picked by the worker yet. The backend cannot be interrupted in the middle of a job: the
+        worker is then restarted if running nothing else, otherwise the job is left to complete, its files being
+        discarded by the worker, for the other jobs queued on it not to be lost.
+        """
+        try:
+            os.remove(os.path.join(self.jobs_path, job_id + '.json'))
+            return
+        except OSError:
+            pass
+        others = [f for f in os.listdir(self.jobs_path) if f.endswith(('.json', '.running'))
+                  and not f.startswith(job_id)]
+        if len(others) == 0:
+            self.stop()
+            return
+        open(os.path.join(self.jobs_path, job_id + '.abandoned'), 'w').close()
+        logging.info("Backend worker job {} left to complete, other jobs being queued.".format(job_id))
+
+    def __collect_stale_workers(self) -> None:
+        """
+        Deletes the folders of the workers of other sessions which stopped (no recent heartbeat).
+        """
+        if not os.path.isdir(self.workers_path):
+            return
+        for session_id in os.listdir(self.workers_path):
+            folder = os.path.join(self.workers_path, session_id)
+            if session_id == self.session_id or not os.path.isdir(folder):
+                continue
+            heartbeat_filename = os.path.join(folder, 'jobs', 'worker.alive')
+            last_activity = os.path.getmtime(heartbeat_filename) if os.path.exists(heartbeat_filename) else \
+                os.path.getmtime(folder)
+            if time.time() - last_activity > self.heartbeat_timeout + self.startup_timeout:
+                shutil.rmtree(folder, ignore_errors=True)
+
+    def __forward_lines(self, log_file, pending_line: str, line_callback) -> str:
+        """
+        Forwards the complete lines appended to the log file since the last call, and returns the trailing partial
+        line (if the backend is still writing it) to be completed at the next call.
+        """
+        content = pending_line + log_file.read()
+        lines = content.split('\n')
+        if line_callback is not None:
+            for line in lines[:-1]:
+                line_callback(line + '\n')
+        return lines[-1]
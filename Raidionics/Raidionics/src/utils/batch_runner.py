@@ -0,0 +1,440 @@
+"""
+Headless cohort processing, running one segmentation model or RADS pipeline over all the cases of a manifest.
+
+The manifest is either a CSV file with the columns case_id, timestamp, sequence, path (one row per input volume), or a
+JSON file in the form {"cases": [{"case_id": "P001", "inputs": [{"timestamp": 0, "sequence": "T1-CE", "path": "..."}]}]}.
+Relative paths are resolved from the manifest location. Each case is a job of the persistent job queue: running the same
+command again after an interruption (or a crash) skips the cases already done, and restarts the others from the stage
+they stopped at. The model (or pipeline) must have been downloaded once from the
+Slicer module beforehand, and is referred to by its name as displayed in the module.
+
+Usage, either with the Slicer Python interpreter or with any Python environment having SimpleITK:
+    Slicer --no-main-window --python-script <module_dir>/src/utils/batch_runner.py --manifest cohort.csv
+        --model <name> --output <folder>
+    python -m src.utils.batch_runner --manifest cohort.csv --model <name> --output <folder>   (from <module_dir>)
+"""
+import argparse
+import configparser
+import csv
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+if __name__ == '__main__' and __package__ in [None, '']:
+    # Executed as a plain script (e.g., Slicer --python-script), the module folder is not on the path yet.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from src.utils.resources import SharedResources
+from src.utils.backend_utilities import generate_backend_config, create_iodict, get_backend_input_filename, \
+    set_selected_atlases, ATLAS_PRESETS
+from src.utils.backend_execution import run_backend, check_native_backend, check_in_process_backend
+from src.utils.docker_utilities import DockerMetadataCache
+from src.utils.job_queue import JobQueue
+from src.utils.job_scheduler import JobScheduler
+from src.utils.progress_utilities import ProgressTracker, StageTimingHistory
+from src.utils.volume_codecs import TRANSFER_FORMATS, get_transfer_extension, write_volume, read_volume, \
+    narrow_image
+from src.utils.result_cache import ResultCache, folder_fingerprints, get_cloud_checksum, get_local_model_fingerprint
+from src.utils.workspace_utilities import RunWorkspace, collect_workspaces
+
+
+def read_manifest(manifest_filename: str) -> list:
+    """
+    Return
+    ------
+    list
+        One dict per case, in the form {'case_id': str, 'inputs': [{'timestamp': str, 'sequence': str, 'path': str}]},
+        in the manifest order.
+    """
+    root = os.path.dirname(os.path.realpath(manifest_filename))
+    cases = {}
+    if manifest_filename.endswith('.json'):
+        with open(manifest_filename, 'r') as infile:
+            content = json.load(infile)
+        for case in content['cases']:
+            cases[str(case['case_id'])] = [{'timestamp': str(x.get('timestamp', 0)), 'sequence': x['sequence'],
+                                            'path': x['path']} for x in case['inputs']]
+    else:
+        with open(manifest_filename, 'r') as infile:
+            for row in csv.DictReader(infile):
+                cases.setdefault(str(row['case_id']), []).append({'timestamp': str(row.get('timestamp') or 0),
+                                                                  'sequence': row['sequence'], 'path': row['path']})
+    for case_id in cases:
+        for i in cases[case_id]:
+            i['path'] = i['path'] if os.path.isabs(i['path']) else os.path.join(root, i['path'])
+    return [{'case_id': k, 'inputs': v} for k, v in cases.items()]
+
+
+def find_local_model(model_name: str) -> dict:
+    """
+    Return
+    ------
+    dict
+        Json description of the locally available model or RADS pipeline with the given name, None if not found.
+    """
+    for fname in sorted(glob(os.path.join(SharedResources.getInstance().json_local_dir, '*.json'))):
+        with open(fname, 'r') as infile:
+            j = json.load(infile)
+        if j.get('name') == model_name:
+            return j
+    return None
+
+
+def check_case_inputs(case: dict, iodict: dict) -> list:
+    """
+    Return
+    ------
+    list
+        Description of the mandatory inputs of the model which are missing for the case, or not found on disk.
+    """
+    missing = []
+    provided = [(i['sequence'], i['timestamp']) for i in case['inputs']]
+    for item in iodict:
+        if iodict[item]["iotype"] == "input" and iodict[item]["type"] == "volume" and \
+                "Mandatory" in iodict[item].get("importance", ""):
+            if (iodict[item].get("sequence_type"), str(iodict[item].get("timestamp_order"))) not in provided:
+                missing.append(item)
+    for i in case['inputs']:
+        if not os.path.exists(i['path']):
+            missing.append(i['path'])
+    return missing
+
+
+def stage_case_inputs(case: dict, workspace) -> int:
+    """
+    Copies (or converts, if not already in the transfer format) the case inputs inside the run workspace, with the
+    folder structure and filenames expected by the backend. The inputs are staged concurrently.
+
+    Return
+    ------
+    int
+        Number of bytes written.
+    """
+    def stage(i, dest_filename):
+        start = time.time()
+        if i['path'].endswith(get_transfer_extension()):
+            shutil.copyfile(i['path'], dest_filename)
+        else:
+            image = read_volume(i['path'])
+            if SharedResources.getInstance().use_dtype_narrowing:
+                image, _ = narrow_image(image)
+            write_volume(image, dest_filename)
+        logging.debug("{}: {} staged in {:.2f}s.".format(case['case_id'], os.path.basename(i['path']),
+                                                         time.time() - start))
+        return os.path.getsize(dest_filename)
+
+    destinations = []
+    for i in case['inputs']:
+        ts_folder = os.path.join(workspace.data_path, 'T' + i['timestamp'])
+        os.makedirs(ts_folder, exist_ok=True)
+        destinations.append(os.path.join(ts_folder, get_backend_input_filename(i['sequence'],
+                                                                               get_transfer_extension())))
+        if i['timestamp'] == '1' and not os.path.exists(os.path.join(workspace.data_path, 'T0')):
+            os.makedirs(os.path.join(workspace.data_path, 'T0'))
+    max_workers = SharedResources.getInstance().staging_threads
+    max_workers = max(1, min(len(destinations), max_workers if max_workers > 0 else os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(stage, case['inputs'], destinations))
+
+
+def create_case_report(case_id: str, resumed_from: str = 'staging', error: str = '') -> dict:
+    return {'case_id': case_id, 'success': False, 'resumed_from': resumed_from,
+            'mode': SharedResources.getInstance().backend_execution_mode,
+            'profile': SharedResources.getInstance().performance_profile, 'staging_time': 0.,
+            'processing_time': 0., 'export_time': 0., 'total_time': 0., 'input_mb': 0., 'cache_hit': False,
+            'error': error}
+
+
+def config_matches_workspace(workspace) -> bool:
+    """
+    Whether the backend configuration of a workspace uses the locations of the current execution mode.
+    """
+    config = configparser.ConfigParser()
+    config.read(workspace.config_filename)
+    return config.get('System', 'input_folder', fallback=None) == workspace.container_data_path
+
+
+def estimate_queue_time(batch_id: str, model_name: str) -> tuple:
+    """
+    Estimates when the queue of the batch will drain, from the processing time recorded for the model (and the
+    current performance profile) during the previous runs, spread over the cases processed simultaneously.
+
+    Return
+    ------
+    tuple
+        Number of cases not processed yet, and the expected remaining time in seconds (None without any history).
+    """
+    remaining = len(JobQueue.getInstance().jobs(batch_id=batch_id, states=['queued'] + JobQueue.stages))
+    if remaining == 0:
+        return 0, 0.
+    duration = StageTimingHistory.getInstance().expected_duration(
+        ProgressTracker(model_name, SharedResources.getInstance().performance_profile).history_key)
+    if duration is None:
+        return remaining, None
+    concurrency = max(1, min(SharedResources.getInstance().max_concurrent_jobs, remaining))
+    return remaining, duration * remaining / concurrency
+
+
+def process_job(job: dict, model_json: dict, iodict: dict, output_folder: str) -> None:
+    """
+    Runs the model or RADS pipeline on the case of one queued job, and moves the results to
+    <output_folder>/<case_id>. The job goes through the staging, running and importing stages, starting from its
+    resume stage if the run workspace of a previous attempt is still available.
+    The processing report, with the timings (in seconds) of each stage performed, is stored with the job.
+    """
+    queue = JobQueue.getInstance()
+    case = job['payload']
+    report = create_case_report(case['case_id'], resumed_from=job['resume_stage'])
+    start = time.time()
+    case_output_folder = os.path.join(output_folder, case['case_id'])
+
+    workspace = RunWorkspace.open(job['run_id']) if job['run_id'] is not None else None
+    resume_stage = job['resume_stage'] if workspace is not None else 'staging'
+    if resume_stage == 'running' and not config_matches_workspace(workspace):
+        # Staged for another execution mode (Docker/native), the configuration locations must be regenerated.
+        resume_stage = 'staging'
+    logic_task = 'reporting' if model_json.get('task') == 'Reporting' else 'segmentation'
+    try:
+        if resume_stage == 'staging':
+            missing = check_case_inputs(case, iodict)
+            if len(missing) != 0:
+                raise ValueError('Missing inputs: {}'.format(', '.join(missing)))
+            if workspace is not None:
+                workspace.release()
+                shutil.rmtree(workspace.path, ignore_errors=True)
+            workspace = RunWorkspace.create()
+            workspace.pin()
+            queue.set_state(job['job_id'], 'staging', run_id=workspace.run_id)
+            report['input_mb'] = stage_case_inputs(case, workspace) / (1024. * 1024.)
+            logic_target_space = "neuro_diagnosis" if model_json.get('target') == "Neuro" else "mediastinum_diagnosis"
+            generate_backend_config(workspace.data_path, iodict, logic_target_space, logic_task,
+                                    model_json.get('model_name'), container_input_folder=workspace.container_data_path,
+                                    container_output_folder=workspace.container_output_path,
+                                    container_resources_folder=workspace.container_resources_path)
+            report['staging_time'] = time.time() - start
+            resume_stage = 'running'
+
+        if resume_stage == 'running':
+            queue.set_state(job['job_id'], 'running')
+            processing_start = time.time()
+            os.makedirs(case_output_folder, exist_ok=True)
+            cache_key = None
+            if SharedResources.getInstance().use_result_cache:
+                cache_key = ResultCache.compute_key(folder_fingerprints(workspace.data_path),
+                                                    model_json.get('model_name'),
+                                                    get_cloud_checksum(model_json.get('name')),
+                                                    workspace.config_filename, workspace.container_path,
+                                                    get_local_model_fingerprint(model_json.get('model_name'),
+                                                                                logic_task, iodict),
+                                                    model_json['docker']['dockerhub_repository'])
+            report['cache_hit'] = cache_key is not None and \
+                ResultCache.getInstance().restore(cache_key, workspace.output_path)
+            if not report['cache_hit']:
+                tracker = ProgressTracker(model_json.get('model_name'),
+                                          SharedResources.getInstance().performance_profile)
+                with open(os.path.join(case_output_folder, 'backend.log'), 'w') as log_file:
+                    def on_line(line):
+                        tracker.feed(line)
+                        log_file.write(line)
+                    success = run_backend(docker_image_name=model_json['docker']['dockerhub_repository'],
+                                          workspace=workspace, line_callback=on_line)
+                tracker.finish(success=success)
+                if not success:
+                    raise RuntimeError('The backend reported a failure, see backend.log.')
+                if cache_key is not None:
+                    ResultCache.getInstance().store(cache_key, workspace.output_path,
+                                                    description=model_json.get('model_name'))
+            report['processing_time'] = time.time() - processing_start
+            resume_stage = 'importing'
+
+        queue.set_state(job['job_id'], 'importing')
+        export_start = time.time()
+        os.makedirs(case_output_folder, exist_ok=True)
+        for f in os.listdir(workspace.output_path):
+            dest = os.path.join(case_output_folder, f)
+            if os.path.isdir(dest):
+                shutil.rmtree(dest)
+            shutil.move(os.path.join(workspace.output_path, f), dest)
+        report['export_time'] = time.time() - export_start
+        report['success'] = True
+        report['total_time'] = time.time() - start
+        queue.set_state(job['job_id'], 'done', report=report)
+        workspace.release()
+        shutil.rmtree(workspace.path, ignore_errors=True)
+    except Exception as e:
+        report['error'] = str(e)
+        report['total_time'] = time.time() - start
+        logging.error("Case {} failed:\n{}".format(case['case_id'], traceback.format_exc()))
+        # The workspace is kept (pinned), for a later resume to restart from the failed stage.
+        queue.fail(job['job_id'], error=str(e), report=report)
+        if workspace is not None:
+            workspace.release()
+    logging.info("{}: {} in {:.1f}s (staging {:.1f}s, processing {:.1f}s, export {:.1f}s){}".format(
+        case['case_id'], 'done' if report['success'] else 'FAILED', report['total_time'], report['staging_time'],
+        report['processing_time'], report['export_time'], '' if report['success'] else ' - ' + report['error']))
+    remaining, eta = estimate_queue_time(job['batch_id'], model_json.get('model_name'))
+    if remaining != 0:
+        logging.info("{} case(s) remaining{}.".format(
+            remaining, '' if eta is None else ', queue expected to drain in {:.0f}s'.format(eta)))
+
+
+def write_summary(reports: list, output_folder: str, wall_time: float, previously_done: int = 0) -> dict:
+    """
+    Writes the per-case reports (batch_summary.csv) and the aggregate throughput (batch_summary.json). The cases
+    already done in a previous session (previously_done) are not accounted for in the throughput.
+
+    Return
+    ------
+    dict
+        Aggregate statistics over the cohort.
+    """
+    with open(os.path.join(output_folder, 'batch_summary.csv'), 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=list(reports[0].keys()) if len(reports) != 0 else ['case_id'])
+        writer.writeheader()
+        for r in reports:
+            writer.writerow(r)
+
+    processed = [r for r in reports if r['success']]
+    aggregate = {'cases': len(reports), 'succeeded': len(processed), 'failed': len(reports) - len(processed),
+                 'previously_done': previously_done, 'wall_time': wall_time,
+                 'cases_per_hour': 3600. * (len(processed) - previously_done) / wall_time if wall_time > 0 else 0.,
+                 'mean_case_time': sum([r['total_time'] for r in processed]) / len(processed) if processed else 0.,
+                 'mean_processing_time': sum([r['processing_time'] for r in processed]) / len(processed)
+                 if processed else 0.,
+                 'input_mb_per_second': sum([r['input_mb'] for r in reports]) /
+                                        max(sum([r['staging_time'] for r in reports]), 1e-6),
+                 'cache_hits': len([r for r in reports if r.get('cache_hit')])}
+    with open(os.path.join(output_folder, 'batch_summary.json'), 'w') as outfile:
+        json.dump({'aggregate': aggregate, 'cases': reports}, outfile, indent=4)
+    return aggregate
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Headless cohort processing with Raidionics models/RADS pipelines.')
+    parser.add_argument('--manifest', required=True, help='CSV or JSON file listing the input volumes of each case.')
+    parser.add_argument('--model', required=True, help='Name of the local model or RADS pipeline to run.')
+    parser.add_argument('--output', required=True, help='Destination folder, one sub-folder per case.')
+    parser.add_argument('--docker', default=shutil.which('docker'), help='Docker executable path.')
+    parser.add_argument('--native-python', default=None, help='Run the backend natively with the Python '
+                                                               'interpreter of this environment, instead of Docker.')
+    parser.add_argument('--in-process', action='store_true', help='Run the backend inside the current Python '
+                                                                  'interpreter, which must have raidionics_rads.')
+    parser.add_argument('--warm-backend', action='store_true', help='Process all cases in a single long-lived '
+                                                                    'backend container.')
+    parser.add_argument('--engine-api', action='store_true', help='Use the Docker Engine API socket.')
+    parser.add_argument('--jobs', type=int, default=1, help='Maximum number of cases processed simultaneously.')
+    parser.add_argument('--cpus', type=float, default=0., help='CPUs for the backend, split between the parallel jobs '
+                                                               '(0: all but the reserved cores).')
+    parser.add_argument('--reserved-cores', type=int, default=1, help='Cores kept free for the rest of the system.')
+    parser.add_argument('--memory', type=int, default=0, help='Backend memory limit in MB, split between the parallel '
+                                                              'jobs (0: no limit).')
+    parser.add_argument('--shm-size', type=int, default=0, help='Shared memory size in MB of each backend container.')
+    parser.add_argument('--profile', default='balanced', choices=['fast', 'balanced', 'accurate'],
+                        help='Backend inference performance profile.')
+    parser.add_argument('--keep-intermediate-files', action='store_true', help='Keep the intermediate files of the '
+                                                                              'backend, for debugging purposes.')
+    parser.add_argument('--atlases', default='all', help='Atlases computed for the neuro reports, either a preset '
+                                                         '(all, routine: MNI and BCB) or a comma-separated list among '
+                                                         '{}.'.format(', '.join(ATLAS_PRESETS['all'])))
+    parser.add_argument('--transfer-format', default='nii.gz', choices=TRANSFER_FORMATS,
+                        help='Encoding of the volumes staged for the backend.')
+    parser.add_argument('--compression-level', type=int, default=6, help='Gzip level of the compressed formats.')
+    parser.add_argument('--no-cache', action='store_true', help='Always run the backend, ignoring the cached results.')
+    parser.add_argument('--restart', action='store_true', help='Process again all cases, instead of resuming the '
+                                                               'previous session of the same batch.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    SharedResources.getInstance().set_environment(headless=True)
+    SharedResources.getInstance().docker_path = args.docker
+    SharedResources.getInstance().backend_execution_mode = 'in_process' if args.in_process else \
+        'native' if args.native_python is not None else 'docker'
+    SharedResources.getInstance().native_backend_python = args.native_python
+    SharedResources.getInstance().use_warm_backend = args.warm_backend
+    SharedResources.getInstance().use_docker_engine_api = args.engine_api
+    SharedResources.getInstance().max_concurrent_jobs = args.jobs
+    SharedResources.getInstance().use_result_cache = not args.no_cache
+    SharedResources.getInstance().performance_profile = args.profile
+    SharedResources.getInstance().keep_intermediate_files = args.keep_intermediate_files
+    set_selected_atlases(args.atlases)
+    SharedResources.getInstance().transfer_format = args.transfer_format
+    SharedResources.getInstance().transfer_compression_level = args.compression_level
+    SharedResources.getInstance().container_cpus = args.cpus
+    SharedResources.getInstance().container_reserved_cores = args.reserved_cores
+    SharedResources.getInstance().container_memory_mb = args.memory
+    SharedResources.getInstance().container_shm_size_mb = args.shm_size
+
+    model_json = find_local_model(args.model)
+    if model_json is None:
+        logging.error("No local model or RADS pipeline named {}.".format(args.model))
+        return 1
+    docker_image_name = model_json['docker']['dockerhub_repository']
+    if args.in_process:
+        if check_in_process_backend() is None:
+            logging.error("raidionics_rads is not installed in the current Python environment.")
+            return 1
+    elif args.native_python is not None:
+        if check_native_backend(args.native_python) is None:
+            logging.error("raidionics_rads is not usable with {}.".format(args.native_python))
+            return 1
+    elif not DockerMetadataCache.getInstance().is_daemon_running():
+        logging.error("Docker Daemon is not running")
+        return 1
+    elif not DockerMetadataCache.getInstance().image_exists(docker_image_name) and \
+            not DockerMetadataCache.getInstance().pull_image(docker_image_name):
+        logging.error("The Docker image {} could not be downloaded.".format(docker_image_name))
+        return 1
+
+    iodict = create_iodict(model_json)
+    cases = read_manifest(args.manifest)
+    os.makedirs(args.output, exist_ok=True)
+    # The same manifest, model and destination always map to the same batch, to resume it after an interruption.
+    batch_id = hashlib.sha1('|'.join([os.path.realpath(args.manifest), args.model,
+                                      os.path.realpath(args.output)]).encode('utf-8')).hexdigest()[:16]
+    queue = JobQueue.getInstance()
+    if args.restart:
+        queue.remove_batch(batch_id)
+    for case in cases:
+        queue.add_job(batch_id, case['case_id'], model_json.get('model_name'), case)
+    case_ids = [c['case_id'] for c in cases]
+    previously_done = len([j for j in queue.jobs(batch_id=batch_id, states=['done']) if j['case_id'] in case_ids])
+    if previously_done != 0:
+        logging.info("Resuming batch {}: {}/{} cases already done.".format(batch_id, previously_done, len(cases)))
+
+    start = time.time()
+    scheduler = JobScheduler(batch_id, lambda job: process_job(job, model_json, iodict, args.output),
+                             max_concurrent_jobs=args.jobs)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+        logging.warning("Interrupted, the unfinished cases will be resumed at the next execution.")
+        return 130
+    reports = [j['report'] if j['report'] else create_case_report(j['case_id'], error=j['error'] or '')
+               for j in queue.jobs(batch_id=batch_id) if j['case_id'] in case_ids]
+
+    if args.warm_backend:
+        from src.utils.backend_worker import BackendWorker
+        BackendWorker.getInstance().stop()
+    collect_workspaces()
+    aggregate = write_summary(reports, args.output, time.time() - start, previously_done=previously_done)
+    logging.info("Cohort processed: {}/{} cases succeeded in {:.1f}s ({:.1f} cases/hour, {:.1f}s per case on "
+                 "average).".format(aggregate['succeeded'], aggregate['cases'], aggregate['wall_time'],
+                                    aggregate['cases_per_hour'], aggregate['mean_case_time']))
+    return 0 if aggregate['failed'] == 0 else 2
+
+
+if __name__ == '__main__':
+    exit_code = main(sys.argv[1:])
+    try:
+        import slicer
+        slicer.util.exit(exit_code)
+    except ImportError:
+        sys.exit(exit_code)
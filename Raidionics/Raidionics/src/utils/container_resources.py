@@ -0,0 +1,185 @@
+import csv
+import logging
+import os
+import platform
+import threading
+import time
+import traceback
+
+from src.utils.resources import SharedResources
+
+
+class ContainerResources:
+    """
+    Resource limits applied to one backend container. A zero value means no limit.
+    """
+    def __init__(self, cpus: float = 0., cpuset: list = None, memory_mb: int = 0, shm_size_mb: int = 0,
+                 slot: int = None):
+        self.cpus = cpus
+        self.cpuset = cpuset if cpuset is not None else []
+        self.memory_mb = memory_mb
+        self.shm_size_mb = shm_size_mb
+        self.slot = slot
+
+    @property
+    def cpuset_string(self) -> str:
+        return ','.join([str(c) for c in self.cpuset])
+
+    def cli_flags(self) -> list:
+        """
+        Return
+        ------
+        list
+            Arguments for the docker run command line.
+        """
+        flags = []
+        if self.cpus > 0:
+            flags.append('--cpus={:.2f}'.format(self.cpus))
+        if len(self.cpuset) != 0:
+            flags.append('--cpuset-cpus={}'.format(self.cpuset_string))
+        if self.memory_mb > 0:
+            flags.append('--memory={}m'.format(int(self.memory_mb)))
+        if self.shm_size_mb > 0:
+            flags.append('--shm-size={}m'.format(int(self.shm_size_mb)))
+        return flags
+
+    def host_config(self) -> dict:
+        """
+        Return
+        ------
+        dict
+            HostConfig fields for the Docker Engine API.
+        """
+        config = dict()
+        if self.cpus > 0:
+            config['NanoCpus'] = int(self.cpus * 1e9)
+        if len(self.cpuset) != 0:
+            config['CpusetCpus'] = self.cpuset_string
+        if self.memory_mb > 0:
+            config['Memory'] = int(self.memory_mb * 1024 * 1024)
+        if self.shm_size_mb > 0:
+            config['ShmSize'] = int(self.shm_size_mb * 1024 * 1024)
+        return config
+
+    def __str__(self):
+        return ' '.join(self.cli_flags()) if len(self.cli_flags()) != 0 else 'unlimited'
+
+
+class ContainerResourcesAllocator:
+    """
+    Singleton class splitting the machine resources between the backend containers running simultaneously.
+    A few cores are kept aside for Slicer (rendering, user interactions). When several jobs run in parallel, each job
+    is pinned to its own disjoint set of cores, and the memory budget is divided between the jobs.
+    The duration of each job is recorded alongside its resources, to tune the split.
+    """
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if ContainerResourcesAllocator.__instance == None:
+            ContainerResourcesAllocator()
+        return ContainerResourcesAllocator.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if ContainerResourcesAllocator.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            ContainerResourcesAllocator.__instance = self
+            self.__init_base_variables()
+
+    def __init_base_variables(self):
+        self.throughput_filename = os.path.join(SharedResources.getInstance().Raidionics_dir, 'job_throughput.csv')
+        self.throughput_columns = ['timestamp', 'image', 'mode', 'profile', 'parallel_jobs', 'cpus', 'cpuset',
+                                   'memory_mb', 'shm_size_mb', 'duration', 'jobs_per_hour', 'success']
+        self.__lock = threading.Lock()
+        self.__used_slots = set()
+
+    def available_cores(self) -> list:
+        """
+        Return
+        ------
+        list
+            Indices of the cores usable by the backend containers, i.e. all but the ones reserved for Slicer.
+        """
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else \
+            list(range(os.cpu_count() or 1))
+        reserved = min(SharedResources.getInstance().container_reserved_cores, len(cores) - 1)
+        return cores[reserved:]
+
+    def acquire(self) -> ContainerResources:
+        """
+        Reserves the resources of one job, to be given back with release once the container is stopped.
+        """
+        slots = max(1, SharedResources.getInstance().max_concurrent_jobs)
+        with self.__lock:
+            free = [s for s in range(slots) if s not in self.__used_slots]
+            slot = free[0] if len(free) != 0 else None
+            if slot is not None:
+                self.__used_slots.add(slot)
+        # Without free slot (e.g., the concurrency limit was lowered meanwhile), only the global limits apply.
+        return self.profile(slot=slot, slots=slots if slot is not None else 1)
+
+    def profile(self, slot: int = 0, slots: int = 1) -> ContainerResources:
+        """
+        Return
+        ------
+        ContainerResources
+            Resources of the given slot, when the machine is split between `slots` simultaneous jobs.
+        """
+        shared = SharedResources.getInstance()
+        cores = self.available_cores()
+        resources = ContainerResources(memory_mb=shared.container_memory_mb, shm_size_mb=shared.container_shm_size_mb,
+                                       slot=slot)
+        # The host cores are only meaningful when Docker runs natively, not inside a virtual machine (macOS, Windows)
+        # where only the user-defined CPU quota is applied.
+        native = platform.system() == 'Linux'
+        cpus = float(len(cores)) if native else 0.
+        if shared.container_cpus > 0:
+            cpus = min(cpus, shared.container_cpus) if native else shared.container_cpus
+        resources.cpus = cpus
+        if slots > 1:
+            if shared.container_memory_mb > 0:
+                resources.memory_mb = shared.container_memory_mb // slots
+            resources.cpus = cpus / slots
+            if native and len(cores) >= slots:
+                # Disjoint core sets, the first jobs getting the remaining cores if not evenly divisible.
+                per_slot, remainder = divmod(len(cores), slots)
+                start = slot * per_slot + min(slot, remainder)
+                resources.cpuset = cores[start:start + per_slot + (1 if slot < remainder else 0)]
+                resources.cpus = min(float(len(resources.cpuset)), max(cpus / slots, 0.01))
+        return resources
+
+    def release(self, resources: ContainerResources) -> None:
+        with self.__lock:
+            self.__used_slots.discard(resources.slot)
+
+    def record(self, docker_image_name: str, resources: ContainerResources, duration: float, success: bool) -> None:
+        """
+        Appends the duration of a job, and the resources actually applied to it, to the throughput history (csv).
+        """
+        with self.__lock:
+            try:
+                new_file = not os.path.exists(self.throughput_filename)
+                if not new_file:
+                    with open(self.throughput_filename, 'r', newline='') as infile:
+                        header = next(csv.reader(infile), [])
+                    if header != self.throughput_columns:
+                        # History written with other columns, kept aside.
+                        os.replace(self.throughput_filename, self.throughput_filename[:-len('.csv')] + '_' +
+                                   time.strftime('%Y%m%d-%H%M%S') + '.csv')
+                        new_file = True
+                with open(self.throughput_filename, 'a', newline='') as outfile:
+                    writer = csv.writer(outfile)
+                    if new_file:
+                        writer.writerow(self.throughput_columns)
+                    writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S'), docker_image_name,
+                                     SharedResources.getInstance().backend_execution_mode,
+                                     SharedResources.getInstance().performance_profile,
+                                     SharedResources.getInstance().max_concurrent_jobs, resources.cpus,
+                                     resources.cpuset_string, resources.memory_mb, resources.shm_size_mb,
+                                     '{:.2f}'.format(duration), '{:.2f}'.format(3600. / max(duration, 1e-6)), success])
+            except Exception:
+                logging.warning("Job throughput could not be recorded.")
+                logging.warning(traceback.format_exc())
@@ -0,0 +1,306 @@
+import http.client
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from urllib.parse import quote, urlencode
+
+
+class DockerEngineError(Exception):
+    """
+    Raised when the Docker Engine API answers with an error status, or cannot be reached.
+    """
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a local Unix domain socket, as exposed by the Docker daemon.
+    """
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class DockerEngineClient:
+    """
+    Minimal client for the Docker Engine HTTP API, talking directly to the daemon socket instead of spawning a Docker
+    CLI process for each call. The connection used for the short requests is kept open and reused (HTTP keep-alive),
+    while the long streaming requests (pull, logs, wait) get their own connection so that they do not block the others.
+    The socket_path can point to any server speaking the same protocol, e.g. a local stand-in for testing purposes.
+    """
+    def __init__(self, socket_path: str = '/var/run/docker.sock', api_version: str = 'v1.41', timeout: float = 60.):
+        self.socket_path = socket_path
+        self.api_version = api_version
+        self.timeout = timeout
+        self.__connection = None
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def is_supported(socket_path: str = '/var/run/docker.sock') -> bool:
+        """
+        Return
+        ------
+        bool
+            Boolean asserting whether the platform supports Unix sockets and the daemon socket exists.
+        """
+        return hasattr(socket, 'AF_UNIX') and os.path.exists(socket_path)
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
+
+    def __url(self, endpoint: str, params: dict = None) -> str:
+        url = '/' + self.api_version + endpoint
+        if params:
+            url += '?' + urlencode(params)
+        return url
+
+    def __request(self, method: str, endpoint: str, params: dict = None, body: dict = None):
+        """
+        Performs a short request on the persistent connection, and returns the status with the decoded JSON content.
+        The connection is re-opened once if the daemon closed it in the meantime.
+        """
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        with self.__lock:
+            for attempt in range(2):
+                if self.__connection is None:
+                    self.__connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+                try:
+                    self.__connection.request(method, self.__url(endpoint, params), body=payload, headers=headers)
+                    response = self.__connection.getresponse()
+                    content = response.read()
+                    break
+                except (http.client.HTTPException, ConnectionError, BrokenPipeError) as e:
+                    self.__connection.close()
+                    self.__connection = None
+                    if attempt == 1:
+                        raise DockerEngineError("Docker Engine API unreachable: {}".format(e))
+                except OSError as e:
+                    self.__connection.close()
+                    self.__connection = None
+                    raise DockerEngineError("Docker Engine API unreachable: {}".format(e))
+        result = json.loads(content.decode('utf-8')) if len(content) != 0 else None
+        return response.status, result
+
+    def __stream(self, method: str, endpoint: str, params: dict = None, body: dict = None):
+        """
+        Opens a dedicated connection for a long-running request, and returns the response to be consumed by the caller.
+        """
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        connection = UnixHTTPConnection(self.socket_path, timeout=None)
+        try:
+            connection.request(method, self.__url(endpoint, params), body=payload, headers=headers)
+            response = connection.getresponse()
+        except OSError as e:
+            connection.close()
+            raise DockerEngineError("Docker Engine API unreachable: {}".format(e))
+        if response.status >= 400:
+            content = response.read()
+            connection.close()
+            raise DockerEngineError(self.__error_message(content), response.status)
+        return connection, response
+
+    @staticmethod
+    def __error_message(content) -> str:
+        try:
+            return json.loads(content.decode('utf-8'))['message']
+        except Exception:
+            return content.decode('utf-8', errors='replace')
+
+    def ping(self) -> bool:
+        """
+        Return
+        ------
+        bool
+            Boolean asserting whether the daemon is reachable and answering.
+        """
+        try:
+            with self.__lock:
+                if self.__connection is None:
+                    self.__connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+                self.__connection.request('GET', '/_ping')
+                response = self.__connection.getresponse()
+                content = response.read()
+            return response.status == 200 and content.strip() == b'OK'
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return False
+
+    def inspect_image(self, docker_image_name: str):
+        """
+        Parameters
+        ----------
+        docker_image_name: str
+            Name of the Docker image in the form <user>/<image_name>:<tag>
+
+        Return
+        ------
+        dict
+            Structured image description (including the RepoDigests), or None if the image does not exist locally.
+        """
+        status, result = self.__request('GET', '/images/{}/json'.format(quote(docker_image_name, safe='')))
+        if status == 404:
+            return None
+        if status >= 400:
+            raise DockerEngineError(result['message'] if result else '', status)
+        return result
+
+    def list_images(self) -> list:
+        """
+        Return
+        ------
+        list
+            Structured description of all the local images, including their RepoDigests.
+        """
+        status, result = self.__request('GET', '/images/json', params={'digests': 'true'})
+        if status >= 400:
+            raise DockerEngineError(result['message'] if result else '', status)
+        return result
+
+    def pull_image(self, docker_image_name: str, progress_callback=None) -> bool:
+        """
+        Pulls the requested image, forwarding each structured progress event (status, id, progressDetail) to the
+        progress_callback.
+
+        Return
+        ------
+        bool
+            Boolean asserting whether the pull operation succeeded.
+        """
+        image, _, tag = docker_image_name.rpartition(':')
+        if image == '' or '/' in tag:
+            image, tag = docker_image_name, 'latest'
+        connection, response = self.__stream('POST', '/images/create', params={'fromImage': image, 'tag': tag})
+        success = True
+        try:
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                if line.strip() == b'':
+                    continue
+                event = json.loads(line.decode('utf-8'))
+                if 'error' in event:
+                    success = False
+                    logging.warning("Docker image pull failed: {}".format(event['error']))
+                if progress_callback is not None:
+                    progress_callback(event)
+        finally:
+            connection.close()
+        return success
+
+    def create_container(self, docker_image_name: str, command: list = None, binds: list = None, user: str = None,
+                         entrypoint: list = None, host_config: dict = None, name: str = None) -> str:
+        """
+        Parameters
+        ----------
+        binds: list
+            Volume mounts in the CLI form <host_path>:<container_path>.
+        host_config: dict
+            Additional HostConfig fields (e.g., NanoCpus, Memory), merged with the binds.
+
+        Return
+        ------
+        str
+            Identifier of the created container.
+        """
+        body = {'Image': docker_image_name, 'Tty': False, 'AttachStdout': True, 'AttachStderr': True,
+                'HostConfig': dict(host_config) if host_config is not None else {}}
+        if command is not None:
+            body['Cmd'] = command
+        if entrypoint is not None:
+            body['Entrypoint'] = entrypoint
+        if user is not None:
+            body['User'] = user
+        if binds is not None:
+            body['HostConfig']['Binds'] = binds
+        status, result = self.__request('POST', '/containers/create', params={'name': name} if name else None,
+                                        body=body)
+        if status >= 400:
+            raise DockerEngineError(result['message'] if result else '', status)
+        for warning in (result.get('Warnings') or []):
+            logging.warning("Docker container creation: {}".format(warning))
+        return result['Id']
+
+    def start_container(self, container_id: str) -> None:
+        status, result = self.__request('POST', '/containers/{}/start'.format(container_id))
+        if status >= 400 and status != 304:
+            raise DockerEngineError(result['message'] if result else '', status)
+
+    def kill_container(self, container_id: str) -> None:
+        status, result = self.__request('POST', '/containers/{}/kill'.format(container_id))
+        if status >= 400 and status != 409:
+            raise DockerEngineError(result['message'] if result else '', status)
+
+    def remove_container(self, container_id: str, force: bool = True) -> None:
+        status, result = self.__request('DELETE', '/containers/{}'.format(container_id),
+                                        params={'force': 'true' if force else 'false'})
+        if status >= 400 and status != 404:
+            raise DockerEngineError(result['message'] if result else '', status)
+
+    def inspect_container(self, container_id: str) -> dict:
+        status, result = self.__request('GET', '/containers/{}/json'.format(container_id))
+        if status >= 400:
+            raise DockerEngineError(result['message'] if result else '', status)
+        return result
+
+    def wait_container(self, container_id: str) -> dict:
+        """
+        Blocks until the container stops.
+
+        Return
+        ------
+        dict
+            Structured exit status, in the form {'StatusCode': int, 'Error': ...}.
+        """
+        connection, response = self.__stream('POST', '/containers/{}/wait'.format(container_id))
+        try:
+            return json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+    def container_logs(self, container_id: str, line_callback, follow: bool = True) -> None:
+        """
+        Forwards the container output, line by line, to the line_callback. When following, returns once the container
+        has stopped.
+        The stream is multiplexed (8-byte frame headers) for containers created without a TTY, which is the case for
+        all the containers created by this client.
+        """
+        params = {'stdout': 'true', 'stderr': 'true', 'follow': 'true' if follow else 'false'}
+        connection, response = self.__stream('GET', '/containers/{}/logs'.format(container_id), params=params)
+        pending_line = b''
+        try:
+            while True:
+                header = response.read(8)
+                if len(header) < 8:
+                    break
+                _, frame_size = struct.unpack('>BxxxL', header)
+                content = pending_line + response.read(frame_size)
+                lines = content.split(b'\n')
+                for line in lines[:-1]:
+                    line_callback(line.decode('utf-8', errors='replace') + '\n')
+                pending_line = lines[-1]
+            if pending_line != b'':
+                line_callback(pending_line.decode('utf-8', errors='replace'))
+        finally:
+            connection.close()
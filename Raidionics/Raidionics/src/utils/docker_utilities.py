@@ -0,0 +1,232 @@
+import logging
+import subprocess
+import threading
+import time
+import traceback
+
+from src.utils.resources import SharedResources
+from src.utils.docker_engine_client import DockerEngineClient, DockerEngineError
+
+_docker_engine_client = None
+
+
+def get_docker_engine_client():
+    """
+    Returns the shared Docker Engine API client if this transport is enabled and available on the platform, None
+    otherwise (in which case the Docker CLI should be used).
+    """
+    global _docker_engine_client
+    socket_path = SharedResources.getInstance().docker_socket_path
+    if not SharedResources.getInstance().use_docker_engine_api or not DockerEngineClient.is_supported(socket_path):
+        return None
+    if _docker_engine_client is None or _docker_engine_client.socket_path != socket_path:
+        _docker_engine_client = DockerEngineClient(socket_path=socket_path)
+    return _docker_engine_client
+
+
+class DockerMetadataCache:
+    """
+    Singleton class answering the recurrent Docker queries (daemon status, local image existence, local digests) from
+    memory, instead of spawning a Docker CLI process for each of them.
+    Each entry is kept for a limited time (ttl seconds), and the image related entries are invalidated after a pull.
+    Safe to use from the GUI thread and from the processing thread concurrently.
+    """
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if DockerMetadataCache.__instance == None:
+            DockerMetadataCache()
+        return DockerMetadataCache.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if DockerMetadataCache.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            DockerMetadataCache.__instance = self
+            self.__init_base_variables()
+
+    def __init_base_variables(self):
+        self.ttl = 300.
+        self.daemon_ttl = 30.
+        self.__lock = threading.Lock()
+        self.__daemon_status = None
+        self.__images = {}
+        self.__digests = None
+        self.hits = 0
+        self.misses = 0
+
+    def __get(self, entry, ttl):
+        """
+        Returns the cached value if still valid, None otherwise. The lock must be held by the caller.
+        """
+        if entry is None or time.time() - entry[0] > ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def invalidate(self, docker_image_name: str = None) -> None:
+        """
+        Drops the cached information about the given image (and the digests list), or everything if no image is given.
+
+        Parameters
+        ----------
+        docker_image_name: str
+            Name of the Docker image in the form <user>/<image_name>:<tag>
+        """
+        with self.__lock:
+            if docker_image_name is None:
+                self.__daemon_status = None
+                self.__images = {}
+            elif docker_image_name in self.__images:
+                del self.__images[docker_image_name]
+            self.__digests = None
+
+    def is_daemon_running(self) -> bool:
+        """
+        Return
+        ------
+        bool
+            Boolean asserting whether the Docker daemon answered to a `docker ps` call.
+        """
+        with self.__lock:
+            status = self.__get(self.__daemon_status, self.daemon_ttl)
+        if status is not None:
+            return status
+
+        status = False
+        try:
+            client = get_docker_engine_client()
+            if client is not None:
+                status = client.ping()
+                if not status:
+                    logging.warning("Docker Engine API unreachable.\nFalling back to the Docker command line.")
+            if not status:
+                p = subprocess.Popen([SharedResources.getInstance().docker_path, 'ps'], stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+                stdout, stderr = p.communicate()
+                status = stdout.decode("utf-8")[:9] == 'CONTAINER'
+        except Exception:
+            logging.warning("Docker daemon status could not be queried.")
+            logging.warning(traceback.format_exc())
+        with self.__lock:
+            # A daemon found down is queried again at the next call, as the user might be starting it.
+            self.__daemon_status = (time.time(), status) if status else None
+        return status
+
+    def image_exists(self, docker_image_name: str) -> bool:
+        """
+        Parameters
+        ----------
+        docker_image_name: str
+            Name of the Docker image in the form <user>/<image_name>:<tag>
+
+        Return
+        ------
+        bool
+            Boolean asserting whether the requested Docker image exists locally or not.
+        """
+        with self.__lock:
+            status = self.__get(self.__images.get(docker_image_name), self.ttl)
+        if status is not None:
+            return status
+
+        status = None
+        client = get_docker_engine_client()
+        if client is not None:
+            try:
+                status = client.inspect_image(docker_image_name) is not None
+            except DockerEngineError as e:
+                logging.warning("{}\nFalling back to the Docker command line.".format(e))
+        if status is None:
+            p = subprocess.Popen([SharedResources.getInstance().docker_path, 'image', 'inspect', docker_image_name],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = p.communicate()
+            status = 'Error: No such image' not in stderr.decode("utf-8")
+        with self.__lock:
+            # A missing image is queried again at the next call, as it might be pulled from outside the plugin.
+            if status:
+                self.__images[docker_image_name] = (time.time(), status)
+        return status
+
+    def image_digests(self) -> list:
+        """
+        Return
+        ------
+        list
+            Digests of all the local Docker images.
+        """
+        with self.__lock:
+            digests = self.__get(self.__digests, self.ttl)
+        if digests is not None:
+            return list(digests)
+
+        digests = []
+        try:
+            client = get_docker_engine_client()
+            if client is not None:
+                try:
+                    for image in client.list_images():
+                        digests.extend([x.split('@')[-1] for x in (image.get('RepoDigests') or [])])
+                    with self.__lock:
+                        self.__digests = (time.time(), digests)
+                    return list(digests)
+                except DockerEngineError as e:
+                    logging.warning("{}\nFalling back to the Docker command line.".format(e))
+                    digests = []
+            p = subprocess.Popen([SharedResources.getInstance().docker_path, 'images', '--digests'],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = p.communicate()
+            digest_index = 2
+            for line in stdout.decode("utf-8").split('\n'):
+                line = line.split()
+                if len(line) == 0:
+                    continue
+                if 'DIGEST' in line:
+                    digest_index = line.index('DIGEST')
+                elif len(line) > digest_index:
+                    digests.append(line[digest_index])
+        except Exception:
+            logging.warning("Docker images digests could not be queried.")
+            logging.warning(traceback.format_exc())
+        with self.__lock:
+            self.__digests = (time.time(), digests)
+        return list(digests)
+
+    def pull_image(self, docker_image_name: str, progress_callback=None) -> bool:
+        """
+        Pulls the requested image, then invalidates its cached information.
+
+        Parameters
+        ----------
+        docker_image_name: str
+            Name of the Docker image in the form <user>/<image_name>:<tag>
+        progress_callback: callable
+            Called from the pulling thread with each structured pull progress event when using the Docker Engine API,
+            or with {'status': <line>} for each output line of the Docker command line.
+
+        Return
+        ------
+        bool
+            Boolean asserting whether the pull operation succeeded.
+        """
+        try:
+            client = get_docker_engine_client()
+            if client is not None:
+                try:
+                    return client.pull_image(docker_image_name, progress_callback=progress_callback)
+                except DockerEngineError as e:
+                    logging.warning("{}\nFalling back to the Docker command line.".format(e))
+            p = subprocess.Popen([SharedResources.getInstance().docker_path, 'image', 'pull', docker_image_name],
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            # Streamed, the pull of a large image taking minutes.
+            for line in iter(p.stdout.readline, b''):
+                if progress_callback is not None and line.strip() != b'':
+                    progress_callback({'status': line.decode('utf-8', errors='replace').strip()})
+            p.wait()
+            return p.returncode == 0
+        finally:
+            self.invalidate(docker_image_name)
@@ -26,6 +26,7 @@ except:
     import gdown
 
 from src.utils.resources import SharedResources
+from src.utils.docker_utilities import DockerMetadataCache
 
 
 def get_available_cloud_models_list() -> List[List[str]]:
@@ -340,6 +341,7 @@ class WorkerFinishedSignal(qt.QObject):
 
 class DownloadWorker(qt.QObject): #qt.QThread
     finished_signal = qt.Signal(bool)
+    progress_signal = qt.Signal(str)
 
     def __init__(self):
         super(qt.QObject, self).__init__()
@@ -487,37 +489,30 @@ class DownloadWorker(qt.QObject): #qt.QThread
         # return success
 
     def download_docker_image(self, select_image):
-        # @TODO. If the download is slow, no info is printed on screen, might make the user wonder what is happening...
-        cmd_docker = ['docker', 'image', 'pull', select_image]
-        p = subprocess.Popen(cmd_docker, stdout=subprocess.PIPE)
-        res_lines = ""
-        while True:
+        # The pull runs in a background thread, the GUI being kept responsive and informed of its progress meanwhile.
+        events = []
+        result = {'success': False}
+
+        def pull():
+            result['success'] = DockerMetadataCache.getInstance().pull_image(select_image,
+                                                                           progress_callback=events.append)
+
+        thread = threading.Thread(target=pull, daemon=True)
+        thread.start()
+        while thread.is_alive() or len(events) != 0:
+            while len(events) != 0:
+                self.progress_signal.emit(format_pull_event(events.pop(0)))
             slicer.app.processEvents()
-            line = p.stdout.readline().decode("utf-8")
-            if not line:
-                break
-            res_lines = res_lines + '/n' + line
-        # cmd_docker = ['docker', 'image', 'inspect', select_image]
-        # p = subprocess.Popen(cmd_docker, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        # # res_lines = ""
-        # # while True:
-        # #     slicer.app.processEvents()
-        # #     line = p.stderr.readline().decode("utf-8")
-        # #     if not line:
-        # #         break
-        # #     res_lines = res_lines + '/n' + line
-        # #
-        # # # If the image could not be downloaded -- abort
-        # # if 'Error: No such image' in res_lines:
-        # #     result = False
-        # # else:
-        # #     result = True
-        #
-        # stdout, stderr = p.communicate()
-        # # If the image could not be downloaded -- abort
-        # if 'Error: No such image' in stderr.decode("utf-8"):
-        #     result = False
-        # else:
-        #     result = True
-
-        self.finished_signal.emit(True)
+            thread.join(0.05)
+        self.finished_signal.emit(result['success'])
+
+
+def format_pull_event(event: dict) -> str:
+    """
+    One line description of a Docker pull progress event, e.g. 'Downloading 3f4e2a1b: 120/512 MB'.
+    """
+    text = ' '.join([x for x in [event.get('status', ''), event.get('id', '')] if x])
+    detail = event.get('progressDetail') or {}
+    if detail.get('total'):
+        text += ': {:.0f}/{:.0f} MB'.format(detail.get('current', 0) / 1e6, detail['total'] / 1e6)
+    return text
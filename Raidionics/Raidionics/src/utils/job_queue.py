@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from src.utils.resources import SharedResources
+
+
+class JobQueue:
+    """
+    Singleton class holding the persistent queue of processing jobs, stored in a SQLite database inside the
+    .raidionics-slicer folder so that it survives a restart (or a crash) of Slicer.
+    A job goes through the states queued, staging, running, importing, and ends either done or failed. Jobs interrupted
+    while in progress are queued again when resuming, restarting from the stage they were interrupted at.
+    """
+    __instance = None
+
+    states = ['queued', 'staging', 'running', 'importing', 'done', 'failed']
+    stages = ['staging', 'running', 'importing']
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if JobQueue.__instance == None:
+            JobQueue()
+        return JobQueue.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if JobQueue.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            JobQueue.__instance = self
+            self.__init_base_variables()
+
+    def __init_base_variables(self):
+        self.database_filename = os.path.join(SharedResources.getInstance().Raidionics_dir, 'jobs.sqlite')
+        self.__lock = threading.Lock()
+        with self.__connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, batch_id TEXT NOT NULL, '
+                               'case_id TEXT NOT NULL, model_name TEXT, payload TEXT, state TEXT NOT NULL, '
+                               'resume_stage TEXT NOT NULL, run_id TEXT, attempts INTEGER DEFAULT 0, error TEXT, '
+                               'report TEXT, created REAL, updated REAL, UNIQUE (batch_id, case_id))')
+
+    def __connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation, the queue being accessed from the scheduler threads.
+        connection = sqlite3.connect(self.database_filename, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def __execute(self, query: str, parameters: tuple = ()) -> list:
+        with self.__lock:
+            connection = self.__connect()
+            try:
+                with connection:
+                    return connection.execute(query, parameters).fetchall()
+            finally:
+                connection.close()
+
+    @staticmethod
+    def __to_dict(row) -> dict:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+        job['report'] = json.loads(job['report']) if job['report'] else {}
+        return job
+
+    def add_job(self, batch_id: str, case_id: str, model_name: str, payload: dict) -> str:
+        """
+        Queues a job, unless a job already exists for the same case in the batch (e.g., when submitting again the
+        batch of an interrupted session), in which case the existing job is kept untouched.
+
+        Return
+        ------
+        str
+            Identifier of the (new or existing) job.
+        """
+        existing = self.__execute('SELECT job_id FROM jobs WHERE batch_id=? AND case_id=?', (batch_id, case_id))
+        if len(existing) != 0:
+            return existing[0]['job_id']
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.__execute('INSERT INTO jobs (job_id, batch_id, case_id, model_name, payload, state, resume_stage, '
+                       'created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (job_id, batch_id, case_id, model_name, json.dumps(payload), 'queued', 'staging', now, now))
+        return job_id
+
+    def get_job(self, job_id: str) -> dict:
+        rows = self.__execute('SELECT * FROM jobs WHERE job_id=?', (job_id,))
+        return self.__to_dict(rows[0]) if len(rows) != 0 else None
+
+    def jobs(self, batch_id: str = None, states: list = None) -> list:
+        """
+        Return
+        ------
+        list
+            Jobs (as dicts) of the batch (all batches if None) in the given states (all states if None), in
+            submission order.
+        """
+        query = 'SELECT * FROM jobs WHERE 1=1'
+        parameters = []
+        if batch_id is not None:
+            query += ' AND batch_id=?'
+            parameters.append(batch_id)
+        if states is not None:
+            query += ' AND state IN ({})'.format(', '.join(['?'] * len(states)))
+            parameters.extend(states)
+        return [self.__to_dict(r) for r in self.__execute(query + ' ORDER BY created, rowid', tuple(parameters))]
+
+    def requeue_unfinished(self, batch_id: str) -> int:
+        """
+        Queues again the failed jobs of the batch, and the ones left in progress by an interrupted session. Each job
+        keeps the stage it will restart from.
+
+        Return
+        ------
+        int
+            Number of jobs queued again.
+        """
+        count = 0
+        for job in self.jobs(batch_id=batch_id, states=self.stages + ['failed']):
+            resume_stage = job['state'] if job['state'] in self.stages else job['resume_stage']
+            self.__execute('UPDATE jobs SET state=?, resume_stage=?, updated=? WHERE job_id=?',
+                           ('queued', resume_stage, time.time(), job['job_id']))
+            count += 1
+        if count != 0:
+            logging.info("{} unfinished job(s) queued again for batch {}.".format(count, batch_id))
+        return count
+
+    def claim_next(self, batch_id: str) -> dict:
+        """
+        Atomically takes the oldest queued job of the batch, moving it to its resume stage.
+
+        Return
+        ------
+        dict
+            The claimed job, or None if no job is left in the queue.
+        """
+        with self.__lock:
+            connection = self.__connect()
+            try:
+                with connection:
+                    row = connection.execute('SELECT * FROM jobs WHERE batch_id=? AND state=? ORDER BY created, rowid '
+                                             'LIMIT 1', (batch_id, 'queued')).fetchone()
+                    if row is None:
+                        return None
+                    connection.execute('UPDATE jobs SET state=?, attempts=attempts+1, updated=? WHERE job_id=?',
+                                       (row['resume_stage'], time.time(), row['job_id']))
+            finally:
+                connection.close()
+        return self.get_job(row['job_id'])
+
+    def set_state(self, job_id: str, state: str, run_id: str = None, report: dict = None) -> None:
+        """
+        Moves the job to a new state, optionally recording the run workspace and the processing report.
+        """
+        if state not in self.states:
+            raise ValueError("Unknown job state: {}".format(state))
+        query = 'UPDATE jobs SET state=?, updated=?'
+        parameters = [state, time.time()]
+        if state in self.stages:
+            query += ', resume_stage=?'
+            parameters.append(state)
+        if run_id is not None:
+            query += ', run_id=?'
+            parameters.append(run_id)
+        if report is not None:
+            query += ', report=?'
+            parameters.append(json.dumps(report))
+        if state == 'done':
+            query += ', error=NULL'
+        self.__execute(query + ' WHERE job_id=?', tuple(parameters + [job_id]))
+
+    def fail(self, job_id: str, error: str, report: dict = None) -> None:
+        """
+        Marks the job as failed. The stage it failed at is kept, to restart from it when resuming.
+        """
+        query = 'UPDATE jobs SET state=?, error=?, updated=?'
+        parameters = ['failed', error, time.time()]
+        if report is not None:
+            query += ', report=?'
+            parameters.append(json.dumps(report))
+        self.__execute(query + ' WHERE job_id=?', tuple(parameters + [job_id]))
+
+    def remove_batch(self, batch_id: str) -> None:
+        self.__execute('DELETE FROM jobs WHERE batch_id=?', (batch_id,))
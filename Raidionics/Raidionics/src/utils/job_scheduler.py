@@ -0,0 +1,52 @@
+import logging
+import threading
+import traceback
+
+from src.utils.job_queue import JobQueue
+from src.utils.resources import SharedResources
+
+
+class JobScheduler:
+    """
+    Processes the queued jobs of one batch, with at most `max_concurrent_jobs` jobs in progress at any time.
+    The processing of a single job is delegated to `job_function(job)`, responsible for moving the job through its
+    stages in the queue, starting from job['resume_stage'].
+    """
+    def __init__(self, batch_id: str, job_function, max_concurrent_jobs: int = None):
+        self.batch_id = batch_id
+        self.job_function = job_function
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs if max_concurrent_jobs is not None else
+                                       SharedResources.getInstance().max_concurrent_jobs)
+        self.abort = False
+        self.__threads = []
+
+    def run(self) -> None:
+        """
+        Resumes the unfinished jobs of the batch, then blocks until the queue is empty (or the scheduler is stopped).
+        """
+        JobQueue.getInstance().requeue_unfinished(self.batch_id)
+        self.__threads = [threading.Thread(target=self.__work, daemon=True, name='raidionics-job-{}'.format(i))
+                          for i in range(self.max_concurrent_jobs)]
+        for t in self.__threads:
+            t.start()
+        for t in self.__threads:
+            # Joining with a timeout, for the main thread to remain responsive to KeyboardInterrupt.
+            while t.is_alive():
+                t.join(0.5)
+
+    def stop(self) -> None:
+        """
+        No new job is started, the jobs in progress run until completion.
+        """
+        self.abort = True
+
+    def __work(self) -> None:
+        while not self.abort:
+            job = JobQueue.getInstance().claim_next(self.batch_id)
+            if job is None:
+                return
+            try:
+                self.job_function(job)
+            except Exception as e:
+                logging.error("Job {} ({}) failed:\n{}".format(job['job_id'], job['case_id'], traceback.format_exc()))
+                JobQueue.getInstance().fail(job['job_id'], error=str(e))
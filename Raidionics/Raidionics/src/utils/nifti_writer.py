@@ -0,0 +1,150 @@
+"""
+NIfTI-1 writer working directly on the voxel buffer of a volume (e.g., the numpy view returned by
+slicer.util.arrayFromVolume) and its IJK-to-RAS matrix, without creating an intermediate ITK image. The voxels are
+written (or compressed) straight from the buffer, the only additional memory being the compressed blocks in flight.
+
+The header follows the ITK NIfTI writer conventions (qform and sform both set to scanner coordinates, millimeters), so
+that the backend reads the same geometry and voxel values as for a volume written by SimpleITK.
+"""
+import math
+import struct
+
+import numpy as np
+
+from src.utils.volume_codecs import BLOCK_SIZE, write_gzip_members, write_gzip_stream
+
+# NIfTI-1 datatype code and bits per voxel of each supported numpy dtype.
+NIFTI_DATATYPES = {
+    np.dtype('uint8'): (2, 8), np.dtype('int16'): (4, 16), np.dtype('int32'): (8, 32),
+    np.dtype('float32'): (16, 32), np.dtype('float64'): (64, 64), np.dtype('int8'): (256, 8),
+    np.dtype('uint16'): (512, 16), np.dtype('uint32'): (768, 32), np.dtype('int64'): (1024, 64),
+    np.dtype('uint64'): (1280, 64),
+}
+NIFTI_HEADER_FORMAT = '<i10s18sihcb8h3f4h8f3fhcb4f2i80s24s2h6f4f4f4f16s4s'
+NIFTI_VOX_OFFSET = 352
+
+
+def is_supported(array) -> bool:
+    """
+    Whether the array can be written without any copy: a scalar 3D volume, in C order, of a NIfTI-1 voxel type.
+    """
+    return array.ndim == 3 and array.flags['C_CONTIGUOUS'] and array.dtype.newbyteorder('=') in NIFTI_DATATYPES \
+        and array.dtype.byteorder in ['=', '<', '|']
+
+
+def geometry_from_ijk_to_ras(ijk_to_ras) -> tuple:
+    """
+    Decomposes an IJK-to-RAS matrix into the geometry of the equivalent ITK image (LPS coordinates).
+
+    Parameters
+    ----------
+    ijk_to_ras: array-like
+        4x4 matrix.
+
+    Return
+    ------
+    tuple
+        Spacing, origin and direction (flattened row by row), as returned by SimpleITK.
+    """
+    m = np.asarray(ijk_to_ras, dtype=np.float64)
+    spacing = np.linalg.norm(m[:3, :3], axis=0)
+    lps = np.diag([-1., -1., 1.])
+    direction = lps @ (m[:3, :3] / spacing)
+    origin = lps @ m[:3, 3]
+    return tuple(spacing.tolist()), tuple(origin.tolist()), tuple(direction.flatten().tolist())
+
+
+def quaternion_from_rotation(rotation) -> tuple:
+    """
+    Quaternion parameters of a rotation matrix with unit columns, following nifti_mat44_to_quatern (nifti1_io.c).
+
+    Return
+    ------
+    tuple
+        quatern_b, quatern_c, quatern_d and qfac (-1 for a left-handed frame).
+    """
+    r = np.array(rotation, dtype=np.float64)
+    qfac = 1.
+    if np.linalg.det(r) < 0:
+        r[:, 2] = -r[:, 2]
+        qfac = -1.
+    a = r[0, 0] + r[1, 1] + r[2, 2] + 1.
+    if a > 0.5:
+        a = 0.5 * math.sqrt(a)
+        b = 0.25 * (r[2, 1] - r[1, 2]) / a
+        c = 0.25 * (r[0, 2] - r[2, 0]) / a
+        d = 0.25 * (r[1, 0] - r[0, 1]) / a
+    else:
+        xd = 1. + r[0, 0] - (r[1, 1] + r[2, 2])
+        yd = 1. + r[1, 1] - (r[0, 0] + r[2, 2])
+        zd = 1. + r[2, 2] - (r[0, 0] + r[1, 1])
+        if xd > 1.:
+            b = 0.5 * math.sqrt(xd)
+            c = 0.25 * (r[0, 1] + r[1, 0]) / b
+            d = 0.25 * (r[0, 2] + r[2, 0]) / b
+            a = 0.25 * (r[2, 1] - r[1, 2]) / b
+        elif yd > 1.:
+            c = 0.5 * math.sqrt(yd)
+            b = 0.25 * (r[0, 1] + r[1, 0]) / c
+            d = 0.25 * (r[1, 2] + r[2, 1]) / c
+            a = 0.25 * (r[0, 2] - r[2, 0]) / c
+        else:
+            d = 0.5 * math.sqrt(zd)
+            b = 0.25 * (r[0, 2] + r[2, 0]) / d
+            c = 0.25 * (r[1, 2] + r[2, 1]) / d
+            a = 0.25 * (r[1, 0] - r[0, 1]) / d
+        if a < 0.:
+            b, c, d = -b, -c, -d
+    return b, c, d, qfac
+
+
+def create_nifti_header(shape: tuple, dtype, ijk_to_ras) -> bytes:
+    """
+    NIfTI-1 single file header (and empty extension flag) for a volume of the given array shape (k, j, i) and type.
+    """
+    datatype, bitpix = NIFTI_DATATYPES[np.dtype(dtype).newbyteorder('=')]
+    m = np.asarray(ijk_to_ras, dtype=np.float64)
+    spacing = np.linalg.norm(m[:3, :3], axis=0)
+    b, c, d, qfac = quaternion_from_rotation(m[:3, :3] / spacing)
+    dim = [3, shape[2], shape[1], shape[0], 1, 1, 1, 1]
+    pixdim = [qfac, spacing[0], spacing[1], spacing[2], 0., 0., 0., 0.]
+    header = struct.pack(NIFTI_HEADER_FORMAT, 348, b'', b'', 0, 0, b'r', 0, *dim, 0., 0., 0., 0, datatype, bitpix,
+                         0, *pixdim, float(NIFTI_VOX_OFFSET), 1., 0., 0, b'\x00', 10, 0., 0., 0., 0., 0, 0, b'', b'',
+                         1, 1, b, c, d, m[0, 3], m[1, 3], m[2, 3], *m[0, :4], *m[1, :4], *m[2, :4], b'', b'n+1\x00')
+    return header + b'\x00' * (NIFTI_VOX_OFFSET - len(header))
+
+
+def write_nifti(array, ijk_to_ras, filename: str, transfer_format: str = 'nii.gz', compression_level: int = 6,
+                threads: int = None) -> None:
+    """
+    Writes a volume buffer as NIfTI-1, without copying the voxels.
+
+    Parameters
+    ----------
+    array: numpy.ndarray
+        Voxels in (k, j, i) order, e.g. the view returned by slicer.util.arrayFromVolume (see is_supported).
+    ijk_to_ras: array-like
+        4x4 IJK-to-RAS matrix of the volume.
+    filename: str
+        Destination file, with the extension matching the transfer format.
+    transfer_format: str
+        One of volume_codecs.TRANSFER_FORMATS.
+    compression_level: int
+        Gzip compression level for the compressed formats.
+    threads: int
+        Number of compression threads for the multithreaded format, the user setting if None.
+    """
+    if not is_supported(array):
+        raise ValueError('Unsupported volume buffer for a direct NIfTI export: {} {}.'.format(array.dtype,
+                                                                                             array.shape))
+    voxels = memoryview(array).cast('B')
+    blocks = [create_nifti_header(array.shape, array.dtype, ijk_to_ras)] + \
+        [voxels[i:i + BLOCK_SIZE] for i in range(0, len(voxels), BLOCK_SIZE)]
+    with open(filename, 'wb') as outfile:
+        if transfer_format == 'nii' or not filename.endswith('.gz'):
+            for block in blocks:
+                outfile.write(block)
+        elif transfer_format == 'nii.gz-mt':
+            write_gzip_members(blocks, outfile, compression_level, threads)
+        else:
+            write_gzip_stream(blocks, outfile, compression_level)
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import traceback
+
+
+def scan_output_files(output_path: str) -> dict:
+    """
+    Lists the files generated by the backend, in a single pass over the output folder.
+
+    Return
+    ------
+    dict
+        Location of each file relative to its timestamp folder (e.g., T0), indexed by timestamp folder. The
+        timestamp folders without any file yet are listed too.
+    """
+    created_files = dict()
+    for root, dirs, files in os.walk(output_path):
+        relative = os.path.relpath(root, output_path)
+        if relative == '.':
+            for d in dirs:
+                created_files[d] = []
+            continue
+        timestamp = relative.split(os.sep)[0]
+        prefix = os.path.relpath(root, os.path.join(output_path, timestamp))
+        created_files.setdefault(timestamp, []).extend([f if prefix == '.' else os.path.join(prefix, f)
+                                                        for f in files])
+    return created_files
+
+
+def file_signature(filename: str) -> tuple:
+    """
+    Size and modification time of a file, a change of either meaning the file was (re)written.
+    """
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class OutputWatcher:
+    """
+    Watches the output folder of a running backend, and hands over each expected output file as soon as it is
+    complete, for the results to be displayed before the whole processing is over (e.g., the tumor mask of a RADS
+    pipeline, long before the atlas overlaps are computed). The backend writes its outputs in place, a file is hence
+    considered complete once its size and modification time stayed unchanged over `stable_polls` consecutive polls.
+    A file failing to be decoded (e.g., still being written after a pause) is retried at the next polls.
+    """
+    def __init__(self, output_path: str, locate_callback, ready_callback, polling_period: float = 1.,
+                 stable_polls: int = 2):
+        """
+        Parameters
+        ----------
+        output_path: str
+            Output folder of the run workspace.
+        locate_callback: callable
+            Called with the scanned files (see scan_output_files), returning the filename of each expected output
+            found, indexed by output item.
+        ready_callback: callable
+            Called with an output item and its complete filename, from the watcher thread, returning the decoded
+            result. Raising makes the file be retried later.
+        polling_period: float
+            Delay in seconds between two scans of the output folder.
+        stable_polls: int
+            Number of consecutive scans a file must stay unchanged over to be considered complete.
+        """
+        self.output_path = output_path
+        self.locate_callback = locate_callback
+        self.ready_callback = ready_callback
+        self.polling_period = polling_period
+        self.stable_polls = stable_polls
+        self.imported = dict()
+        self.__candidates = dict()
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+    def start(self) -> None:
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> dict:
+        """
+        Stops the watcher, waiting for the output being decoded (if any).
+
+        Return
+        ------
+        dict
+            Filename, signature and decoded result of each output handed over, indexed by output item.
+        """
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        with self.__lock:
+            return dict(self.imported)
+
+    def __run(self) -> None:
+        while not self.__stop_event.wait(self.polling_period):
+            try:
+                self.poll()
+            except Exception:
+                logging.debug(traceback.format_exc())
+
+    def poll(self) -> None:
+        """
+        Scans the output folder once, handing over the expected outputs which became complete.
+        """
+        if not os.path.isdir(self.output_path):
+            return
+        for item, filename in self.locate_callback(scan_output_files(self.output_path)).items():
+            try:
+                signature = file_signature(filename)
+            except OSError:
+                continue
+            with self.__lock:
+                if item in self.imported and self.imported[item]['signature'] == signature:
+                    continue
+            previous, count = self.__candidates.get(item, (None, 0))
+            count = count + 1 if previous == signature else 1
+            self.__candidates[item] = (signature, count)
+            if signature[0] == 0 or count < self.stable_polls or self.__stop_event.is_set():
+                continue
+            try:
+                result = self.ready_callback(item, filename)
+            except Exception:
+                logging.debug("Output {} not readable yet.".format(item))
+                continue
+            with self.__lock:
+                self.imported[item] = {'filename': filename, 'signature': signature, 'result': result}
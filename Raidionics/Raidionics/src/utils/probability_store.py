@@ -0,0 +1,164 @@
+import logging
+import os
+import shutil
+import tempfile
+import traceback
+
+import numpy as np
+
+from src.utils.resources import SharedResources
+
+# Voxels processed at once when quantising or thresholding, to avoid any full size temporary.
+CHUNK_VOXELS = 4 * 1024 * 1024
+
+
+class ProbabilityStore:
+    """
+    Raw values of the volume outputs of the last run (e.g., the probability maps used by the interactive
+    thresholding), kept in files memory-mapped on demand instead of in memory. The probability maps (float values
+    within [0, 1]) are quantised to uint8 (steps of 1/255) or float16, the other volumes being kept with their type.
+    The files live in a session folder of the system temporary location (or SharedResources.probability_store_path),
+    and are deleted when the store is cleared, for a new run or when Slicer quits.
+    """
+    def __init__(self, store_path: str = None, dtype: str = None):
+        self.store_path = store_path
+        self.dtype = dtype
+        self.__folder = None
+        self.__entries = dict()
+        self.__count = 0
+
+    def __contains__(self, item) -> bool:
+        return item in self.__entries
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def keys(self) -> list:
+        return list(self.__entries.keys())
+
+    @property
+    def folder(self) -> str:
+        if self.__folder is None or not os.path.isdir(self.__folder):
+            base = self.store_path if self.store_path is not None else \
+                SharedResources.getInstance().probability_store_path
+            base = base if base else None
+            if base is not None:
+                os.makedirs(base, exist_ok=True)
+            self.__folder = tempfile.mkdtemp(prefix='raidionics-probabilities-', dir=base)
+        return self.__folder
+
+    def store(self, item: str, array) -> None:
+        """
+        Writes the raw values of an output into the store, by chunks and without copying the array beforehand.
+
+        Parameters
+        ----------
+        item: str
+            Output name, e.g. the class of the probability map.
+        array: numpy.ndarray
+            Raw values in (k, j, i) order, e.g. the view returned by SimpleITK.GetArrayViewFromImage.
+        """
+        self.remove(item)
+        step = max(1, CHUNK_VOXELS // max(1, int(np.prod(array.shape[1:]))))
+        chunks = [slice(s, s + step) for s in range(0, array.shape[0], step)]
+        quantisation = None
+        if array.dtype.kind == 'f' and array.size != 0:
+            low = min([array[c].min() for c in chunks])
+            high = max([array[c].max() for c in chunks])
+            if 0. <= low and high <= 1.:
+                quantisation = self.dtype if self.dtype is not None else \
+                    SharedResources.getInstance().probability_store_dtype
+        stored_dtype = np.dtype(quantisation) if quantisation is not None else array.dtype
+        filename = os.path.join(self.folder, '{}.npy'.format(self.__count))
+        self.__count += 1
+        data = np.lib.format.open_memmap(filename, mode='w+', dtype=stored_dtype, shape=array.shape)
+        for c in chunks:
+            if quantisation == 'uint8':
+                data[c] = np.rint(array[c] * 255.)
+            else:
+                data[c] = array[c]
+        data.flush()
+        del data
+        self.__entries[item] = {'filename': filename, 'quantisation': quantisation, 'shape': array.shape,
+                                'original_bytes': array.nbytes, 'stored_bytes': os.path.getsize(filename),
+                                'data': np.load(filename, mmap_mode='r')}
+
+    def get(self, item: str):
+        """
+        Return
+        ------
+        numpy.ndarray
+            Read-only memory-mapped stored values of the output, as quantised (see values for the decoded ones).
+        """
+        return self.__entries[item]['data']
+
+    def values(self, item: str):
+        """
+        Return
+        ------
+        numpy.ndarray
+            Decoded raw values of the output (probabilities as float32), in memory.
+        """
+        entry = self.__entries[item]
+        if entry['quantisation'] == 'uint8':
+            return entry['data'].astype(np.float32) / 255.
+        if entry['quantisation'] == 'float16':
+            return entry['data'].astype(np.float32)
+        return np.array(entry['data'])
+
+    def threshold(self, item: str, threshold: float, out):
+        """
+        Binarises the raw values of an output, by chunks, directly into the given array (e.g., the voxels of the
+        output node), with 1 where the value is greater than or equal to the threshold and 0 elsewhere.
+
+        Return
+        ------
+        numpy.ndarray
+            The given array.
+        """
+        entry = self.__entries[item]
+        data = entry['data']
+        if out.shape != data.shape:
+            raise ValueError('Stored values of {} and output array shapes differ: {} vs {}.'.format(
+                item, data.shape, out.shape))
+        if entry['quantisation'] == 'uint8':
+            threshold = np.ceil(threshold * 255. - 1e-6)
+        elif entry['quantisation'] == 'float16':
+            threshold = np.float16(threshold)
+        step = max(1, CHUNK_VOXELS // max(1, int(np.prod(data.shape[1:]))))
+        for s in range(0, data.shape[0], step):
+            out[s:s + step] = data[s:s + step] >= threshold
+        return out
+
+    def remove(self, item: str) -> None:
+        entry = self.__entries.pop(item, None)
+        if entry is None:
+            return
+        del entry['data']
+        try:
+            os.remove(entry['filename'])
+        except OSError:
+            # Still mapped elsewhere (Windows), deleted with the folder.
+            logging.debug(traceback.format_exc())
+
+    def clear(self) -> None:
+        """
+        Empties the store, deleting its files.
+        """
+        for item in self.keys():
+            self.remove(item)
+        if self.__folder is not None:
+            shutil.rmtree(self.__folder, ignore_errors=True)
+            self.__folder = None
+
+    def statistics(self) -> dict:
+        """
+        Return
+        ------
+        dict
+            Number of outputs stored, their size in memory as decoded (i.e., what keeping them in memory would cost),
+            and their size on disk.
+        """
+        return {'items': len(self.__entries),
+                'original_bytes': sum([e['original_bytes'] for e in self.__entries.values()]),
+                'stored_bytes': sum([e['stored_bytes'] for e in self.__entries.values()])}
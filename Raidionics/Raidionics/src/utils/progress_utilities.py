@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+
+from src.utils.resources import SharedResources
+
+
+class ProgressEvent:
+    """
+    Typed progress event, decoded from one line printed by the backend.
+    The kind is either 'stage_begin', 'stage_end', or 'log' for any other line.
+    """
+    def __init__(self, kind: str, line: str, stage: str = None, step: int = None, total_steps: int = None):
+        self.kind = kind
+        self.line = line
+        self.stage = stage
+        self.step = step
+        self.total_steps = total_steps
+        self.timestamp = time.time()
+        self.stage_duration = None
+        self.percentage = None
+        self.eta = None
+
+    @property
+    def status(self) -> str:
+        if self.kind == 'stage_begin':
+            return 'Begin'
+        elif self.kind == 'stage_end':
+            return 'End'
+        return None
+
+
+_step_pattern = re.compile(r'\((\d+)\s*/\s*(\d+)\)')
+
+
+def parse_backend_log_line(line: str) -> ProgressEvent:
+    """
+    Decodes the stage markers printed by the backend, in either of the two following formats:
+        * segmentation: 'LOG: <task> - <stage> - Begin (<step>/<total_steps>)'
+        * reporting: 'SLICERLOG: <stage> - Begin'
+
+    Return
+    ------
+    ProgressEvent
+        Decoded event, of kind 'log' if the line does not contain a stage marker.
+    """
+    try:
+        if 'SLICERLOG' in line:
+            content = line.split('SLICERLOG')[1].lstrip(':').split('-')
+            stage = content[0].strip()
+            status = content[1].strip().split('(')[0].strip()
+        elif 'LOG:' in line:
+            content = line.split('LOG:')[1].split('-')
+            stage = content[1].strip()
+            status = content[-1].strip().split('(')[0].strip()
+        else:
+            return ProgressEvent(kind='log', line=line)
+    except IndexError:
+        return ProgressEvent(kind='log', line=line)
+
+    if status not in ['Begin', 'End']:
+        return ProgressEvent(kind='log', line=line)
+    step = None
+    total_steps = None
+    match = _step_pattern.search(line)
+    if match is not None:
+        step = int(match.group(1))
+        total_steps = int(match.group(2))
+    return ProgressEvent(kind='stage_begin' if status == 'Begin' else 'stage_end', line=line, stage=stage, step=step,
+                         total_steps=total_steps)
+
+
+class StageTimingHistory:
+    """
+    Singleton class storing, for each model or RADS pipeline, the duration of each processing stage over the last
+    runs. The history is persisted on disk to estimate the progress and the remaining time of the next runs.
+    """
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if StageTimingHistory.__instance == None:
+            StageTimingHistory()
+        return StageTimingHistory.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if StageTimingHistory.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            StageTimingHistory.__instance = self
+            self.__init_base_variables()
+
+    def __init_base_variables(self):
+        self.history_filename = os.path.join(SharedResources.getInstance().Raidionics_dir, 'stage_timings.json')
+        self.max_runs = 10
+        self.__lock = threading.Lock()
+        self.__history = {}
+        try:
+            if os.path.exists(self.history_filename):
+                with open(self.history_filename, 'r') as infile:
+                    self.__history = json.load(infile)
+        except Exception:
+            logging.warning("Stage timings history could not be loaded, starting from scratch.")
+            logging.warning(traceback.format_exc())
+
+    def expected_stages(self, model_name: str) -> list:
+        """
+        Return
+        ------
+        list
+            Ordered list of (stage name, mean duration in seconds) observed for the model, empty if never run.
+        """
+        with self.__lock:
+            runs = self.__history.get(model_name, [])
+            if len(runs) == 0:
+                return []
+            # The most recent run gives the stages order, the duration is averaged over all recorded runs.
+            stages = []
+            for stage, _ in runs[-1]:
+                durations = [d for run in runs for s, d in run if s == stage]
+                stages.append((stage, sum(durations) / len(durations)))
+            return stages
+
+    def expected_duration(self, model_name: str) -> float:
+        """
+        Return
+        ------
+        float
+            Expected total processing time for the model in seconds, or None if the model has never been run.
+        """
+        stages = self.expected_stages(model_name)
+        if len(stages) == 0:
+            return None
+        return sum([d for _, d in stages])
+
+    def record(self, model_name: str, stage_durations: list) -> None:
+        """
+        Stores the (stage name, duration in seconds) list of one successful run, and persists the history.
+        """
+        if model_name is None or len(stage_durations) == 0:
+            return
+        with self.__lock:
+            runs = self.__history.setdefault(model_name, [])
+            runs.append([[s, d] for s, d in stage_durations])
+            self.__history[model_name] = runs[-self.max_runs:]
+            try:
+                with open(self.history_filename + '.tmp', 'w') as outfile:
+                    json.dump(self.__history, outfile, indent=4)
+                os.replace(self.history_filename + '.tmp', self.history_filename)
+            except Exception:
+                logging.warning("Stage timings history could not be saved.")
+                logging.warning(traceback.format_exc())
+
+
+class ProgressTracker:
+    """
+    Turns the backend log lines of one run into a typed progress stream, with a percentage and an estimated remaining
+    time (ETA) computed from the stage durations recorded during the previous runs of the same model.
+    Without history, the percentage relies on the step counter printed by the backend, if any, and no ETA is given.
+    The history is kept separately for each performance profile, the stage durations being only comparable within one.
+    """
+    def __init__(self, model_name: str, profile: str = None):
+        self.model_name = model_name
+        self.profile = profile
+        self.start_time = time.time()
+        self.expected_stages = StageTimingHistory.getInstance().expected_stages(self.history_key)
+        self.stage_durations = []
+        self.open_stages = {}
+        self.last_step = None
+
+    @property
+    def history_key(self) -> str:
+        if self.model_name is None or self.profile is None:
+            return self.model_name
+        return '{} [{}]'.format(self.model_name, self.profile)
+
+    def feed(self, line: str) -> ProgressEvent:
+        """
+        Decodes one backend log line, and updates the run progress accordingly.
+        """
+        event = parse_backend_log_line(line)
+        # Stages can be nested (e.g., a segmentation step inside a RADS pipeline), hence tracked by name.
+        if event.kind == 'stage_begin':
+            self.open_stages[event.stage] = event.timestamp
+        elif event.kind == 'stage_end':
+            event.stage_duration = event.timestamp - self.open_stages.pop(event.stage, event.timestamp)
+            self.stage_durations.append((event.stage, event.stage_duration))
+        if event.step is not None and event.total_steps is not None:
+            self.last_step = (event.step - (1 if event.kind == 'stage_begin' else 0), event.total_steps)
+        event.percentage, event.eta = self.estimate(event.timestamp)
+        return event
+
+    def estimate(self, now: float = None):
+        """
+        Return
+        ------
+        (float, float)
+            Percentage of the run already processed (between 0 and 100, or None if unknown), and the estimated
+            remaining time in seconds (or None if unknown).
+        """
+        now = time.time() if now is None else now
+        if len(self.expected_stages) != 0:
+            total = sum([d for _, d in self.expected_stages])
+            expected = dict(self.expected_stages)
+            # Stages unknown from the history (e.g., new optional step) do not count towards the estimate.
+            done = sum([expected.get(s, 0.) for s, _ in self.stage_durations])
+            for stage, start in self.open_stages.items():
+                done += min(now - start, expected.get(stage, 0.))
+            done = min(done, total)
+            if total > 0:
+                return 100. * done / total, total - done
+        if self.last_step is not None and self.last_step[1] > 0:
+            return 100. * self.last_step[0] / self.last_step[1], None
+        return None, None
+
+    def finish(self, success: bool) -> None:
+        """
+        Records the stage durations of the run in the history, only for successful runs.
+        """
+        if success:
+            StageTimingHistory.getInstance().record(self.history_key, self.stage_durations)
+            logging.info("Run completed for {} in {:.1f} seconds.".format(self.history_key,
+                                                                         time.time() - self.start_time))
+
+
+def update_progressbar(progressbar, event: ProgressEvent) -> None:
+    """
+    Displays the run percentage and the estimated remaining time of the event inside a QProgressBar.
+    The bar is left untouched when the progress cannot be estimated yet.
+    """
+    if event.percentage is None:
+        return
+    progressbar.setValue(int(round(event.percentage)))
+    if event.eta is not None:
+        minutes, seconds = divmod(int(round(event.eta)), 60)
+        progressbar.setFormat('%p% - about {}m{:02d}s left'.format(minutes, seconds))
+    else:
+        progressbar.setFormat('%p%')
@@ -0,0 +1,199 @@
+"""
+Long-lived job loop executed inside the raidionics-rads Docker image.
+
+The script is copied by the plugin into the mounted resources folder, and used as the container entrypoint. It keeps
+the Python interpreter, the backend libraries and the already loaded inference sessions alive between jobs. Jobs are
+exchanged through plain files inside the jobs folder:
+    * <job_id>.json: submitted by the plugin (atomic rename), containing the rads_config.ini filename to process.
+    * <job_id>.log: backend log lines for the job, consumed by the plugin while the job is running.
+    * <job_id>.status: final state of the job (atomic rename), written once the processing is over.
+    * <job_id>.abandoned: written by the plugin for a job aborted while running, whose files are then discarded.
+A heartbeat file is refreshed every few seconds so that the plugin can detect a dead worker. The worker exits once
+left without job for --idle-timeout seconds.
+
+With --config, a single configuration file is processed and the backend log is written to the standard output. This is
+also the entrypoint of the native execution mode, run by the interpreter of a local environment where raidionics_rads
+is installed (see backend_execution.run_backend_native).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+HEARTBEAT_FILENAME = 'worker.alive'
+HEARTBEAT_PERIOD = 2.
+POLLING_PERIOD = 0.2
+# Inference sessions kept loaded (least recently used dropped first), and the session options telling them apart.
+MAX_CACHED_SESSIONS = 2
+SESSION_OPTIONS_KEYS = ['graph_optimization_level', 'execution_mode', 'intra_op_num_threads', 'inter_op_num_threads',
+                        'enable_cpu_mem_arena', 'enable_mem_pattern', 'enable_mem_reuse', 'use_deterministic_compute']
+
+
+def cache_inference_sessions(max_sessions: int = MAX_CACHED_SESSIONS) -> None:
+    """
+    Keeps the last ONNX inference sessions created by the backend in memory, so that a model used by consecutive runs
+    is loaded only once. A session is reused as long as the model file on disk is unchanged and it is requested with
+    the same providers and session options. The InferenceSession class is replaced by a subclass, the sessions hence
+    remaining instances of the original class.
+    """
+    try:
+        import onnxruntime
+    except ImportError:
+        return
+
+    if getattr(onnxruntime.InferenceSession, 'raidionics_cached', False):
+        # Already patched, e.g. by a previous in-process run.
+        return
+    sessions = OrderedDict()
+    lock = threading.Lock()
+
+    def session_key(path_or_bytes, sess_options=None, providers=None, provider_options=None, **kwargs):
+        if not isinstance(path_or_bytes, str) or not os.path.exists(path_or_bytes):
+            return None
+        options = None
+        if sess_options is not None:
+            options = [(name, str(getattr(sess_options, name, None))) for name in SESSION_OPTIONS_KEYS]
+        return repr([os.path.realpath(path_or_bytes), os.path.getmtime(path_or_bytes), options, providers,
+                     provider_options, sorted(kwargs.items(), key=lambda x: x[0])])
+
+    class CachedInferenceSession(onnxruntime.InferenceSession):
+        raidionics_cached = True
+
+        def __new__(cls, *args, **kwargs):
+            key = session_key(*args, **kwargs)
+            with lock:
+                if key is not None and key in sessions:
+                    sessions.move_to_end(key)
+                    logging.debug("Reusing the inference session already loaded for {}.".format(args[0]))
+                    return sessions[key]
+            return super(CachedInferenceSession, cls).__new__(cls)
+
+        def __init__(self, *args, **kwargs):
+            if getattr(self, '_raidionics_key', None) is not None:
+                # Cached session returned by __new__, already initialised.
+                return
+            super(CachedInferenceSession, self).__init__(*args, **kwargs)
+            self._raidionics_key = session_key(*args, **kwargs)
+            if self._raidionics_key is None:
+                return
+            with lock:
+                sessions[self._raidionics_key] = self
+                while len(sessions) > max_sessions:
+                    sessions.popitem(last=False)
+
+    onnxruntime.InferenceSession = CachedInferenceSession
+
+
+def load_backend():
+    try:
+        from raidionics_rads.compute import run_rads
+    except ImportError:
+        from raidionics_rads import run_rads
+    return run_rads
+
+
+def heartbeat(jobs_folder: str, stop_event: threading.Event) -> None:
+    heartbeat_filename = os.path.join(jobs_folder, HEARTBEAT_FILENAME)
+    while not stop_event.is_set():
+        with open(heartbeat_filename, 'w') as outfile:
+            outfile.write(str(time.time()))
+        stop_event.wait(HEARTBEAT_PERIOD)
+
+
+def write_status(jobs_folder: str, job_id: str, status: dict) -> None:
+    status_filename = os.path.join(jobs_folder, job_id + '.status')
+    with open(status_filename + '.tmp', 'w') as outfile:
+        json.dump(status, outfile)
+    os.replace(status_filename + '.tmp', status_filename)
+
+
+def process_job(jobs_folder: str, job_id: str, run_rads) -> None:
+    running_filename = os.path.join(jobs_folder, job_id + '.running')
+    os.replace(os.path.join(jobs_folder, job_id + '.json'), running_filename)
+    with open(running_filename, 'r') as infile:
+        job = json.load(infile)
+
+    handler = logging.FileHandler(os.path.join(jobs_folder, job_id + '.log'), mode='w')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.DEBUG if job.get('verbose', 'debug') == 'debug' else logging.INFO)
+    start = time.time()
+    status = {'success': True, 'elapsed': 0., 'error': ''}
+    try:
+        run_rads(config_filename=job['config'])
+    except Exception:
+        status['success'] = False
+        status['error'] = traceback.format_exc()
+        logging.error(status['error'])
+    finally:
+        handler.flush()
+        root_logger.removeHandler(handler)
+        handler.close()
+        os.remove(running_filename)
+    status['elapsed'] = time.time() - start
+    abandoned_filename = os.path.join(jobs_folder, job_id + '.abandoned')
+    if os.path.exists(abandoned_filename):
+        # Nobody is waiting for the job anymore.
+        os.remove(os.path.join(jobs_folder, job_id + '.log'))
+        os.remove(abandoned_filename)
+        return
+    write_status(jobs_folder, job_id, status)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', help='Folder where jobs are submitted by the plugin.')
+    parser.add_argument('--config', help='Process a single configuration file, then exit.')
+    parser.add_argument('--idle-timeout', type=float, default=0., help='Exit after this many seconds without any '
+                                                                       'job (0: never).')
+    args = parser.parse_args(argv)
+    if args.jobs is None and args.config is None:
+        parser.error('either --jobs or --config is required.')
+
+    if args.config is not None:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.DEBUG)
+        run_rads = load_backend()
+        try:
+            run_rads(config_filename=args.config)
+        except Exception:
+            logging.error(traceback.format_exc())
+            return 1
+        return 0
+
+    cache_inference_sessions()
+    run_rads = load_backend()
+
+    os.makedirs(args.jobs, exist_ok=True)
+    stop_event = threading.Event()
+    heartbeat_thread = threading.Thread(target=heartbeat, args=(args.jobs, stop_event), daemon=True)
+    heartbeat_thread.start()
+    last_job = time.time()
+    try:
+        while True:
+            pending = sorted([f for f in os.listdir(args.jobs) if f.endswith('.json')],
+                             key=lambda x: os.path.getmtime(os.path.join(args.jobs, x)))
+            if len(pending) == 0:
+                if 0 < args.idle_timeout < time.time() - last_job:
+                    break
+                time.sleep(POLLING_PERIOD)
+                continue
+            process_job(args.jobs, pending[0][:-len('.json')], run_rads)
+            last_job = time.time()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -30,7 +30,14 @@ class SharedResources:
         else:
             SharedResources.__instance = self
 
-    def set_environment(self):
+    def set_environment(self, headless: bool = False):
+        """
+        Parameters
+        ----------
+        headless: bool
+            For the command line tools (e.g., batch_runner) possibly running next to a Slicer session sharing the same
+            folders: the cloud lists and runtime data are then left untouched, instead of being reset.
+        """
         self.home_path = expanduser("~")
         current_folder = os.path.dirname(os.path.realpath(__file__))
         self.icon_dir = os.path.join(current_folder, '../../', '/Resources/Icons/')
@@ -40,9 +47,9 @@ class SharedResources:
             os.mkdir(self.Raidionics_dir)
 
         self.json_cloud_dir = os.path.join(self.Raidionics_dir, 'json', 'cloud')
-        if os.path.isdir(self.json_cloud_dir):
+        if os.path.isdir(self.json_cloud_dir) and not headless:
             shutil.rmtree(self.json_cloud_dir)
-        os.makedirs(self.json_cloud_dir)
+        os.makedirs(self.json_cloud_dir, exist_ok=True)
         self.json_cloud_info_file = "https://drive.google.com/uc?id=13-Mx1Os9eXB_bJBcJt_o9MXQrRI1xONi"
 
         self.json_local_dir = os.path.join(self.Raidionics_dir, 'json', 'local')
@@ -60,19 +67,76 @@ class SharedResources:
             os.makedirs(self.diagnosis_path)
 
         self.data_path = os.path.join(self.resources_path, 'data')
-        if os.path.isdir(self.data_path):
+        if os.path.isdir(self.data_path) and not headless:
             shutil.rmtree(self.data_path)
-        os.makedirs(self.data_path)
+        os.makedirs(self.data_path, exist_ok=True)
 
         self.user_config_filename = os.path.join(self.data_path, 'runtime_config.ini')
         self.diagnosis_config_filename = os.path.join(self.data_path, 'diagnosis_config.ini')
 
-        self.output_path = os.path.join(self.resources_path, 'output')
-        if os.path.isdir(self.output_path):
-            shutil.rmtree(self.output_path)
-        os.makedirs(self.output_path)
-
+        # Each run gets its own workspace folder, old ones are garbage-collected in the background.
+        self.runs_path = os.path.join(self.resources_path, 'runs')
+        if not os.path.isdir(self.runs_path):
+            os.makedirs(self.runs_path)
+        self.workspace_retention = 3
+        # Workspaces kept in the memory-backed location, where they take up memory until collected.
+        self.memory_workspace_retention = 1
+        # Location of the run workspaces, among default (runs_path), memory (/dev/shm) and custom (scratch_path, e.g. a
+        # local disk), the default one being used when less than scratch_reserve_mb would remain once staged.
+        self.scratch_location = 'default'
+        self.scratch_path = ''
+        self.scratch_reserve_mb = 1024
+        # Number of jobs from the persistent queue processed simultaneously.
+        self.max_concurrent_jobs = 1
+        # Backend container resources (0 for no limit), split between the jobs running in parallel.
+        self.container_cpus = 0.
+        self.container_memory_mb = 0
+        self.container_shm_size_mb = 0
+        self.container_reserved_cores = 1
+        # Backend inference options preset, among fast, balanced and accurate (see backend_utilities).
+        self.performance_profile = 'balanced'
+        # Intermediate files of the backend (e.g., resampled inputs) kept in the run workspace, for debugging purposes.
+        self.keep_intermediate_files = False
+        # Outputs of previous runs, reused when running again the same model on the same inputs.
+        self.use_result_cache = True
+        self.result_cache_max_size_mb = 2048
+        # Segmentation masks from the previous runs younger than this are reused by the RADS pipelines.
+        self.use_segmentation_reuse = True
+        self.artifact_max_age_hours = 72
+
+        # Encoding of the volumes exchanged with the backend, among nii, nii.gz and nii.gz-mt (see volume_codecs).
+        self.transfer_format = 'nii.gz'
+        self.transfer_compression_level = 6
+        self.transfer_compression_threads = 0
+        # Number of input volumes exported simultaneously before a run (0: as many as cores).
+        self.staging_threads = 0
+        # Input volumes written straight from the node voxel buffers, without intermediate ITK image (nifti_writer).
+        self.use_direct_staging = True
+        # Volumes with integral values staged (and label map results kept) with the narrowest lossless integer type.
+        self.use_dtype_narrowing = True
+        # Results decoded and displayed as soon as the backend wrote them, while the processing goes on.
+        self.use_output_streaming = True
+        # Raw results (e.g., the probability maps for the interactive thresholding) kept memory-mapped from files in
+        # probability_store_path (empty: system temporary folder), the probabilities quantised to uint8 or float16.
+        self.probability_store_dtype = 'uint8'
+        self.probability_store_path = ''
+        # Input volumes staged by the previous runs of the session, reused while the volume nodes are unchanged.
+        self.use_staging_cache = True
+        self.staging_cache_max_size_mb = 2048
+        # Segmentation inputs staged cropped to the region of interest (ROI node roi_crop_node_id, else the brain/lungs
+        # mask linked by the user) plus a margin, the results being pasted back at the full input size.
+        self.use_roi_crop = False
+        self.roi_crop_margin_mm = 10.
+        self.roi_crop_node_id = ''
         self.docker_path = None
+        # The backend either runs in its Docker image (docker), natively from a local Python environment where
+        # raidionics_rads is installed (native, native_backend_python being the interpreter of that environment), or
+        # inside the Slicer Python interpreter itself (in_process).
+        self.backend_execution_mode = 'docker'
+        self.native_backend_python = ''
+        self.use_warm_backend = False
+        self.use_docker_engine_api = False
+        self.docker_socket_path = '/var/run/docker.sock'
         self.__set_runtime_parameters()
         self.global_active_model_update = False
 
@@ -101,3 +165,6 @@ class SharedResources:
         self.user_diagnosis_configuration['Neuro'] = {}
         self.user_diagnosis_configuration['Neuro']['tumor_segmentation_filename'] = ''
         self.user_diagnosis_configuration['Neuro']['brain_segmentation_filename'] = ''
+        # Atlases used for the cortical/subcortical structures features of the neuro report (comma-separated).
+        self.user_diagnosis_configuration['Neuro']['cortical_features'] = 'MNI, Schaefer7, Schaefer17, Harvard-Oxford'
+        self.user_diagnosis_configuration['Neuro']['subcortical_features'] = 'BCB'
@@ -0,0 +1,325 @@
+import configparser
+import csv
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import traceback
+
+from src.utils.resources import SharedResources
+
+
+def image_fingerprint(image) -> str:
+    """
+    Content fingerprint of a SimpleITK image, covering the voxel values, the pixel type and the geometry (size,
+    spacing, origin and direction), but not the file encoding.
+    """
+    import SimpleITK as sitk
+    return array_fingerprint(sitk.GetArrayViewFromImage(image), image.GetPixelIDValue(),
+                             image.GetNumberOfComponentsPerPixel(), image.GetSpacing(), image.GetOrigin(),
+                             image.GetDirection())
+
+
+def array_fingerprint(array, pixel_id: int, components: int, spacing: tuple, origin: tuple, direction: tuple) -> str:
+    """
+    Content fingerprint of a voxel buffer and its geometry (ITK conventions), equal to the image_fingerprint of the
+    corresponding SimpleITK image. The buffer is hashed in place.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    size = list(reversed(array.shape[:3]))
+    h.update(json.dumps([pixel_id, components, size, [round(x, 6) for x in spacing], [round(x, 6) for x in origin],
+                         [round(x, 6) for x in direction]]).encode('utf-8'))
+    h.update(memoryview(array).cast('B'))
+    return h.hexdigest()
+
+
+def file_fingerprint(filename: str) -> str:
+    """
+    Content fingerprint of a file, read by chunks.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(8 * 1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def folder_fingerprints(data_path: str) -> dict:
+    """
+    Content fingerprint of each staged input file of a run data folder, indexed by its relative location. The backend
+    configuration file is left out, as it contains run-specific locations.
+    """
+    fingerprints = dict()
+    for root, _, files in os.walk(data_path):
+        for f in files:
+            if f.endswith('.ini'):
+                continue
+            fingerprints[os.path.relpath(os.path.join(root, f), data_path).replace(os.sep, '/')] = \
+                file_fingerprint(os.path.join(root, f))
+    return fingerprints
+
+
+def get_local_model_fingerprint(model_name: str, logic_task: str = 'segmentation', iodict: dict = None) -> str:
+    """
+    Fingerprint of the local model files used by a run, covering the content of its pipeline (the RADS pipeline for
+    the reporting task) and the name, size and modification time of each file of the model folders it refers to. A
+    model updated on disk hence changes the fingerprint, even when the cloud lists are not available.
+    """
+    resources = SharedResources.getInstance()
+    pipeline_filename = os.path.join(resources.model_path, model_name, 'pipeline.json')
+    if logic_task == 'reporting' and iodict is not None and 'UserConfiguration' in iodict:
+        pipeline_filename = os.path.join(resources.diagnosis_path, iodict['UserConfiguration']['default'])
+    h = hashlib.blake2b(digest_size=20)
+    models = {model_name}
+    if os.path.exists(pipeline_filename):
+        with open(pipeline_filename, 'rb') as infile:
+            content = infile.read()
+        h.update(content)
+        try:
+            steps = json.loads(content.decode('utf-8')).values()
+            models.update([x['model'] for x in steps if isinstance(x, dict) and x.get('model')])
+        except Exception:
+            logging.warning("Pipeline {} could not be parsed.".format(pipeline_filename))
+    for model in sorted(models):
+        model_folder = os.path.join(resources.model_path, model)
+        for root, dirs, files in os.walk(model_folder):
+            dirs.sort()
+            for f in sorted(files):
+                stat = os.stat(os.path.join(root, f))
+                relative = os.path.relpath(os.path.join(root, f), resources.model_path).replace(os.sep, '/')
+                h.update(json.dumps([relative, stat.st_size, stat.st_mtime_ns]).encode('utf-8'))
+    return h.hexdigest()
+
+
+def get_cloud_checksum(cloud_name: str) -> str:
+    """
+    Checksum of the model (or RADS pipeline) archive, as listed in the last downloaded cloud models/pipelines lists.
+
+    Return
+    ------
+    str
+        The checksum, or an empty string if the model is not listed (e.g., the lists could not be downloaded).
+    """
+    for list_name in ['cloud_models_list.csv', 'cloud_diagnoses_list.csv']:
+        list_filename = os.path.join(SharedResources.getInstance().json_cloud_dir, list_name)
+        if cloud_name is None or not os.path.exists(list_filename):
+            continue
+        try:
+            with open(list_filename) as csv_file:
+                for row in list(csv.reader(csv_file, delimiter=','))[1:]:
+                    if len(row) > 3 and row[0] == cloud_name:
+                        return row[3]
+        except Exception:
+            logging.warning("Cloud list {} could not be parsed.".format(list_filename))
+    return ''
+
+
+class ResultCache:
+    """
+    Singleton class caching the outputs of the backend runs on disk, addressed by the content of the run inputs: the
+    input voxels and geometry, the model name and local files, the Docker image, and the runtime options of the backend
+    configuration.
+    The cache size is bounded, the least recently used entries being evicted first.
+    """
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if ResultCache.__instance == None:
+            ResultCache()
+        return ResultCache.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if ResultCache.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            ResultCache.__instance = self
+            self.__init_base_variables()
+
+    def __init_base_variables(self):
+        self.cache_path = os.path.join(SharedResources.getInstance().Raidionics_dir, 'results_cache')
+        os.makedirs(self.cache_path, exist_ok=True)
+        self.index_filename = os.path.join(self.cache_path, 'index.json')
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__index = {}
+        try:
+            if os.path.exists(self.index_filename):
+                with open(self.index_filename, 'r') as infile:
+                    self.__index = json.load(infile)
+        except Exception:
+            logging.warning("Results cache index could not be loaded, starting from scratch.")
+            logging.warning(traceback.format_exc())
+        # Entries whose folder went missing are dropped.
+        self.__index = {k: v for k, v in self.__index.items() if os.path.isdir(os.path.join(self.cache_path, k))}
+
+    @staticmethod
+    def compute_key(input_fingerprints: dict, model_name: str, model_checksum: str, config_filename: str,
+                    container_path: str = None, model_fingerprint: str = '', docker_image_name: str = '') -> str:
+        """
+        Computes the cache key of a run.
+
+        Parameters
+        ----------
+        input_fingerprints: dict
+            Fingerprint of each staged input, indexed by its location relative to the run data folder.
+        model_name: str
+            Name of the model (or pipeline) run by the backend.
+        model_checksum: str
+            Checksum of the model archive, from the cloud models list (empty if not listed).
+        config_filename: str
+            Backend configuration file (rads_config.ini) of the run.
+        container_path: str
+            Run-specific location of the workspace inside the container, stripped from the configuration values.
+        model_fingerprint: str
+            Fingerprint of the local model files (see get_local_model_fingerprint).
+        docker_image_name: str
+            Backend Docker image, in the form <user>/<image_name>:<tag>.
+
+        Return
+        ------
+        str
+            Hexadecimal key.
+        """
+        config = configparser.ConfigParser()
+        config.read(config_filename)
+        options = []
+        for section in config.sections():
+            for option, value in config.items(section):
+                # The run-specific folders and the threads count (machine and concurrency dependent) do not impact
+                # the results.
+                if section == 'System' and option in ['input_folder', 'output_folder', 'threads']:
+                    continue
+                if container_path is not None:
+                    value = value.replace(container_path, '')
+                options.append([section, option, value])
+        description = {'inputs': sorted(input_fingerprints.items()), 'model': model_name, 'checksum': model_checksum,
+                       'model_files': model_fingerprint, 'image': docker_image_name, 'config': options}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @property
+    def max_size(self) -> int:
+        return int(SharedResources.getInstance().result_cache_max_size_mb * 1024 * 1024)
+
+    @property
+    def size(self) -> int:
+        with self.__lock:
+            return sum([e['size'] for e in self.__index.values()])
+
+    def restore(self, key: str, destination: str) -> bool:
+        """
+        Copies the cached outputs for the key into the destination folder (hard links when possible).
+
+        Return
+        ------
+        bool
+            True on a cache hit, False otherwise.
+        """
+        entry_path = os.path.join(self.cache_path, key)
+        with self.__lock:
+            hit = key in self.__index and os.path.isdir(entry_path)
+            if hit:
+                self.__index[key]['last_access'] = time.time()
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            return False
+        try:
+            shutil.copytree(entry_path, destination, copy_function=_link_or_copy, dirs_exist_ok=True)
+        except Exception:
+            logging.warning("Cached results {} could not be restored.".format(key))
+            logging.warning(traceback.format_exc())
+            self.invalidate(key)
+            return False
+        self.__save_index()
+        return True
+
+    def store(self, key: str, source: str, description: str = '') -> None:
+        """
+        Adds the outputs folder of a successful run to the cache, then evicts the least recently used entries above
+        the cache size limit.
+        """
+        entry_path = os.path.join(self.cache_path, key)
+        tmp_path = entry_path + '.tmp'
+        try:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
+            shutil.copytree(source, tmp_path, copy_function=_link_or_copy)
+            size = sum([os.path.getsize(os.path.join(r, f)) for r, _, files in os.walk(tmp_path) for f in files])
+            if size > self.max_size:
+                shutil.rmtree(tmp_path)
+                return
+            if os.path.exists(entry_path):
+                shutil.rmtree(entry_path)
+            os.replace(tmp_path, entry_path)
+            with self.__lock:
+                self.__index[key] = {'size': size, 'last_access': time.time(), 'description': description}
+            self.__evict()
+            self.__save_index()
+        except Exception:
+            logging.warning("Results could not be added to the cache.")
+            logging.warning(traceback.format_exc())
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def invalidate(self, key: str = None) -> None:
+        """
+        Removes one entry, or the whole cache content if no key is given.
+        """
+        with self.__lock:
+            keys = [key] if key is not None else list(self.__index.keys())
+            for k in keys:
+                self.__index.pop(k, None)
+                shutil.rmtree(os.path.join(self.cache_path, k), ignore_errors=True)
+        self.__save_index()
+
+    def statistics(self) -> dict:
+        """
+        Return
+        ------
+        dict
+            Number of entries, size in bytes, and hits/misses (and hit rate) over the session.
+        """
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.__index), 'size': sum([e['size'] for e in self.__index.values()]),
+                    'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups != 0 else 0.}
+
+    def __evict(self) -> None:
+        with self.__lock:
+            total = sum([e['size'] for e in self.__index.values()])
+            for k in sorted(self.__index.keys(), key=lambda x: self.__index[x]['last_access']):
+                if total <= self.max_size:
+                    break
+                total -= self.__index[k]['size']
+                self.__index.pop(k)
+                shutil.rmtree(os.path.join(self.cache_path, k), ignore_errors=True)
+                logging.debug("Results cache entry {} evicted.".format(k))
+
+    def __save_index(self) -> None:
+        with self.__lock:
+            try:
+                with open(self.index_filename + '.tmp', 'w') as outfile:
+                    json.dump(self.__index, outfile, indent=4)
+                os.replace(self.index_filename + '.tmp', self.index_filename)
+            except Exception:
+                logging.warning("Results cache index could not be saved.")
+                logging.warning(traceback.format_exc())
+
+
+def _link_or_copy(src: str, dst: str) -> str:
+    # The cached results are never modified in place, hard links avoid duplicating them when on the same device.
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
@@ -0,0 +1,114 @@
+"""
+Region of interest cropping of the volumes exchanged with the backend: the inputs are staged cropped to the bounding
+box of a region (e.g., the brain or the lungs) plus a margin, and the outputs computed on the crop are pasted back into
+volumes of the full input size.
+
+A crop is given in voxel indices of the volume, in ITK order: [i_start, j_start, k_start, i_end, j_end, k_end], the end
+indices being excluded.
+"""
+import numpy as np
+
+
+def mask_ras_bounds(array, ijk_to_ras):
+    """
+    Bounding box of the non-zero voxels of a mask, in RAS coordinates.
+
+    Parameters
+    ----------
+    array: numpy.ndarray
+        Mask voxels in (k, j, i) order, e.g. as returned by slicer.util.arrayFromVolume.
+    ijk_to_ras: array-like
+        4x4 IJK-to-RAS matrix of the mask.
+
+    Return
+    ------
+    list
+        Bounds [r_min, r_max, a_min, a_max, s_min, s_max] (voxel corners included), or None for an empty mask.
+    """
+    extents = []
+    # Projections along the two other axes, a single pass over the voxels each.
+    for axis in [2, 1, 0]:
+        other_axes = tuple([a for a in range(3) if a != axis])
+        indices = np.flatnonzero(np.any(array, axis=other_axes))
+        if len(indices) == 0:
+            return None
+        extents.append((indices[0] - 0.5, indices[-1] + 0.5))
+    corners = np.array([[i, j, k, 1.] for i in extents[0] for j in extents[1] for k in extents[2]])
+    ras = corners @ np.asarray(ijk_to_ras, dtype=np.float64).T
+    return [ras[:, 0].min(), ras[:, 0].max(), ras[:, 1].min(), ras[:, 1].max(), ras[:, 2].min(), ras[:, 2].max()]
+
+
+def compute_crop(ras_bounds, ras_to_ijk, dims, spacing, margin: float = 10., min_reduction: float = 0.05):
+    """
+    Voxel crop of a volume covering a RAS bounding box, enlarged by a margin.
+
+    Parameters
+    ----------
+    ras_bounds: list
+        Region bounds [r_min, r_max, a_min, a_max, s_min, s_max].
+    ras_to_ijk: array-like
+        4x4 RAS-to-IJK matrix of the volume.
+    dims: list
+        Volume dimensions (i, j, k).
+    spacing: list
+        Voxel spacing (mm) along i, j and k.
+    margin: float
+        Margin (mm) added around the region on each side.
+    min_reduction: float
+        Minimum fraction of voxels to be cropped out for the crop to be worth it.
+
+    Return
+    ------
+    list
+        Crop of the volume, or None if the region does not intersect the volume or if the crop would be too small a
+        reduction.
+    """
+    corners = np.array([[r, a, s, 1.] for r in ras_bounds[0:2] for a in ras_bounds[2:4] for s in ras_bounds[4:6]])
+    ijk = (corners @ np.asarray(ras_to_ijk, dtype=np.float64).T)[:, :3]
+    margin_voxels = margin / np.asarray(spacing, dtype=np.float64)
+    start = np.floor(ijk.min(axis=0) + 0.5 - margin_voxels).astype(int)
+    end = np.ceil(ijk.max(axis=0) + 0.5 + margin_voxels).astype(int)
+    start = np.clip(start, 0, np.asarray(dims))
+    end = np.clip(end, 0, np.asarray(dims))
+    if np.any(end <= start):
+        return None
+    if np.prod(end - start) > (1. - min_reduction) * np.prod(np.asarray(dims, dtype=np.float64)):
+        return None
+    return [int(x) for x in start] + [int(x) for x in end]
+
+
+def crop_size(crop) -> list:
+    return [crop[3] - crop[0], crop[4] - crop[1], crop[5] - crop[2]]
+
+
+def crop_array(array, ijk_to_ras, crop):
+    """
+    Crops a volume buffer, into a contiguous array (the only copy made) and its IJK-to-RAS matrix.
+    """
+    cropped = np.ascontiguousarray(array[crop[2]:crop[5], crop[1]:crop[4], crop[0]:crop[3]])
+    m = np.array(ijk_to_ras, dtype=np.float64)
+    m[:3, 3] = (m @ np.array([crop[0], crop[1], crop[2], 1.]))[:3]
+    return cropped, m
+
+
+def paste_crop(array, crop, dims, fill_value=0):
+    """
+    Pastes the voxels computed on a crop back into a volume of the full size.
+
+    Parameters
+    ----------
+    array: numpy.ndarray
+        Voxels of the cropped result in (k, j, i) order, possibly with a trailing components axis.
+    crop: list
+        Crop the result was computed on.
+    dims: list
+        Full volume dimensions (i, j, k).
+
+    Return
+    ------
+    numpy.ndarray
+        Full size voxels, of the same type as the result.
+    """
+    full = np.full((dims[2], dims[1], dims[0]) + array.shape[3:], fill_value, dtype=array.dtype)
+    full[crop[2]:crop[5], crop[1]:crop[4], crop[0]:crop[3]] = array
+    return full
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import traceback
+
+from src.utils.resources import SharedResources
+
+
+def sampled_fingerprint(array, ijk_to_ras, samples: int = 64, sample_size: int = 64 * 1024) -> str:
+    """
+    Fast fingerprint of a voxel buffer and its geometry, hashing only `samples` evenly spaced blocks of the buffer
+    (the whole of it when smaller). Meant to catch a content change which did not update the node modification time,
+    not to replace the full content fingerprint (see result_cache.array_fingerprint).
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps([str(array.dtype), list(array.shape),
+                         [round(float(x), 6) for x in list(ijk_to_ras.flatten())]]).encode('utf-8'))
+    voxels = memoryview(array).cast('B')
+    if len(voxels) <= samples * sample_size:
+        h.update(voxels)
+    else:
+        step = (len(voxels) - sample_size) // (samples - 1)
+        for i in range(samples):
+            h.update(voxels[i * step:i * step + sample_size])
+    return h.hexdigest()
+
+
+class StagingCache:
+    """
+    Singleton class keeping the input volumes staged by the previous runs of the session, so that running several
+    models or pipelines on the same loaded volumes does not export them again. An entry is addressed by the volume
+    node ID, its modification time (node and image data, bumped on any edit or resampling), a sampled fingerprint of
+    its voxels, the transfer format, and the region staged. The staged files are hard-linked into the new workspaces
+    when possible. The node IDs and modification times are only meaningful within one Slicer session, the cache is
+    hence not persistent and its folders are emptied on first use. The least recently used entries are evicted first.
+    """
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if StagingCache.__instance == None:
+            StagingCache()
+        return StagingCache.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if StagingCache.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            StagingCache.__instance = self
+            self.__init_base_variables()
+
+    def __init_base_variables(self):
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__index = {}
+        self.__cache_paths = set()
+
+    @staticmethod
+    def compute_key(node_id: str, mtime: int, fingerprint: str, transfer_format: str, compression_level: int,
+                    crop: list = None, narrowing: bool = False) -> str:
+        """
+        Computes the cache key of a staged volume.
+
+        Parameters
+        ----------
+        node_id: str
+            MRML ID of the volume node.
+        mtime: int
+            Modification time of the node and of its image data, whichever the latest.
+        fingerprint: str
+            Sampled fingerprint of the voxels and geometry (see sampled_fingerprint).
+        transfer_format: str
+            Encoding of the staged file (see volume_codecs), along with its compression level.
+        crop: list
+            Region of the volume staged (see roi_utilities), None for the whole volume.
+        narrowing: bool
+            Whether the volume was staged with a narrower type when lossless (see volume_codecs.narrow_array).
+
+        Return
+        ------
+        str
+            Hexadecimal key.
+        """
+        description = [node_id, int(mtime), fingerprint, transfer_format, int(compression_level), crop, narrowing]
+        return hashlib.sha256(json.dumps(description).encode('utf-8')).hexdigest()
+
+    @property
+    def max_size(self) -> int:
+        return int(SharedResources.getInstance().staging_cache_max_size_mb * 1024 * 1024)
+
+    def get_cache_path(self, runs_path: str) -> str:
+        """
+        Cache folder next to the given runs folder, for the staged files to be hard-linked (same filesystem).
+        """
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(runs_path)), 'staging_cache')
+        with self.__lock:
+            if cache_path not in self.__cache_paths:
+                # Leftovers of a previous session.
+                shutil.rmtree(cache_path, ignore_errors=True)
+                os.makedirs(cache_path, exist_ok=True)
+                self.__cache_paths.add(cache_path)
+        return cache_path
+
+    def restore(self, key: str, destination: str) -> tuple:
+        """
+        Links (or copies) the staged file for the key to the destination.
+
+        Return
+        ------
+        tuple
+            Content fingerprint of the staged volume and, if it was staged with a narrower type, its original and
+            staged types (original_type and type), on a cache hit. None otherwise.
+        """
+        with self.__lock:
+            entry = self.__index.get(key)
+            hit = entry is not None and os.path.exists(entry['filename'])
+            if hit:
+                entry['last_access'] = time.time()
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            return None
+        try:
+            _link_or_copy(entry['filename'], destination)
+        except Exception:
+            logging.warning("Staged volume {} could not be reused.".format(os.path.basename(destination)))
+            logging.debug(traceback.format_exc())
+            self.invalidate(key)
+            return None
+        return entry['fingerprint'], dict(entry.get('types', {}))
+
+    def store(self, key: str, source: str, fingerprint: str, node_id: str, runs_path: str, types: dict = None) -> None:
+        """
+        Adds a freshly staged file to the cache, replacing the previous entries of the same node, then evicts the least
+        recently used entries above the cache size limit. The types (original_type and type) of a volume staged with
+        a narrower type are kept along, for the cache hits to report them.
+        """
+        try:
+            size = os.path.getsize(source)
+            if size > self.max_size:
+                return
+            filename = os.path.join(self.get_cache_path(runs_path), key + '_' + os.path.basename(source))
+            _link_or_copy(source, filename)
+            with self.__lock:
+                # A node has a single up-to-date content, its other entries are stale.
+                for k in [k for k, e in self.__index.items() if e['node_id'] == node_id and k != key]:
+                    self.__remove(k)
+                self.__index[key] = {'filename': filename, 'fingerprint': fingerprint, 'node_id': node_id,
+                                     'types': types if types is not None else {}, 'size': size,
+                                     'last_access': time.time()}
+                total = sum([e['size'] for e in self.__index.values()])
+                for k in sorted(self.__index.keys(), key=lambda x: self.__index[x]['last_access']):
+                    if total <= self.max_size:
+                        break
+                    total -= self.__index[k]['size']
+                    self.__remove(k)
+        except Exception:
+            logging.warning("Staged volume could not be added to the cache.")
+            logging.debug(traceback.format_exc())
+
+    def invalidate(self, key: str = None) -> None:
+        """
+        Removes one entry, or the whole cache content if no key is given.
+        """
+        with self.__lock:
+            for k in [key] if key is not None else list(self.__index.keys()):
+                self.__remove(k)
+
+    def statistics(self) -> dict:
+        """
+        Return
+        ------
+        dict
+            Number of entries, size in bytes, and hits/misses over the session.
+        """
+        with self.__lock:
+            return {'entries': len(self.__index), 'size': sum([e['size'] for e in self.__index.values()]),
+                    'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+    def __remove(self, key: str) -> None:
+        entry = self.__index.pop(key, None)
+        if entry is not None and os.path.exists(entry['filename']):
+            try:
+                os.remove(entry['filename'])
+            except OSError:
+                logging.debug(traceback.format_exc())
+
+
+def _link_or_copy(src: str, dst: str) -> str:
+    # The staged volumes are only read by the backend, hard links avoid duplicating them when on the same device.
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
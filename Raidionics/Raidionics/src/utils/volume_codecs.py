@@ -0,0 +1,306 @@
+"""
+Encoding of the volumes exchanged with the backend (staged inputs, manually provided segmentations, outputs).
+
+The backend reads NIfTI only, the available transfer formats being:
+    * nii: uncompressed, the fastest to write and read but the largest on disk.
+    * nii.gz: single-threaded gzip, with a configurable compression level (1: fastest, 9: smallest).
+    * nii.gz-mt: multithreaded block gzip, the volume being compressed by blocks in parallel, each block being a
+      complete gzip member. The concatenated members form a regular gzip file, readable by any NIfTI reader.
+
+Before being written, a volume whose values are all integral (e.g., a float32 scan or label map) can be narrowed
+losslessly to uint8, int16 or uint16 (see find_lossless_dtype), for fewer bytes to compress and exchange.
+
+Usage, for benchmarking the formats on typical volumes (synthetic ones if no file is given), from <module_dir>:
+    python -m src.utils.volume_codecs [volume.nii.gz ...]
+"""
+import logging
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == '__main__' and __package__ in [None, '']:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from src.utils.resources import SharedResources
+
+TRANSFER_FORMATS = ['nii', 'nii.gz', 'nii.gz-mt']
+BLOCK_SIZE = 4 * 1024 * 1024
+# Lossless narrowing candidates, by order of preference, and voxels checked at once.
+NARROW_DTYPES = ['uint8', 'int16', 'uint16']
+NARROW_CHUNK_SIZE = 1024 * 1024
+
+
+def get_transfer_extension(transfer_format: str = None) -> str:
+    """
+    Return
+    ------
+    str
+        File extension of the volumes exchanged with the backend, for the given (or current) transfer format.
+    """
+    transfer_format = transfer_format if transfer_format is not None else \
+        SharedResources.getInstance().transfer_format
+    return '.nii' if transfer_format == 'nii' else '.nii.gz'
+
+
+def get_compression_threads() -> int:
+    threads = SharedResources.getInstance().transfer_compression_threads
+    return threads if threads > 0 else max(1, os.cpu_count() or 1)
+
+
+def write_volume(image, filename: str, transfer_format: str = None, compression_level: int = None) -> None:
+    """
+    Writes a SimpleITK image with the given (or current) transfer format, the filename extension being expected to
+    match (see get_transfer_extension).
+
+    Parameters
+    ----------
+    image: SimpleITK.Image
+        Volume to write.
+    filename: str
+        Destination file.
+    transfer_format: str
+        One of TRANSFER_FORMATS, the user setting if None.
+    compression_level: int
+        Gzip compression level between 1 and 9, the user setting if None.
+    """
+    import SimpleITK as sitk
+    transfer_format = transfer_format if transfer_format is not None else \
+        SharedResources.getInstance().transfer_format
+    compression_level = compression_level if compression_level is not None else \
+        SharedResources.getInstance().transfer_compression_level
+    if transfer_format == 'nii' or not filename.endswith('.gz'):
+        sitk.WriteImage(image, filename, False)
+        return
+    # The NIfTI writer of ITK ignores the compression level, the raw file is compressed with zlib instead.
+    raw_filename = filename[:-len('.gz')]
+    sitk.WriteImage(image, raw_filename, False)
+    try:
+        if transfer_format == 'nii.gz-mt':
+            gzip_file_multithreaded(raw_filename, filename, compression_level)
+        else:
+            with open(raw_filename, 'rb') as infile, open(filename, 'wb') as outfile:
+                write_gzip_stream(iter(lambda: infile.read(BLOCK_SIZE), b''), outfile, compression_level)
+    finally:
+        os.remove(raw_filename)
+
+
+def read_volume(filename: str):
+    """
+    Reads a volume written by the plugin or by the backend, whichever its transfer format.
+
+    Return
+    ------
+    SimpleITK.Image
+        Decoded volume.
+    """
+    import SimpleITK as sitk
+    return sitk.ReadImage(filename)
+
+
+def find_lossless_dtype(array, chunk_size: int = NARROW_CHUNK_SIZE):
+    """
+    Narrowest integer type among NARROW_DTYPES able to hold all the voxel values exactly. The values are checked by
+    chunks (vectorised integral and range checks, no full size temporary), stopping at the first chunk ruling the
+    narrowing out, e.g. the first one with a fractional value for a genuine float volume.
+
+    Parameters
+    ----------
+    array: numpy.ndarray
+        Voxels of a scalar volume.
+    chunk_size: int
+        Number of voxels checked at once.
+
+    Return
+    ------
+    numpy.dtype
+        Narrower type than the array one, or None if the array cannot be narrowed losslessly.
+    """
+    import numpy as np
+    if array.dtype.kind not in ['f', 'i', 'u'] or array.size == 0:
+        return None
+    candidates = [np.dtype(d) for d in NARROW_DTYPES if np.dtype(d).itemsize < array.dtype.itemsize]
+    if len(candidates) == 0:
+        return None
+    low_bound = min([np.iinfo(d).min for d in candidates])
+    high_bound = max([np.iinfo(d).max for d in candidates])
+    flat = array.reshape(-1)
+    low, high = None, None
+    for start in range(0, flat.size, chunk_size):
+        chunk = flat[start:start + chunk_size]
+        # NaN values fail the comparison, infinite ones the range check.
+        if array.dtype.kind == 'f' and not np.array_equal(np.trunc(chunk), chunk):
+            return None
+        chunk_low, chunk_high = chunk.min(), chunk.max()
+        low = chunk_low if low is None else min(low, chunk_low)
+        high = chunk_high if high is None else max(high, chunk_high)
+        if low < low_bound or high > high_bound or (low < 0 and high > np.iinfo(np.int16).max):
+            return None
+    for dtype in candidates:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return None
+
+
+def narrow_array(array) -> tuple:
+    """
+    Return
+    ------
+    tuple
+        The voxels converted to the narrowest lossless type (see find_lossless_dtype), or the array itself, and the
+        original type (None if not narrowed).
+    """
+    dtype = find_lossless_dtype(array)
+    if dtype is None:
+        return array, None
+    return array.astype(dtype), array.dtype
+
+
+def narrow_image(image) -> tuple:
+    """
+    SimpleITK counterpart of narrow_array, for scalar images.
+
+    Return
+    ------
+    tuple
+        The image cast to the narrowest lossless type, or the image itself, and the original pixel type ID (None if
+        not narrowed).
+    """
+    import SimpleITK as sitk
+    if image.GetNumberOfComponentsPerPixel() != 1:
+        return image, None
+    dtype = find_lossless_dtype(sitk.GetArrayViewFromImage(image))
+    if dtype is None:
+        return image, None
+    pixel_ids = {'uint8': sitk.sitkUInt8, 'int16': sitk.sitkInt16, 'uint16': sitk.sitkUInt16}
+    return sitk.Cast(image, pixel_ids[dtype.name]), image.GetPixelID()
+
+
+def gzip_file_multithreaded(source: str, destination: str, compression_level: int = 6, threads: int = None) -> None:
+    """
+    Compresses a file by blocks of BLOCK_SIZE bytes in parallel (zlib releases the GIL), each block becoming a complete
+    gzip member of the destination file.
+    """
+    with open(source, 'rb') as infile, open(destination, 'wb') as outfile:
+        write_gzip_members(iter(lambda: infile.read(BLOCK_SIZE), b''), outfile, compression_level, threads)
+
+
+def write_gzip_members(blocks, outfile, compression_level: int = 6, threads: int = None) -> None:
+    """
+    Compresses the blocks (bytes-like objects, e.g. memoryview slices) in parallel, and writes them in order as
+    successive gzip members.
+    """
+    threads = threads if threads is not None else get_compression_threads()
+
+    def compress(block):
+        compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 31)
+        return compressor.compress(block) + compressor.flush()
+
+    blocks = iter(blocks)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            # Bounded read-ahead, for the memory usage not to grow with the volume size.
+            chunk = [b for _, b in zip(range(threads * 2), blocks)]
+            if len(chunk) == 0:
+                return
+            for member in executor.map(compress, chunk):
+                outfile.write(member)
+
+
+def write_gzip_stream(blocks, outfile, compression_level: int = 6) -> None:
+    """
+    Compresses the blocks (bytes-like objects) as a single gzip member.
+    """
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 31)
+    for block in blocks:
+        outfile.write(compressor.compress(block))
+    outfile.write(compressor.flush())
+
+
+def benchmark_transfer_formats(images: list, compression_levels: list = None, repeats: int = 2) -> list:
+    """
+    Measures the writing (staging) and reading speed of each transfer format on the given volumes.
+
+    Parameters
+    ----------
+    images: list
+        SimpleITK images, e.g. typical inputs of the models.
+    compression_levels: list
+        Gzip levels to evaluate for the compressed formats.
+    repeats: int
+        Number of measurements for each format, the fastest being kept.
+
+    Return
+    ------
+    list
+        One dict per format and level, with the raw volumes size (MB), the encoded size (MB), the total staging and
+        reading times (s) over all the volumes, and the corresponding throughputs (MB/s of raw volume).
+    """
+    import tempfile
+    import SimpleITK as sitk
+    compression_levels = compression_levels if compression_levels is not None else [1, 6]
+    raw_mb = sum([x.GetNumberOfPixels() * x.GetNumberOfComponentsPerPixel() *
+                  sitk.GetArrayViewFromImage(x).itemsize for x in images]) / (1024. * 1024.)
+    candidates = [('nii', 0)] + [(f, level) for f in ['nii.gz', 'nii.gz-mt'] for level in compression_levels]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        for transfer_format, level in candidates:
+            write_time = read_time = float('inf')
+            encoded_mb = 0.
+            for _ in range(repeats):
+                filenames = [os.path.join(tmp_folder, 'volume{}{}'.format(i, get_transfer_extension(transfer_format)))
+                             for i in range(len(images))]
+                start = time.time()
+                for image, filename in zip(images, filenames):
+                    write_volume(image, filename, transfer_format, level)
+                write_time = min(write_time, time.time() - start)
+                encoded_mb = sum([os.path.getsize(f) for f in filenames]) / (1024. * 1024.)
+                start = time.time()
+                for filename in filenames:
+                    read_volume(filename)
+                read_time = min(read_time, time.time() - start)
+                for filename in filenames:
+                    os.remove(filename)
+            results.append({'format': transfer_format, 'level': level, 'raw_mb': raw_mb, 'encoded_mb': encoded_mb,
+                            'staging_time': write_time, 'reading_time': read_time,
+                            'write_mb_per_s': raw_mb / max(write_time, 1e-6),
+                            'read_mb_per_s': raw_mb / max(read_time, 1e-6)})
+    return results
+
+
+def create_typical_volumes() -> list:
+    """
+    Synthetic volumes of the typical sizes, i.e. a 256^3 MR scan and a 512x512x400 CT scan (int16), with a smooth
+    content and some noise for a realistic compression ratio.
+    """
+    import numpy as np
+    import SimpleITK as sitk
+    volumes = []
+    for shape in [(256, 256, 256), (400, 512, 512)]:
+        z, y, x = np.ogrid[0:shape[0], 0:shape[1], 0:shape[2]]
+        array = (1000. * np.exp(-(((z - shape[0] / 2.) / shape[0]) ** 2 + ((y - shape[1] / 2.) / shape[1]) ** 2 +
+                                  ((x - shape[2] / 2.) / shape[2]) ** 2) * 8.))
+        array = (array + np.random.normal(0., 20., shape)).astype(np.int16)
+        volumes.append(sitk.GetImageFromArray(array))
+    return volumes
+
+
+def main(argv=None) -> int:
+    import SimpleITK as sitk
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    # Only the settings used by the codecs, the plugin environment (downloaded lists, runtime data) being left alone.
+    SharedResources.getInstance().transfer_compression_threads = 0
+    argv = argv if argv is not None else []
+    images = [sitk.ReadImage(f) for f in argv] if len(argv) != 0 else create_typical_volumes()
+    logging.info("{:<10} {:>5} {:>9} {:>11} {:>10} {:>10} {:>9} {:>9}".format(
+        'format', 'level', 'raw (MB)', 'file (MB)', 'write (s)', 'read (s)', 'w (MB/s)', 'r (MB/s)'))
+    for r in benchmark_transfer_formats(images):
+        logging.info("{:<10} {:>5} {:>9.1f} {:>11.1f} {:>10.2f} {:>10.2f} {:>9.1f} {:>9.1f}".format(
+            r['format'], r['level'], r['raw_mb'], r['encoded_mb'], r['staging_time'], r['reading_time'],
+            r['write_mb_per_s'], r['read_mb_per_s']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,288 @@
+import datetime
+import logging
+import os
+import shutil
+import threading
+import traceback
+import uuid
+
+from src.utils.resources import SharedResources
+
+_active_run_ids = set()
+_active_run_ids_lock = threading.Lock()
+
+
+class RunWorkspace:
+    """
+    Isolated working directory for one run, identified by a unique run ID, containing its own data (inputs and
+    configuration) and output folders. The folder is mounted in the backend container at the same location whichever
+    the transport (warm worker or one-shot container), i.e. /workspace/resources/runs/<run_id>, or
+    /workspace/scratch/<run_id> for a workspace staged outside the resources folder (see get_scratch_runs_path). When
+    the backend runs natively or in-process, it reads the workspace and the resources at their host location instead.
+    """
+    docker_resources_path = '/workspace/resources'
+    docker_scratch_path = '/workspace/scratch'
+    pin_filename = '.pinned'
+
+    def __init__(self, run_id: str, runs_path: str = None):
+        self.run_id = run_id
+        self.runs_path = runs_path if runs_path is not None else SharedResources.getInstance().runs_path
+        self.path = os.path.join(self.runs_path, run_id)
+        self.execution_mode = SharedResources.getInstance().backend_execution_mode
+        self.native = self.execution_mode != 'docker'
+
+    @staticmethod
+    def create(runs_path: str = None):
+        """
+        Creates the folders of a new workspace, registered as active until released.
+
+        Return
+        ------
+        RunWorkspace
+            Newly created workspace, with a unique run ID starting with the creation timestamp.
+        """
+        run_id = datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        workspace = RunWorkspace(run_id, runs_path)
+        os.makedirs(workspace.data_path)
+        os.makedirs(workspace.output_path)
+        with _active_run_ids_lock:
+            _active_run_ids.add(run_id)
+        return workspace
+
+    @staticmethod
+    def open(run_id: str, runs_path: str = None):
+        """
+        Re-opens the workspace of a previous (possibly interrupted) run, registered as active until released.
+
+        Return
+        ------
+        RunWorkspace
+            Existing workspace with the given run ID, or None if its folders do not exist anymore.
+        """
+        workspace = RunWorkspace(run_id, runs_path)
+        if not os.path.isdir(workspace.data_path) or not os.path.isdir(workspace.output_path):
+            return None
+        with _active_run_ids_lock:
+            _active_run_ids.add(run_id)
+        return workspace
+
+    def pin(self) -> None:
+        """
+        Protects the workspace from garbage collection across sessions, e.g. for a queued job to be resumed later.
+        """
+        open(os.path.join(self.path, self.pin_filename), 'w').close()
+
+    def unpin(self) -> None:
+        if os.path.exists(os.path.join(self.path, self.pin_filename)):
+            os.remove(os.path.join(self.path, self.pin_filename))
+
+    def release(self) -> None:
+        """
+        Marks the workspace as inactive, making it eligible for garbage collection. The results are kept on disk.
+        """
+        with _active_run_ids_lock:
+            _active_run_ids.discard(self.run_id)
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.path, 'data')
+
+    @property
+    def output_path(self) -> str:
+        return os.path.join(self.path, 'output')
+
+    @property
+    def config_filename(self) -> str:
+        return os.path.join(self.data_path, 'rads_config.ini')
+
+    @property
+    def scratch(self) -> bool:
+        """
+        Whether the workspace lies outside the resources folder, e.g. in memory or on a local scratch disk.
+        """
+        return os.path.abspath(self.runs_path) != os.path.abspath(SharedResources.getInstance().runs_path)
+
+    @property
+    def container_resources_path(self) -> str:
+        """
+        Location of the resources folder (models, reporting pipelines), as seen by the backend.
+        """
+        return SharedResources.getInstance().resources_path if self.native else self.docker_resources_path
+
+    @property
+    def container_path(self) -> str:
+        if self.native:
+            return self.path
+        return self.docker_scratch_path + '/' + self.run_id if self.scratch else \
+            self.docker_resources_path + '/runs/' + self.run_id
+
+    @property
+    def container_data_path(self) -> str:
+        return self.container_path + '/data'
+
+    @property
+    def container_output_path(self) -> str:
+        return self.container_path + '/output'
+
+    @property
+    def container_config_filename(self) -> str:
+        return self.container_data_path + '/rads_config.ini'
+
+    def docker_volumes(self) -> list:
+        """
+        Volume mounts needed by a one-shot container: the shared models and reporting pipelines, and this workspace.
+        The models are always read from the model folder, wherever the workspace is staged.
+
+        Return
+        ------
+        list
+            Mounts in the CLI form <host_path>:<container_path>.
+        """
+        return [SharedResources.getInstance().model_path + ':' + self.docker_resources_path + '/models',
+                SharedResources.getInstance().diagnosis_path + ':' + self.docker_resources_path + '/reporting',
+                self.path + ':' + self.container_path]
+
+
+def get_scratch_runs_path(location: str = None, estimated_size: int = 0) -> str:
+    """
+    Location for the run workspaces, possibly on a faster storage than the resources folder (e.g., when the home
+    directory sits on network storage): in a memory-backed filesystem (/dev/shm), or in a user-chosen scratch folder.
+    The default runs folder is used instead when the location is not available, or when the free space (and, for a
+    memory-backed location, the available memory) would fall below the reserve once the run volumes are staged.
+
+    Parameters
+    ----------
+    location: str
+        One of default, memory or custom (SharedResources.scratch_path), the user setting if None.
+    estimated_size: int
+        Estimated size in bytes of the volumes exchanged with the backend for the run (inputs and outputs).
+
+    Return
+    ------
+    str
+        Runs folder to create the workspace in.
+    """
+    shared = SharedResources.getInstance()
+    location = location if location is not None else shared.scratch_location
+    if location == 'memory':
+        root = '/dev/shm'
+        runs_path = os.path.join(get_memory_scratch_path(), 'runs')
+    elif location == 'custom' and shared.scratch_path:
+        root = shared.scratch_path
+        runs_path = os.path.join(root, 'runs')
+    else:
+        return shared.runs_path
+    if not os.path.isdir(root) or not os.access(root, os.W_OK):
+        logging.info("Workspace location {} unavailable, using {}.".format(root, shared.runs_path))
+        return shared.runs_path
+    required = estimated_size + shared.scratch_reserve_mb * 1024 * 1024
+    available = shutil.disk_usage(root).free
+    if location == 'memory':
+        # The files in a memory-backed filesystem take up memory, until the workspace is collected. The staging cache
+        # created next to the runs folder can grow up to its size limit on top of that.
+        available = min(available, get_available_memory())
+        if shared.use_staging_cache:
+            cache_path = os.path.join(os.path.dirname(runs_path), 'staging_cache')
+            required += max(0, shared.staging_cache_max_size_mb * 1024 * 1024 - get_folder_size(cache_path))
+    if available < required:
+        logging.info("Not enough space in {} ({:.0f} MB available, {:.0f} MB required), using {}.".format(
+            root, available / (1024. * 1024.), required / (1024. * 1024.), shared.runs_path))
+        return shared.runs_path
+    try:
+        os.makedirs(runs_path, exist_ok=True)
+        return runs_path
+    except OSError:
+        logging.debug(traceback.format_exc())
+    return shared.runs_path
+
+
+def get_memory_scratch_path() -> str:
+    """
+    Folder of the user in the memory-backed filesystem, holding the memory runs folder and its staging cache.
+    """
+    return os.path.join('/dev/shm', 'raidionics-slicer-' + str(os.getuid()))
+
+
+def release_memory_scratch() -> None:
+    """
+    Deletes the inactive workspaces and the staging cache kept in the memory-backed filesystem, e.g. when the
+    application quits, for them not to hold on to memory afterwards.
+    """
+    scratch_path = get_memory_scratch_path()
+    if not os.path.isdir(scratch_path):
+        return
+    runs_path = os.path.join(scratch_path, 'runs')
+    collect_workspaces(runs_path=runs_path, keep=0)
+    shutil.rmtree(os.path.join(scratch_path, 'staging_cache'), ignore_errors=True)
+    for folder in [runs_path, scratch_path]:
+        try:
+            # Left as is if still holding an active workspace.
+            os.rmdir(folder)
+        except OSError:
+            pass
+
+
+def get_folder_size(path: str) -> int:
+    """
+    Total size in bytes of the files of a folder (0 if it does not exist).
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return size
+
+
+def get_available_memory() -> int:
+    """
+    Return
+    ------
+    int
+        Memory available for new allocations in bytes (MemAvailable on Linux), or 0 if unknown.
+    """
+    try:
+        with open('/proc/meminfo', 'r') as infile:
+            for line in infile:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        logging.debug(traceback.format_exc())
+    return 0
+
+
+def collect_workspaces(runs_path: str = None, keep: int = None) -> None:
+    """
+    Deletes the oldest inactive and unpinned workspaces, keeping only the `keep` most recent ones (by default, the
+    workspace retention, or the memory workspace retention for a runs folder in the memory-backed filesystem).
+    """
+    runs_path = runs_path if runs_path is not None else SharedResources.getInstance().runs_path
+    if keep is None:
+        keep = SharedResources.getInstance().workspace_retention
+        if os.path.abspath(runs_path).startswith(get_memory_scratch_path() + os.sep):
+            keep = min(keep, SharedResources.getInstance().memory_workspace_retention)
+    if not os.path.isdir(runs_path):
+        return
+    with _active_run_ids_lock:
+        active = set(_active_run_ids)
+    # The run IDs start with their creation timestamp, hence sorted chronologically.
+    candidates = sorted([d for d in os.listdir(runs_path) if os.path.isdir(os.path.join(runs_path, d))
+                         and d not in active
+                         and not os.path.exists(os.path.join(runs_path, d, RunWorkspace.pin_filename))])
+    for run_id in candidates[:max(0, len(candidates) - keep)]:
+        try:
+            shutil.rmtree(os.path.join(runs_path, run_id))
+        except Exception:
+            logging.warning("Workspace {} could not be deleted.".format(run_id))
+            logging.debug(traceback.format_exc())
+
+
+def collect_workspaces_async(runs_path: str = None, keep: int = None) -> threading.Thread:
+    """
+    Runs the workspaces garbage collection in a background thread, so that no run waits for old results deletion.
+    """
+    thread = threading.Thread(target=collect_workspaces, kwargs={'runs_path': runs_path, 'keep': keep}, daemon=True)
+    thread.start()
+    return thread